@@ -3,4 +3,10 @@ set -e
 
 python manage.py migrate
 python manage.py collectstatic
+# uploads are imported off the request path by the worker, restarted whenever it exits (the jobs it was running
+# are queued again once their heartbeat goes stale)
+while true; do
+    python manage.py import_worker || echo "import_worker exited with $?, restarting" >&2
+    sleep 5
+done &
 pipenv run gunicorn -t 120 -b 0.0.0.0:8000 nyc_data.wsgi
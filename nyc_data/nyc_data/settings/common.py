@@ -131,6 +131,29 @@ USE_TZ = True
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
+# Failed uploads are kept (gzipped, named by checksum) until they are fixed, so they can be downloaded and retried
+# from the admin. The web and worker dynos don't share a disk, so in production this should be a storage they can
+# both reach (e.g. `storages.backends.s3boto3.S3Boto3Storage`); unset, it is `DEFAULT_FILE_STORAGE`. The root is the
+# storage's `location`: a directory on disk, or a prefix in a bucket.
+FAILED_IMPORT_STORAGE = env("FAILED_IMPORT_STORAGE")
+FAILED_IMPORT_ROOT = env("FAILED_IMPORT_ROOT", os.path.join(BASE_DIR, "failed_imports"))
+
+# `manage.py prune_imports` keeps this many imports of each kind of file and dumps the rows of older ones to
+# IMPORT_ARCHIVE_STORAGE, gzipped, before deleting them. As with failed uploads, that should be a storage that
+# outlives the dyno in production.
+IMPORT_RETENTION = int(env("IMPORT_RETENTION", 10))
+IMPORT_ARCHIVE_STORAGE = env("IMPORT_ARCHIVE_STORAGE")
+IMPORT_ARCHIVE_ROOT = env("IMPORT_ARCHIVE_ROOT", os.path.join(BASE_DIR, "import_archive"))
+
+# `manage.py import_worker` records a heartbeat for the job it is importing every IMPORT_JOB_HEARTBEAT seconds. A
+# running job without one for IMPORT_JOB_STALE_AFTER seconds was left behind by a worker that died, and is queued
+# again.
+IMPORT_JOB_HEARTBEAT = int(env("IMPORT_JOB_HEARTBEAT", 30))
+IMPORT_JOB_STALE_AFTER = int(env("IMPORT_JOB_STALE_AFTER", 600))
+# Uploads `manage.py import_worker` imports at once, each in a process of its own (never more than one per kind of
+# file). Every one holds a whole file in memory while it is imported.
+IMPORT_WORKER_CONCURRENCY = int(env("IMPORT_WORKER_CONCURRENCY", 2))
+
 # Authentication config
 
 INSECURE_MODE = True if (os.environ.get("INSECURE_MODE",'') == "True" or DEBUG) else False
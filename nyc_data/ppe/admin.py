@@ -1,19 +1,38 @@
 from django.conf.urls import url
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import F, OuterRef, Subquery
 
 # Register your models here.
-from django.http import HttpResponse
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.template.defaultfilters import filesizeformat
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.html import format_html
 
-from ppe.models import FailedImport, DataImport
+from ppe import retention
+from ppe.errors import FailedImportFileMissing
+from ppe.models import FailedImport, DataImport, ApiToken, ImportJob, DataFileLockStats
 
 
-def retry_upload(_modeladmin, _request, queryset):
-    queryset.first().retry()
+def retry_upload(modeladmin, request, queryset):
+    jobs = [failed_import.queue_retry() for failed_import in queryset.order_by("uploaded_at")]
+    queued = [job for job in jobs if job is not None]
+    modeladmin.message_user(
+        request,
+        f"Queued {len(queued)} uploads to be retried by the import worker. "
+        f"Their outcome is shown in the \"last retry\" column.",
+    )
+    skipped = len(jobs) - len(queued)
+    if skipped:
+        modeladmin.message_user(
+            request,
+            f"Skipped {skipped} uploads that are already fixed or have a retry queued or running.",
+            messages.WARNING,
+        )
 
 
-retry_upload.short_description = "Retry a failed upload"
+retry_upload.short_description = "Retry the selected failed uploads"
 
 
 class FailedImportAdmin(admin.ModelAdmin):
@@ -24,9 +43,11 @@ class FailedImportAdmin(admin.ModelAdmin):
         "uploaded_by",
         "current_as_of",
         "fixed",
+        "last_retry",
         "download"
     )
-    readonly_fields = ('download',)
+    readonly_fields = ('download', 'errors')
+    exclude = ('error_report',)
 
     DOWNLOAD_NAME = 'ppe_failedimport_download'
 
@@ -39,8 +60,35 @@ class FailedImportAdmin(admin.ModelAdmin):
         ]
         return urls
 
+    def get_queryset(self, request):
+        latest_retry = ImportJob.objects.filter(failed_import=OuterRef("pk")).order_by("-created_at")
+        return super().get_queryset(request).annotate(
+            retry_status=Subquery(latest_retry.values("status")[:1]),
+            retry_error=Subquery(latest_retry.values("error")[:1]),
+            retry_duration=Subquery(
+                latest_retry.annotate(duration=F("finished_at") - F("started_at")).values("duration")[:1]
+            ),
+        )
+
+    def last_retry(self, obj):
+        if obj.retry_status is None:
+            return "-"
+        duration = f" in {obj.retry_duration.total_seconds():.1f}s" if obj.retry_duration else ""
+        return f"{obj.retry_status}{duration}{': ' + obj.retry_error if obj.retry_error else ''}"
+    last_retry.short_description = "Last retry"
+
+    def errors(self, obj):
+        if not (obj.error_report.get("errors") or obj.error_report.get("warnings")):
+            return "-"
+        # as on the verify page
+        return render_to_string("import_errors.html", dict(report=obj.error_report))
+    errors.short_description = "Errors"
+
     # custom "field" that returns a link to the custom function
     def download(self, obj):
+        if obj.fixed:
+            # the file is deleted once fixed
+            return "-"
         return format_html(
             '<a href="{}">Download file</a>',
             reverse(f'admin:{self.DOWNLOAD_NAME}', args=[obj.pk])
@@ -49,12 +97,18 @@ class FailedImportAdmin(admin.ModelAdmin):
 
     # add custom view function that downloads the file
     def download_file(self, request, pk):
-        response = HttpResponse(content_type='application/force-download')
-        obj: FailedImport = FailedImport.objects.get(id=pk)
-        response['Content-Disposition'] = f'attachment; filename="{obj.file_name}"'
-        # generate dynamic file content using object pk
-        response.write(obj.data)
-        return response
+        obj: FailedImport = get_object_or_404(FailedImport, id=pk, fixed=False)
+        try:
+            # streamed, decompressing as it goes
+            stored = obj.open()
+        except FailedImportFileMissing as ex:
+            raise Http404(str(ex))
+        return FileResponse(
+            stored,
+            as_attachment=True,
+            filename=obj.file_name,
+            content_type='application/force-download',
+        )
 
 
 class DataImportAdmin(admin.ModelAdmin):
@@ -64,9 +118,62 @@ class DataImportAdmin(admin.ModelAdmin):
         "current_as_of",
         "uploaded_by",
         "file_name",
+        "rows",
+        "size",
+        "archive",
     )
     ordering = ("status",)
 
+    def get_queryset(self, request):
+        # old imports are pruned by `manage.py prune_imports`
+        return retention.annotate_storage(super().get_queryset(request))
+
+    def rows(self, obj):
+        counts = retention.row_counts(obj)
+        if not counts:
+            return 0
+        return format_html(
+            '<span title="{}">{}</span>',
+            ", ".join(f"{model}: {count}" for model, count in counts.items()),
+            obj.rows,
+        )
+    rows.admin_order_field = "rows"
+
+    def size(self, obj):
+        return filesizeformat(obj.size)
+    size.admin_order_field = "size"
+    size.short_description = "Storage size (estimated)"
+
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    # tokens are created with `manage.py create_api_token`, which shows the key once
+    list_display = ("name", "user", "created_at", "last_used_at")
+    readonly_fields = ("key_hash", "created_at", "last_used_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
+class DataFileLockStatsAdmin(admin.ModelAdmin):
+    # live holders and waiters: `manage.py import_locks`
+    list_display = (
+        "data_file",
+        "operation",
+        "acquisitions",
+        "contended",
+        "wait_seconds",
+        "max_wait_seconds",
+        "last_contended_at",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 admin.site.register(FailedImport, FailedImportAdmin)
 admin.site.register(DataImport, DataImportAdmin)
+admin.site.register(ApiToken, ApiTokenAdmin)
+admin.site.register(DataFileLockStats, DataFileLockStatsAdmin)
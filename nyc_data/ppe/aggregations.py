@@ -15,7 +15,8 @@ import django_tables2 as tables
 import ppe.dataclasses as dc
 from ppe.dataclasses import Period, OrderType
 from ppe.models import (
-    ScheduledDelivery,
+    ActiveDelivery,
+    ActiveItemTotals,
     Inventory,
     FacilityDelivery,
     Demand,
@@ -112,11 +113,8 @@ class WeeklyRollup:
 def build_week_breakdown(rollup_fn, num_weeks: int, order_type: OrderType):
     start_date = datetime.date.today()
     end_date = start_date + datetime.timedelta(weeks=num_weeks)
-    relevant_deliveries = (
-        ScheduledDelivery.active()
-        .prefetch_related("purchase")
-        .filter(delivery_date__gte=start_date, delivery_date__lte=end_date)
-        .filter(purchase__order_type=order_type)
+    relevant_deliveries = ActiveDelivery.objects.filter(
+        delivery_date__gte=start_date, delivery_date__lte=end_date, order_type=order_type
     )
 
     broken_down = collections.defaultdict(list)
@@ -215,38 +213,27 @@ def asset_rollup(
     demand_calculation_config: DemandCalculationConfig,
 ) -> Dict[str, AssetRollup]:
     time_start, time_end = time_range.start, time_range.end
-    relevant_deliveries = (
-        ScheduledDelivery.active()
-        .prefetch_related("purchase")
-        .filter(delivery_date__gte=time_start, delivery_date__lte=time_end)
-    )
-
-    relevant_donations = Purchase.active().filter(order_type=OrderType.Donation)
-
+    relevant_deliveries = ActiveDelivery.objects.filter(
+        delivery_date__gte=time_start, delivery_date__lte=time_end
+    ).exclude(order_type=OrderType.Donation)
 
     results: Dict[dc.Item, AssetRollup] = {}
     for _, item in dc.Item.__members__.items():
         results[item] = AssetRollup(asset=item, total_cols=supply_cols)
 
     for delivery in relevant_deliveries:
-        rollup = results[delivery.purchase.item]
-        tpe = delivery.purchase.order_type
-
-        if tpe != dc.OrderType.Donation:
-            param = MAPPING.get(tpe)
-
-            if param is None:
-                raise Exception(f"unexpected purchase type: `{tpe}`")
-            setattr(rollup, param, getattr(rollup, param) + delivery.quantity)
-
-    for donation in relevant_donations:
-        rollup = results[donation.item]
-        rollup.donated += donation.quantity - donation.received_quantity
-
-    inventory = Inventory.active()
-    for item in inventory:
-        rollup = results[item.item]
-        rollup.inventory += item.quantity
+        rollup = results[delivery.item]
+        tpe = delivery.order_type
+
+        param = MAPPING.get(tpe)
+        if param is None:
+            raise Exception(f"unexpected purchase type: `{tpe}`")
+        setattr(rollup, param, getattr(rollup, param) + delivery.quantity)
+
+    for totals in ActiveItemTotals.objects.all():
+        rollup = results[totals.item]
+        rollup.donated += totals.donated
+        rollup.inventory += totals.inventory
 
     add_demand_estimate(time_start, time_end, results, demand_calculation_config)
 
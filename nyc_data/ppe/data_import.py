@@ -1,11 +1,20 @@
 import hashlib
+import logging
+import multiprocessing
+import os
 import tempfile
-from datetime import date
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 
 import sentry_sdk
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
 
 import xlsx_utils
 from ppe import edc_po_tracker
@@ -20,12 +29,26 @@ from ppe.data_mapping.mappers import (
 from ppe.data_mapping.types import DataFile
 from ppe.data_mapping.utils import ErrorCollector
 from ppe.errors import (
-    DataImportError,
     NoMappingForFileError,
     ImportInProgressError,
+    ImportNotCandidate,
+    describe_upload_error,
 )
-from ppe.models import ImportStatus, DataImport, FacilityDelivery, FailedImport
-from xlsx_utils import import_xlsx
+from ppe.models import (
+    ImportStatus,
+    ImportJob,
+    ImportJobStatus,
+    DataImport,
+    FacilityDelivery,
+    FailedImport,
+    RawRow,
+    RawDataModel,
+)
+from ppe.locks import data_file_lock
+from ppe.signals import data_import_finalized
+from xlsx_utils import import_xlsx_numbered
+
+logger = logging.getLogger(__name__)
 
 ALL_MAPPINGS = [
     edc_po_tracker.EDC_PO_TRACKER,
@@ -36,32 +59,145 @@ ALL_MAPPINGS = [
     hospital_demands.WEEKLY_DEMANDS,
     donations.DONATION_DATA,
 ]
+# how `guess_mapping` looks files up, built once
+MAPPING_INDEX = xlsx_utils.MappingIndex(ALL_MAPPINGS)
+
+
+# how often (in rows) to record progress while writing objects
+PROGRESS_INTERVAL = 500
+CHECKSUM_CHUNK_SIZE = 64 * 1024
+
+
+def enqueue_upload(
+    f, current_as_of: date, user: User, append: bool = True
+) -> ImportJob:
+    """
+    Queue an upload to be imported by `manage.py import_worker`
+    :param append: see `import_data`
+    """
+    job = ImportJob(
+        data=b"".join(f.chunks()),
+        file_name=f.name,
+        uploaded_by=user,
+        current_as_of=current_as_of,
+        append=append,
+    )
+    job.save()
+    return job
+
+
+def run_import_job(job: ImportJob):
+    error_collector = ErrorCollector()
+    try:
+        if job.failed_import_id is not None:
+            # already stored as a FailedImport, left as is if the retry fails too
+            job.data_import = job.failed_import.retry(
+                import_job=job, error_collector=error_collector
+            )
+        else:
+            job.data_import = handle_upload(
+                f=ContentFile(job.data, name=job.file_name),
+                current_as_of=job.current_as_of,
+                user=job.uploaded_by,
+                import_job=job,
+                append=job.append,
+                error_collector=error_collector,
+            )
+        finish_import_job(job, ImportJobStatus.done)
+    except Exception as ex:
+        fail_import_job(job, ex, error_collector.report())
+
 
+def fail_import_job(job: ImportJob, ex: Exception, error_report: Optional[dict] = None):
+    job.error = describe_upload_error(ex)
+    if error_report is not None:
+        job.error_report = error_report
+    if isinstance(ex, ImportInProgressError):
+        job.import_in_progress = ex.import_id
+    finish_import_job(job, ImportJobStatus.failed)
 
-def handle_upload(f, current_as_of: date, user: User) -> DataImport:
-    with tempfile.NamedTemporaryFile(
-        "w+b", delete=False, suffix=f.name
-    ) as upload_target:
+
+def finish_import_job(job: ImportJob, status: ImportJobStatus):
+    job.status = status
+    job.finished_at = timezone.now()
+    # imported, or kept as a FailedImport if it failed: no need for another copy here
+    job.data = b""
+    job.save()
+    if job.failed_import_id is not None:
+        # kept while the retry ran, even if it fixed the upload (see
+        # `FailedImport.discard_file`)
+        job.failed_import.discard_file()
+
+
+def handle_upload(
+    f,
+    current_as_of: date,
+    user: User,
+    import_job: Optional[ImportJob] = None,
+    append: bool = True,
+    error_collector: Optional[ErrorCollector] = None,
+) -> DataImport:
+    """
+    :param error_collector: see `import_data`; what it collected is kept with the
+    `FailedImport` if the import fails
+    """
+    if error_collector is None:
+        error_collector = ErrorCollector()
+    # spool the upload to disk once, hashing it on the way; parsing and failure capture
+    # both reuse that file
+    checksum = hashlib.sha256()
+    with tempfile.NamedTemporaryFile("w+b", suffix=f.name) as upload_target:
         for chunk in f.chunks():
+            checksum.update(chunk)
             upload_target.write(chunk)
         upload_target.flush()
         try:
-            return smart_import(Path(upload_target.name), user.email, current_as_of)
+            return smart_import(
+                Path(upload_target.name),
+                user.email,
+                current_as_of,
+                checksum=checksum.hexdigest(),
+                import_job=import_job,
+                append=append,
+                error_collector=error_collector,
+            )
         except Exception as ex:
             # Capture all upload errors -- we will never 500 the UI
             sentry_sdk.capture_message("Failed upload (see exception)")
             sentry_sdk.capture_exception(ex)
-            # reset back to beginning so we can read the file into the DB
-            upload_target.seek(0)
-            FailedImport(
-                data=upload_target.read(),
+            FailedImport.store(
+                upload_target,
+                checksum.hexdigest(),
                 file_name=f.name,
                 uploaded_by=user,
                 current_as_of=current_as_of,
-            ).save()
+                error_report=error_collector.report(),
+            )
             raise
 
 
+def file_checksum(path: Path) -> str:
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def job_data_file(job: ImportJob) -> Optional[DataFile]:
+    """
+    The kind of file a job imports, or None if it doesn't match any mapping or can't be
+    read (e.g. the stored file of a retry is gone): the job then fails as soon as it
+    runs, with the usual error
+    """
+    try:
+        with job.local_copy() as path:
+            mappings = xlsx_utils.guess_mapping(path, MAPPING_INDEX)
+    except Exception:
+        return None
+    return mappings[0].data_file if mappings else None
+
+
 def import_in_progress(data_file: DataFile):
     return DataImport.objects.filter(data_file=data_file, status=ImportStatus.candidate)
 
@@ -72,10 +208,23 @@ def smart_import(
     current_as_of: date,
     overwrite_in_prog: bool = False,
     user_provided_name: Optional[str] = None,
-) -> DataImport:
-    possible_mappings = xlsx_utils.guess_mapping(path, ALL_MAPPINGS)
-    if len(possible_mappings) == 0:
+    checksum: Optional[str] = None,
+    import_job: Optional[ImportJob] = None,
+    dry_run: bool = False,
+    append: bool = True,
+    error_collector: Optional[ErrorCollector] = None,
+) -> Union[DataImport, "DryRunReport"]:
+    """
+    :param dry_run: only parse, map and generate the objects the file would import,
+    without touching the DB, and return a `DryRunReport` instead of a `DataImport`
+    :param append: see `import_data`
+    :param error_collector: see `import_data`
+    """
+    possible_mappings = xlsx_utils.guess_mapping(path, MAPPING_INDEX)
+    if not possible_mappings:
         raise NoMappingForFileError()
+    if dry_run:
+        return dry_run_import(path, possible_mappings)
     return import_data(
         path,
         possible_mappings,
@@ -83,6 +232,60 @@ def smart_import(
         uploaded_by=uploader_name,
         overwrite_in_prog=overwrite_in_prog,
         user_provided_filename=user_provided_name,
+        checksum=checksum,
+        import_job=import_job,
+        append=append,
+        error_collector=error_collector,
+    )
+
+
+class DryRunReport(NamedTuple):
+    data_file: DataFile
+    rows: int
+    object_counts: Dict[str, int]
+    error_collector: ErrorCollector
+    seconds: float
+
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+    def display(self):
+        counts = ", ".join(
+            f"{count} {model}" for model, count in sorted(self.object_counts.items())
+        )
+        return (
+            f"{self.data_file.name}: {self.rows} rows -> {counts or 'no objects'}. "
+            f"{self.error_collector!r}. "
+            f"{self.seconds:.2f}s ({self.rows_per_second():.0f} rows/s)"
+        )
+
+
+def dry_run_import(
+    path: Path,
+    mappings: List[xlsx_utils.SheetMapping],
+    parsed: Optional[List["ParsedSheet"]] = None,
+) -> DryRunReport:
+    """
+    Everything `import_data` does short of writing to the database
+    :param parsed: see `import_data`
+    """
+    start = time.perf_counter()
+    error_collector = ErrorCollector()
+    rows = 0
+    object_counts = Counter()
+    if parsed is None:
+        parsed = parse_sheets(path, mappings)
+    for sheet in parsed:
+        error_collector.extend(sheet.errors)
+        rows += len(sheet.rows)
+        for objs in generate_objects(sheet, error_collector):
+            object_counts.update(type(obj).__name__ for obj in objs)
+    return DryRunReport(
+        data_file=mappings[0].data_file,
+        rows=rows,
+        object_counts=dict(object_counts),
+        error_collector=error_collector,
+        seconds=time.perf_counter() - start,
     )
 
 
@@ -93,14 +296,82 @@ def import_data(
     user_provided_filename: Optional[str],
     uploaded_by: Optional[str] = None,
     overwrite_in_prog=False,
+    checksum: Optional[str] = None,
+    import_job: Optional[ImportJob] = None,
+    append: bool = True,
+    parsed: Optional[List["ParsedSheet"]] = None,
+    error_collector: Optional[ErrorCollector] = None,
 ):
-    error_collector = ErrorCollector()
+    """
+    :param append: for time-series files, only import the dates the active import
+    doesn't have yet and carry its rows forward (pass False to re-import the whole file,
+    e.g. after history was corrected)
+    :param parsed: the result of `parse_sheets(path, mappings)`, if it was already run
+    elsewhere (e.g. in a worker process)
+    :param error_collector: collects the errors of the import, if the caller wants to
+    see them afterwards
+    """
+    if error_collector is None:
+        error_collector = ErrorCollector()
     data_file = {mapping.data_file for mapping in mappings}
     if len(data_file) != 1:
         raise ImportError(
             "Something is wrong, can't import from two different files..."
         )
     data_file = mappings[0].data_file
+    if checksum is None:
+        checksum = file_checksum(path)
+
+    # one import of each kind of file at a time, across every worker
+    with data_file_lock(data_file, "import"):
+        return _import_data_locked(
+            path,
+            mappings,
+            data_file,
+            current_as_of,
+            user_provided_filename,
+            uploaded_by,
+            overwrite_in_prog,
+            checksum,
+            import_job,
+            append,
+            parsed,
+            error_collector,
+        )
+
+
+def _import_data_locked(
+    path: Path,
+    mappings: List[xlsx_utils.SheetMapping],
+    data_file: DataFile,
+    current_as_of: date,
+    user_provided_filename: Optional[str],
+    uploaded_by: Optional[str],
+    overwrite_in_prog: bool,
+    checksum: str,
+    import_job: Optional[ImportJob],
+    append: bool,
+    parsed: Optional[List["ParsedSheet"]],
+    error_collector: ErrorCollector,
+):
+    """
+    `import_data`, once it holds the lock of `data_file`
+    """
+    # an identical file is either already live or awaiting verification: send the
+    # uploader there instead
+    duplicate = find_duplicate_import(data_file, checksum)
+    if duplicate is not None and duplicate.status in (
+        ImportStatus.active,
+        ImportStatus.candidate,
+    ):
+        logger.info(
+            "%s was already imported as %s (%s)",
+            path.name,
+            duplicate.id,
+            duplicate.status,
+        )
+        return link_import_job(import_job, duplicate)
+
     in_progress = import_in_progress(data_file)
 
     if in_progress.count() > 0:
@@ -109,8 +380,17 @@ def import_data(
         else:
             raise ImportInProgressError(in_progress.first().id)
 
-    with open(path, "rb") as f:
-        checksum = hashlib.sha256(f.read())
+    if duplicate is not None:
+        # the rows of a replaced or cancelled import are still there, so it can be
+        # verified again as-is
+        logger.info(
+            "%s was already imported as %s, offering to reactivate it",
+            path.name,
+            duplicate.id,
+        )
+        duplicate.status = ImportStatus.candidate
+        duplicate.save(update_fields=["status"])
+        return link_import_job(import_job, duplicate)
 
     uploaded_by = uploaded_by or ""
     data_import = DataImport(
@@ -122,44 +402,286 @@ def import_data(
         file_name=user_provided_filename or path.name,
     )
     data_import.save()
+    link_import_job(import_job, data_import)
+
+    base = append_base(data_file, mappings) if append else None
+    if base is not None:
+        data_import.carried_forward.set(base.sources())
 
-    for mapping in mappings:
+    try:
+        data_import.record_progress(
+            current_sheet=", ".join(sheet_label(path, mapping) for mapping in mappings)
+        )
+        if parsed is None:
+            parsed = parse_sheets(path, mappings)
+        data_import.record_progress(
+            rows_parsed=sum(len(sheet.rows) for sheet in parsed)
+        )
+        if base is not None:
+            parsed = [
+                new_series_rows(mapping, sheet, base)
+                for mapping, sheet in zip(mappings, parsed)
+            ]
+
+        sheet_objects = []
+        for sheet in parsed:
+            error_collector.extend(sheet.errors)
+            sheet_objects.append(generate_objects(sheet, error_collector))
+        # not in the transaction below, which would keep the tables the partitions refer
+        # to locked
+        data_import.create_partitions(
+            {
+                type(obj)
+                for row_objects in sheet_objects
+                for objs in row_objects
+                for obj in objs
+            }
+        )
+
+        # every sheet of the file is written, or none of them are
+        with data_import.progress_outside_transaction(), transaction.atomic():
+            for sheet, row_objects in zip(parsed, sheet_objects):
+                data_import.record_progress(current_sheet=sheet.sheet)
+                write_objects(
+                    data_import, row_objects, error_collector, sheet.row_numbers
+                )
+    except Exception:
+        # nothing was written: don't leave an empty import behind for a retry of the
+        # file to be matched against
+        link_import_job(import_job, None)
         try:
-            data = import_xlsx(path, mapping, error_collector)
-            data = list(data)
-            # there are a lot of deliveries, pull them out for bulk import
-            deliveries = []
-            for item in data:
-                try:
-                    for obj in item.to_objects(error_collector):
-                        obj.source = data_import
-                        if isinstance(obj, FacilityDelivery):
-                            deliveries.append(obj)
-                        else:
-                            obj.save()
-                except Exception as ex:
-                    error_collector.report_error(
-                        f"Failure importing row. This is a bug: {ex}"
-                    )
-                    sentry_sdk.capture_exception(ex)
-
-            FacilityDelivery.objects.bulk_create(deliveries)
-
-        except Exception:
-            print(f"Failure importing {path}, mapping: {mapping.sheet_name}")
-            raise
+            data_import.delete()
+        except Exception as ex:
+            # the import's own error is the one to report
+            sentry_sdk.capture_exception(ex)
+        raise
 
+    data_import.error_report = error_collector.report()
+    # the progress as of the end of the write, now that the rows it counts are committed
+    data_import.save(update_fields=["error_report", "current_sheet", "rows_written"])
     print(f"Errors: ")
     error_collector.dump()
     return data_import
 
 
-def finalize_import(data_import: DataImport):
-    current_active = DataImport.objects.filter(
-        data_file=data_import.data_file, status=ImportStatus.active
+def find_duplicate_import(data_file: DataFile, checksum: str) -> Optional[DataImport]:
+    """
+    A previous import of the exact same file, preferring one that is active or awaiting
+    verification. Archived imports don't count: their rows are gone.
+    """
+    imports = DataImport.objects.filter(
+        data_file=data_file, file_checksum=checksum
+    ).exclude(status=ImportStatus.archived)
+    return (
+        imports.filter(status__in=[ImportStatus.active, ImportStatus.candidate]).first()
+        or imports.order_by("-import_date").first()
     )
-    if current_active.count() > 1:
-        raise DataImportError("Multiple active imports")
-    current_active.update(status=ImportStatus.replaced)
-    data_import.status = ImportStatus.active
-    data_import.save()
+
+
+def link_import_job(import_job: Optional[ImportJob], data_import: Optional[DataImport]):
+    if import_job is not None:
+        import_job.data_import = data_import
+        import_job.save(update_fields=["data_import"])
+    return data_import
+
+
+def append_base(
+    data_file: DataFile, mappings: List[xlsx_utils.SheetMapping]
+) -> Optional[DataImport]:
+    """
+    The import a time-series file can be appended to: the active one, if every sheet of
+    the file is a time series
+    """
+    if not all(mapping.time_series for mapping in mappings):
+        return None
+    return DataImport.objects.filter(
+        data_file=data_file, status=ImportStatus.active
+    ).first()
+
+
+def new_series_rows(
+    mapping: xlsx_utils.SheetMapping, sheet: "ParsedSheet", base: DataImport
+) -> "ParsedSheet":
+    """
+    The rows of a time-series sheet for dates that `base` (or what it carries forward)
+    doesn't have
+    """
+    series = mapping.time_series
+    known_dates = set(
+        series.model.objects.filter(source__in=base.sources())
+        .values_list(series.model_date, flat=True)
+        .distinct()
+    )
+    new_rows = [
+        (row, row_number)
+        for row, row_number in zip(sheet.rows, sheet.row_numbers)
+        if as_date(getattr(row, series.row_date)) not in known_dates
+    ]
+    logger.info(
+        "%s: %s rows already imported by %s, importing %s",
+        sheet.sheet,
+        len(sheet.rows) - len(new_rows),
+        base.id,
+        len(new_rows),
+    )
+    return sheet._replace(
+        rows=[row for row, _ in new_rows],
+        row_numbers=[row_number for _, row_number in new_rows],
+    )
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def sheet_label(path: Path, mapping: xlsx_utils.SheetMapping):
+    return str(mapping.sheet_name or path.name)
+
+
+class ParsedSheet(NamedTuple):
+    sheet: str
+    rows: list
+    # spreadsheet row number of each of `rows`
+    row_numbers: List[int]
+    errors: ErrorCollector
+
+
+def parse_sheet(path: Path, mapping: xlsx_utils.SheetMapping) -> ParsedSheet:
+    """
+    Load and map one sheet into `ImportedRow`s. This runs in a worker process when a
+    file has several sheets, so it must not touch the database.
+    """
+    error_collector = ErrorCollector()
+    error_collector.sheet = sheet_label(path, mapping)
+    try:
+        numbered = list(import_xlsx_numbered(path, mapping, error_collector))
+    except Exception:
+        print(f"Failure importing {path}, mapping: {mapping.sheet_name}")
+        raise
+    return ParsedSheet(
+        sheet=error_collector.sheet,
+        rows=[row for _, row in numbered],
+        row_numbers=[row_number for row_number, _ in numbered],
+        errors=error_collector,
+    )
+
+
+def parse_sheets(path: Path, mappings: List[xlsx_utils.SheetMapping]):
+    """
+    `parse_sheet` for every mapping, in parallel when there is more than one (and more
+    than one core). Rows come back from the workers as `ImportedRow`s -- pickling the
+    (many more) model objects they generate costs more than generating them, so
+    `to_objects()` runs in the calling process.
+    """
+    workers = min(len(mappings), os.cpu_count() or 1)
+    if workers == 1:
+        return [parse_sheet(path, mapping) for mapping in mappings]
+    # fork so workers inherit the imported mappers instead of setting Django up again
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+    ) as pool:
+        return list(pool.map(parse_sheet, [path] * len(mappings), mappings))
+
+
+def generate_objects(sheet: ParsedSheet, error_collector: ErrorCollector):
+    """
+    :return: the objects generated by each row of `sheet` (empty for rows that failed)
+    """
+    error_collector.sheet = sheet.sheet
+    row_objects = []
+    for item, row_number in zip(sheet.rows, sheet.row_numbers):
+        error_collector.row = row_number
+        try:
+            row_objects.append(item.to_objects(error_collector))
+        except Exception as ex:
+            report_row_failure(ex, error_collector)
+            row_objects.append([])
+    error_collector.row = None
+    return row_objects
+
+
+def write_objects(
+    data_import: DataImport,
+    row_objects,
+    error_collector: ErrorCollector,
+    row_numbers: Optional[List[int]] = None,
+):
+    # fan-out rows share a raw row -- store each distinct one once, up front
+    RawRow.save_all(
+        obj.raw_row
+        for objs in row_objects
+        for obj in objs
+        if isinstance(obj, RawDataModel) and obj.raw_row is not None
+    )
+
+    # there are a lot of deliveries, pull them out for bulk import
+    deliveries = []
+    rows_written = data_import.rows_written
+    for i, objs in enumerate(row_objects):
+        try:
+            # a savepoint, so a bad row doesn't abort the whole file's transaction
+            with transaction.atomic():
+                row_deliveries = []
+                for obj in objs:
+                    obj.source = data_import
+                    if isinstance(obj, FacilityDelivery):
+                        # bulk_create doesn't call save()
+                        obj.set_fingerprint()
+                        row_deliveries.append(obj)
+                    else:
+                        obj.save()
+            deliveries += row_deliveries
+            rows_written += len(objs) - len(row_deliveries)
+        except Exception as ex:
+            error_collector.row = row_numbers[i] if row_numbers else None
+            report_row_failure(ex, error_collector)
+        if i % PROGRESS_INTERVAL == 0:
+            data_import.record_progress(rows_written=rows_written)
+
+    error_collector.row = None
+    FacilityDelivery.objects.bulk_create(deliveries)
+    data_import.record_progress(rows_written=rows_written + len(deliveries))
+
+
+def report_row_failure(ex: Exception, error_collector: ErrorCollector):
+    error_collector.report_error("Failure importing row. This is a bug: {}", ex)
+    sentry_sdk.capture_exception(ex)
+
+
+def finalize_import(data_import: DataImport, lock_timeout: Optional[float] = None):
+    """
+    Make `data_import` the active import of its data file.
+
+    The previous import is replaced and this one activated in a single transaction, so
+    readers see either the old generation or the new one -- never none or both (which
+    `one_active_import_per_data_file` enforces). `data_import_finalized` is sent once
+    that transaction has committed. The transaction is short, but not constant: it flags
+    the rows of both generations (see `DataImport.sync_active_rows`).
+
+    Raises `ImportNotCandidate` if the import was replaced, cancelled or archived before
+    the lock was ours (an import that is already active is left as it is).
+    :param lock_timeout: see `data_file_lock`
+    """
+    with data_file_lock(
+        data_import.data_file, "finalize", timeout=lock_timeout
+    ), transaction.atomic():
+        # whoever held the lock may have replaced it meanwhile (e.g. an upload with
+        # `overwrite_in_prog`)
+        data_import.refresh_from_db()
+        if data_import.status == ImportStatus.active:
+            return
+        if data_import.status != ImportStatus.candidate:
+            raise ImportNotCandidate(data_import.id, data_import.status)
+        # demote first: the unique index is checked row by row
+        DataImport.objects.filter(
+            data_file=data_import.data_file, status=ImportStatus.active
+        ).exclude(id=data_import.id).update(status=ImportStatus.replaced)
+        data_import.status = ImportStatus.active
+        # also flags the rows of the new generation active, and those of the old one not
+        # (see `is_active`)
+        data_import.save(update_fields=["status"])
+        transaction.on_commit(
+            lambda: data_import_finalized.send(
+                sender=DataImport, data_import=data_import
+            )
+        )
@@ -42,8 +42,11 @@ class SourcingRow(ImportedRow, NamedTuple):
         # lots of data doesn't have delivery dates.
         if delivered_quantity > self.quantity:
             error_collector.report_warning(
-                f"Claimed delivered quantity ({delivered_quantity}) > "
-                f"total quantity {self.quantity} for {self.item} from {self.vendor}"
+                "Claimed delivered quantity ({}) > total quantity {} for {} from {}",
+                delivered_quantity,
+                self.quantity,
+                self.item,
+                self.vendor,
             )
         # if delivered_quantity < self.quantity:
         #    errors.append(f'Delivery < total {delivered_quantity} < {self.quantity}')
@@ -58,7 +61,7 @@ class SourcingRow(ImportedRow, NamedTuple):
         errors = self.sanity(error_collector)
         if errors:
             error_collector.report_error(
-                f"Refusing to generate a data model for: {self}. Errors: {errors}"
+                "Refusing to generate a data model for: {}. Errors: {}", self, errors
             )
             return []
         purchase = models.Purchase(
@@ -78,7 +81,7 @@ class SourcingRow(ImportedRow, NamedTuple):
                 if quantity is None:
                     quantity = self.quantity - total
                     error_collector.report_warning(
-                        f"Assuming that a null quantity means a full delivery for {self}"
+                        "Assuming that a null quantity means a full delivery for {}", self
                     )
                 deliveries.append(
                     models.ScheduledDelivery(
@@ -42,7 +42,7 @@ class VentilatorRow(ImportedRow, NamedTuple):
             item = Item.ventilators_non_full_service
         else:
             error_collector.report_error(
-                f"Unknown ventilator type: {self.functionality}"
+                "Unknown ventilator type: {}", self.functionality
             )
             return []
 
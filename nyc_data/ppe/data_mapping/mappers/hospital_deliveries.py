@@ -5,7 +5,7 @@ from ppe.data_mapping.types import DataFile, ImportedRow
 from ppe.data_mapping.utils import parse_int_or_zero, parse_date, ErrorCollector
 from ppe.dataclasses import Item
 from ppe.models import FacilityDelivery, Facility
-from xlsx_utils import SheetMapping, Mapping
+from xlsx_utils import SheetMapping, Mapping, TimeSeries
 
 
 class DeliveryRow(ImportedRow):
@@ -67,4 +67,5 @@ FACILITY_DELIVERIES = SheetMapping(
     },
     obj_constructor=DeliveryRow,
     include_raw=True,
+    time_series=TimeSeries(row_date="date", model=FacilityDelivery, model_date="date"),
 )
@@ -6,7 +6,7 @@ from ppe.data_mapping.utils import (
     parse_int_or_zero,
 )
 from ppe.models import Inventory
-from xlsx_utils import SheetMapping, Mapping
+from xlsx_utils import SheetMapping, Mapping, TimeSeries
 
 
 class InventoryRow(ImportedRow):
@@ -50,4 +50,5 @@ INVENTORY = SheetMapping(
     },
     include_raw=True,
     obj_constructor=InventoryRow,
+    time_series=TimeSeries(row_date="date", model=Inventory, model_date="as_of"),
 )
@@ -3,26 +3,165 @@ from datetime import datetime
 from ppe.dataclasses import Item
 
 
+class ReportedError:
+    """
+    Every report of one message template: how often it happened, and a sample of the messages,
+    (spreadsheet) row numbers and sheets involved
+    """
+
+    __slots__ = ("level", "template", "count", "messages", "rows", "sheets")
+
+    def __init__(self, level: str, template: str):
+        self.level = level
+        self.template = template
+        self.count = 0
+        self.messages = []
+        self.rows = []
+        self.sheets = []
+
+    def add(self, count: int, messages, rows, sheets):
+        self.count += count
+        _sample(self.messages, messages)
+        _sample(self.rows, rows)
+        _sample(self.sheets, sheets)
+
+    def as_dict(self):
+        return dict(
+            template=self.template,
+            count=self.count,
+            messages=self.messages,
+            rows=self.rows,
+            sheets=self.sheets,
+        )
+
+    def __str__(self):
+        where = ", ".join(
+            part
+            for part in [
+                self.sheets and f"sheets: {', '.join(map(str, self.sheets))}",
+                self.rows and f"rows: {', '.join(map(str, self.rows))}",
+            ]
+            if part
+        )
+        examples = self.messages if self.messages != [self.template] else []
+        return (
+            f"[{self.level}] {self.template} (x{self.count}{'; ' + where if where else ''})"
+            + "".join(f"\n    {message}" for message in examples)
+        )
+
+
+# at most this many messages, rows and sheets are kept per template
+SAMPLE_SIZE = 10
+# at most this many templates are kept, reports of any others are only counted
+MAX_TEMPLATES = 100
+
+
+def _sample(sample: list, values):
+    for value in values:
+        if len(sample) >= SAMPLE_SIZE:
+            return
+        if value not in sample:
+            sample.append(value)
+
+
 class ErrorCollector:
+    """
+    Errors and warnings of an import, aggregated by message template so memory stays bounded however many
+    rows report them. `sheet` and `row` are the spreadsheet location that reports are attributed to.
+
+    Report with a template and its arguments, e.g. `report_warning("Unknown type: {}", asset_name)`, so that the
+    same problem with different values is counted together.
+    """
+
+    ERROR = "error"
+    WARNING = "warning"
+
     def __init__(self):
-        self.errors = []
-        self.warnings = []
+        self.reported = {}
+        self.dropped = 0
+        self.sheet = None
+        self.row = None
 
     def __len__(self):
-        return len(self.errors) + len(self.warnings)
+        return self.error_count + self.warning_count
+
+    @property
+    def error_count(self):
+        return self._count(self.ERROR)
+
+    @property
+    def warning_count(self):
+        return self._count(self.WARNING)
+
+    def _count(self, level):
+        return sum(r.count for r in self.reported.values() if r.level == level)
 
-    def report_error(self, err: str):
-        self.errors.append(err)
+    def report_error(self, template: str, *args):
+        self._report(self.ERROR, template, args)
 
-    def report_warning(self, warning: str):
-        self.warnings.append(warning)
+    def report_warning(self, template: str, *args):
+        self._report(self.WARNING, template, args)
+
+    def _report(self, level: str, template: str, args):
+        reported = self._reported(level, template)
+        if reported is not None:
+            reported.add(
+                1,
+                [template.format(*args) if args else template],
+                [] if self.row is None else [self.row],
+                [] if self.sheet is None else [self.sheet],
+            )
+
+    def _reported(self, level: str, template: str):
+        key = (level, template)
+        reported = self.reported.get(key)
+        if reported is None:
+            if len(self.reported) >= MAX_TEMPLATES:
+                self.dropped += 1
+                return None
+            reported = self.reported[key] = ReportedError(level, template)
+        return reported
+
+    def extend(self, other: "ErrorCollector"):
+        """
+        Add everything reported to `other`. Reports that `other` has no location for are attributed to
+        this collector's `sheet` and `row`.
+        """
+        for (level, template), theirs in other.reported.items():
+            ours = self._reported(level, template)
+            if ours is None:
+                continue
+            ours.add(
+                theirs.count,
+                theirs.messages,
+                theirs.rows or ([] if self.row is None else [self.row]),
+                theirs.sheets or ([] if self.sheet is None else [self.sheet]),
+            )
+        self.dropped += other.dropped
+
+    def report(self):
+        """
+        JSON-able summary, errors first and most frequent first
+        """
+        reported = sorted(
+            self.reported.values(), key=lambda r: (r.level != self.ERROR, -r.count)
+        )
+        return dict(
+            errors=[r.as_dict() for r in reported if r.level == self.ERROR],
+            warnings=[r.as_dict() for r in reported if r.level == self.WARNING],
+            dropped=self.dropped,
+        )
 
     def dump(self):
-        print("\n".join(set(self.errors)))
-        print("\n".join(set(self.warnings)))
+        for reported in sorted(
+            self.reported.values(), key=lambda r: (r.level != self.ERROR, -r.count)
+        ):
+            print(reported)
+        if self.dropped:
+            print(f"... and {self.dropped} more reports")
 
     def __repr__(self):
-        return f"{len(self.errors)} errors and {len(self.warnings)} warnings"
+        return f"{self.error_count} errors and {self.warning_count} warnings"
 
 
 NAME_ITEM_MAPPING = {
@@ -72,41 +211,119 @@ def asset_name_to_item(asset_name: str, error_collector: ErrorCollector) -> Item
     match = NAME_ITEM_MAPPING.get(asset_name.lower().replace(" ", ""))
     if match is not None:
         return match
-    error_collector.report_warning(f"Unknown type: {asset_name}")
+    error_collector.report_warning("Unknown type: {}", asset_name)
     return Item.unknown
 
 
+DATE_FORMATS = {
+    "%m/%d/%Y": lambda x: x,  # 04/10/2020
+    "%m/%d/%y": lambda x: x,  # 04/10/20
+    "%Y-%m-%d": lambda x: x,  # 2020-04-10
+    "%d-%b": lambda d: d.replace(year=2020),  # 30-Apr
+    "%m/%d": lambda d: d.replace(year=2020),  # 4/15
+    "%m-%d": lambda d: d.replace(year=2020),  # 04-13
+    "%m-%d-%Y": lambda x: x,
+}
+
+
+def _match_date_formats(date: str):
+    """
+    :return: dict of format -> parsed date for every format in DATE_FORMATS that parses `date`
+    """
+    match = {}
+    for fmt, mapper in DATE_FORMATS.items():
+        try:
+            match[fmt] = mapper(datetime.strptime(date, fmt))
+        except ValueError:
+            pass
+    return match
+
+
+def _resolve_date_match(date: str, match):
+    """
+    Collapse the output of `_match_date_formats` into (parsed date, (error template, date) or None)
+    """
+    parsed = set(match.values())
+    if len(parsed) > 1:
+        return None, ("Ambiguous date! {}", date)
+    elif len(parsed) == 1:
+        return parsed.pop(), None
+    else:
+        return None, ("Unknown date format: {}", date)
+
+
 def parse_date(date: any, error_collector: ErrorCollector):
-    formats = [
-        ("%m/%d/%Y", lambda x: x),  # 04/10/2020
-        ("%m/%d/%y", lambda x: x),  # 04/10/20
-        ("%Y-%m-%d", lambda x: x),  # 2020-04-10
-        ("%d-%b", lambda d: d.replace(year=2020)),  # 30-Apr
-        ("%m/%d", lambda d: d.replace(year=2020)),  # 4/15
-        ("%m-%d", lambda d: d.replace(year=2020)),  # 04-13
-        ("%m-%d-%Y", lambda x: x),
-    ]
     if isinstance(date, str):
         date = date.strip()
-        match = []
-        for fmt, mapper in formats:
-            try:
-                match.append(mapper(datetime.strptime(date, fmt)))
-            except ValueError:
-                pass
-        if len(set(match)) > 1:
-            error_collector.report_error(f"Ambiguous date! {date}")
-        elif len(set(match)) == 1:
-            return match[0]
-        else:
-            error_collector.report_error(f"Unknown date format: {date}")
-            return None
+        parsed, error = _resolve_date_match(date, _match_date_formats(date))
+        if error:
+            error_collector.report_error(*error)
+        return parsed
     elif isinstance(date, datetime):
         return date
     else:
         return None
 
 
+class DateColumnParser:
+    """
+    Drop-in replacement for `parse_date` that is scoped to a single column of a single import.
+
+    Date columns repeat a handful of values thousands of times, always in the same format, so:
+    1. Results (and the error they reported, if any) are memoized per distinct string.
+    2. The first `sample_size` distinct values are checked against every format. If exactly one
+       format parses all of them, it is locked in and tried first for the rest of the column.
+
+    Values the locked format can't parse fall back to the full search, so ambiguous and
+    unknown dates are still reported through the `ErrorCollector` -- once per cell, like `parse_date`.
+    """
+
+    def __init__(self, sample_size: int = 5):
+        self.sample_size = sample_size
+        self.sampled = 0
+        self.candidate_formats = None
+        self.locked_format = None
+        self.cache = {}
+
+    def __call__(self, date: any, error_collector: ErrorCollector):
+        if not isinstance(date, str):
+            return parse_date(date, error_collector)
+        date = date.strip()
+        if date not in self.cache:
+            self.cache[date] = self._parse(date)
+        parsed, error = self.cache[date]
+        if error:
+            error_collector.report_error(*error)
+        return parsed
+
+    def _parse(self, date: str):
+        if self.locked_format is not None:
+            try:
+                return (
+                    DATE_FORMATS[self.locked_format](
+                        datetime.strptime(date, self.locked_format)
+                    ),
+                    None,
+                )
+            except ValueError:
+                pass
+
+        match = _match_date_formats(date)
+        parsed, error = _resolve_date_match(date, match)
+        if error is None and self.sampled < self.sample_size:
+            self._sample(match.keys())
+        return parsed, error
+
+    def _sample(self, formats):
+        if self.candidate_formats is None:
+            self.candidate_formats = set(formats)
+        else:
+            self.candidate_formats &= set(formats)
+        self.sampled += 1
+        if self.sampled == self.sample_size and len(self.candidate_formats) == 1:
+            self.locked_format = self.candidate_formats.pop()
+
+
 def parse_int_or_zero(inp: str, error_collector: ErrorCollector):
     return parse_int(inp, error_collector) or 0
 
@@ -121,7 +338,7 @@ def parse_int(inp: str, error_collector: ErrorCollector):
     except ValueError:
         # Maybe there's a unit or some other crap
         error_collector.report_error(
-            f"Can't parse {inp}. Returning None for now [TODO]"
+            "Can't parse {}. Returning None for now [TODO]", inp
         )
         return None
 
@@ -137,7 +354,7 @@ def parse_bool(inp: str, error_collector: ErrorCollector):
     elif inp in {"n", "no"}:
         return False
     else:
-        error_collector.report_error(f"Failed to parse bool: `{inp}`")
+        error_collector.report_error("Failed to parse bool: `{}`", inp)
 
 
 def parse_string_or_none(inp: str, error_collector: ErrorCollector):
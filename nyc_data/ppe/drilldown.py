@@ -1,9 +1,11 @@
 import ppe.dataclasses as dc
 from datetime import datetime, timedelta, date
 
+from django.db.models import OuterRef, Subquery
+
 from ppe import aggregations
 from ppe.aggregations import AssetRollup, DemandCalculationConfig, AggColumn
-from ppe.models import ScheduledDelivery, Purchase, Inventory
+from ppe.models import ActiveDelivery, Purchase, Inventory, ScheduledDelivery
 from ppe.dataclasses import OrderType
 from typing import List, Callable, NamedTuple, Dict, Set
 
@@ -12,7 +14,7 @@ from ppe.utils import log_db_queries
 
 class DrilldownResult(NamedTuple):
     purchases: List[Purchase]
-    scheduled_deliveries: List[ScheduledDelivery]
+    scheduled_deliveries: List[ActiveDelivery]
     inventory: List[Inventory]
     donations: List[Purchase]
     aggregation: Dict[str, AssetRollup]
@@ -25,10 +27,16 @@ def drilldown_result(
     supply_cols: Set[AggColumn],
     time_range: dc.Period,
 ):
+    # ordering by the join with the deliveries would list a purchase once per delivery
+    first_delivery = (
+        ScheduledDelivery.objects.filter(purchase=OuterRef("pk"))
+        .order_by("delivery_date")
+        .values("delivery_date")[:1]
+    )
     purchases = (
-        Purchase.active()
-        .prefetch_related("deliveries")
-        .order_by("deliveries__delivery_date")
+        Purchase.with_delivery_totals(Purchase.active())
+        .annotate(first_delivery=Subquery(first_delivery))
+        .order_by("first_delivery")
     )
 
     donations = [
@@ -58,10 +66,11 @@ def drilldown_result(
         and p.order_type != OrderType.Donation
     ]
 
-    deliveries = [list(p.deliveries.all()) for p in purchases]
-    # flatten
-    deliveries = sum(deliveries, [])
-    deliveries = sorted(deliveries, key=lambda d: d.delivery_date)
+    deliveries = list(
+        ActiveDelivery.objects.filter(purchase_id__in=[p.id for p in purchases]).order_by(
+            "delivery_date"
+        )
+    )
     inventory = [
         i for i in Inventory.active() if rollup_fn(dc.Item(i.item)) == item_type
     ]
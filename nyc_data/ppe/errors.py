@@ -39,6 +39,52 @@ class ImportInProgressError(DataImportError):
         self.import_id = import_id
 
 
+class DataFileBusy(DataImportError):
+    """
+    Another process held the lock of a kind of file for longer than the caller was
+    prepared to wait (see `ppe.locks.data_file_lock`)
+    """
+
+    def __init__(self, data_file, operation: str):
+        self.data_file = data_file
+        self.operation = operation
+
+    def __str__(self):
+        return (
+            "Another import of this file type is running. "
+            "Try again once it has finished."
+        )
+
+
+class ImportNotCandidate(DataImportError):
+    """
+    The import was no longer waiting to be verified by the time it was to be activated,
+    e.g. replaced by a newer upload of the same file type
+    """
+
+    def __init__(self, import_id, status):
+        self.import_id = import_id
+        self.status = status
+
+    def __str__(self):
+        return f"This upload can't be activated any more: it has been {self.status}."
+
+
+class FailedImportFileMissing(DataImportError):
+    """
+    The stored copy of a failed upload is gone (see `FailedImport.discard_file`)
+    """
+
+    def __init__(self, failed_import_id):
+        self.failed_import_id = failed_import_id
+
+    def __str__(self):
+        return (
+            "The stored copy of this upload is gone, so it can't be retried. "
+            "Please upload the file again."
+        )
+
+
 class SheetNameMismatch(DataImportError):
     def __init__(self, sheet_names, best_guess):
         self.sheet_names = sheet_names
@@ -74,3 +120,29 @@ class ColumnNameMismatch(DataImportError):
 
 class CsvImportError(DataImportError):
     pass
+
+
+def describe_upload_error(err: Exception) -> str:
+    """
+    What to tell the user when their upload failed with `err`
+    """
+    if isinstance(err, ImportInProgressError):
+        return "Import already in progress for this file type."
+    elif isinstance(err, NoMappingForFileError):
+        return "We were unable to find an existing mapping for this file."
+    elif isinstance(err, CsvImportError):
+        return f"Error reading CSV file: {err}."
+    elif isinstance(
+        err,
+        (
+            SheetNameMismatch,
+            PartialFile,
+            ColumnNameMismatch,
+            DataFileBusy,
+            ImportNotCandidate,
+            FailedImportFileMissing,
+        ),
+    ):
+        return str(err)
+    else:
+        return f"There was an unknown error importing the file. {err}"
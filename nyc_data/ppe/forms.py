@@ -4,3 +4,9 @@ from django import forms
 class UploadFileForm(forms.Form):
     file = forms.FileField()
     data_current = forms.DateField(label="Data current as of YYYY-MM-DD")
+    reimport_history = forms.BooleanField(
+        required=False,
+        label="Re-import every date, not only new ones",
+        help_text="For cumulative files whose earlier dates were corrected. "
+        "Otherwise only the dates that aren't imported yet are read from them.",
+    )
@@ -0,0 +1,109 @@
+import logging
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from ppe.data_mapping.types import DataFile
+from ppe.errors import DataFileBusy
+from ppe.models import DataFileLockStats
+
+logger = logging.getLogger(__name__)
+
+
+def _int4(name: str) -> int:
+    # the two-key form of the advisory lock functions takes int4s
+    return zlib.crc32(name.encode()) & 0x7FFFFFFF
+
+
+# first key of every advisory lock taken here, so they can't collide with locks taken for anything else
+LOCK_NAMESPACE = _int4("ppe.data_file_lock")
+# seconds between attempts when waiting for a lock with a timeout
+LOCK_POLL_INTERVAL = 0.05
+
+
+def lock_key(data_file: DataFile) -> int:
+    return _int4(DataFile(data_file).name)
+
+
+@contextmanager
+def data_file_lock(data_file: DataFile, operation: str, timeout: Optional[float] = None):
+    """
+    Holds a Postgres advisory lock for `data_file` so imports (and activations) of one kind of file run one at a
+    time across every worker and node, while other kinds run in parallel.
+
+    The lock is held by the database session rather than a transaction, so it can span the several transactions of
+    an import. How long callers waited is recorded in `DataFileLockStats`.
+
+    :param timeout: seconds to wait for the lock at most before raising `DataFileBusy` (e.g. in a web request,
+    which shouldn't wait out a whole import); by default, wait as long as it takes
+    """
+    key = lock_key(data_file)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [LOCK_NAMESPACE, key])
+        (acquired,) = cursor.fetchone()
+        waited = 0.0
+        if not acquired:
+            # counted in `DataFileLockStats` too, once it is acquired
+            logger.info("Waiting for another %s of %s", operation, DataFile(data_file).name)
+            start = time.perf_counter()
+            if timeout is None:
+                cursor.execute("SELECT pg_advisory_lock(%s, %s)", [LOCK_NAMESPACE, key])
+            else:
+                # polled: a lock_timeout would abort the caller's transaction, if it is in one
+                while not acquired:
+                    if time.perf_counter() - start >= timeout:
+                        raise DataFileBusy(data_file, operation)
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [LOCK_NAMESPACE, key])
+                    (acquired,) = cursor.fetchone()
+            waited = time.perf_counter() - start
+    try:
+        record_acquisition(data_file, operation, contended=not acquired, waited=waited)
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [LOCK_NAMESPACE, key])
+
+
+def record_acquisition(data_file: DataFile, operation: str, contended: bool, waited: float):
+    stats, _ = DataFileLockStats.objects.get_or_create(
+        data_file=DataFile(data_file), operation=operation
+    )
+    update = dict(acquisitions=F("acquisitions") + 1)
+    if contended:
+        update.update(
+            contended=F("contended") + 1,
+            wait_seconds=F("wait_seconds") + waited,
+            max_wait_seconds=Greatest("max_wait_seconds", waited),
+            last_contended_at=timezone.now(),
+        )
+    DataFileLockStats.objects.filter(id=stats.id).update(**update)
+
+
+def held_locks() -> Dict[str, List[Dict]]:
+    """
+    Which sessions hold or are waiting for each data file's lock right now
+    """
+    keys = {lock_key(data_file): data_file.name for data_file in DataFile}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT l.objid::int, l.granted, a.pid, a.application_name, a.client_addr::text, a.query_start
+            FROM pg_locks l LEFT JOIN pg_stat_activity a ON a.pid = l.pid
+            WHERE l.locktype = 'advisory' AND l.classid::int = %s
+            ORDER BY l.granted DESC, a.query_start
+            """,
+            [LOCK_NAMESPACE],
+        )
+        locks = {}
+        for objid, granted, pid, application, client, since in cursor.fetchall():
+            locks.setdefault(keys.get(objid, str(objid)), []).append(
+                dict(granted=granted, pid=pid, application=application, client=client, since=since)
+            )
+    return locks
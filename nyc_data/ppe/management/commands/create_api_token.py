@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ppe.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = "Create a token for the import API (`/api/imports/`). The key is only shown once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User the API acts as")
+        parser.add_argument(
+            "--name", default="", help="What the token is for, e.g. the feed using it"
+        )
+
+    def handle(self, *args, username, name, **options):
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(f"No user named {username}")
+        token, key = ApiToken.create(user, name)
+        self.stdout.write(f"Created token {token.id} for {username}: {key}")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from ppe.locks import held_locks
+from ppe.models import DataFileLockStats
+
+
+class Command(BaseCommand):
+    help = "Show who holds or waits for the per-DataFile import locks, and how contended they have been"
+
+    def handle(self, *args, **options):
+        locks = held_locks()
+        if not locks:
+            self.stdout.write("No import locks are held")
+        for data_file, sessions in locks.items():
+            self.stdout.write(f"{data_file}:")
+            for session in sessions:
+                state = "holds" if session["granted"] else "waits"
+                self.stdout.write(
+                    f"    pid {session['pid']} ({session['application'] or '-'} {session['client'] or 'local'}) "
+                    f"{state} since {session['since']}"
+                )
+
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'data file':<30}{'operation':<10}{'acquired':>10}{'contended':>10}{'wait s':>10}{'max wait s':>12}"
+        )
+        for stats in DataFileLockStats.objects.order_by("data_file", "operation"):
+            self.stdout.write(
+                f"{stats.data_file:<30}{stats.operation:<10}{stats.acquisitions:>10}{stats.contended:>10}"
+                f"{stats.wait_seconds:>10.1f}{stats.max_wait_seconds:>12.1f}"
+            )
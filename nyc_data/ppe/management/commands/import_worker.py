@@ -0,0 +1,184 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import sentry_sdk
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+
+from ppe import data_import
+from ppe.data_mapping.types import DataFile
+from ppe.models import ImportJob, ImportJobStatus
+
+
+@contextmanager
+def heartbeat(job: ImportJob):
+    """
+    Send `job`'s heartbeat from a thread of its own while the import runs, so it isn't mistaken for one left behind
+    by a dead worker (see `ImportJob.requeue_stale`)
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.IMPORT_JOB_HEARTBEAT):
+                try:
+                    job.beat()
+                except Exception as ex:
+                    # the next beat reconnects
+                    sentry_sdk.capture_exception(ex)
+                    connection.close()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job.id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job_in_worker(job_id: int):
+    try:
+        job = ImportJob.objects.get(id=job_id)
+        with heartbeat(job):
+            data_import.run_import_job(job)
+    finally:
+        # don't hold connections open between jobs
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Import queued uploads (see `ImportJob`) off the request path"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Seconds to wait before checking an empty queue again",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.IMPORT_WORKER_CONCURRENCY,
+            help="Jobs imported at once (never more than one per kind of file), e.g. for bulk retries",
+        )
+
+    def handle(self, *args, poll_interval, once, concurrency, **options):
+        if concurrency > 1:
+            return self.handle_concurrently(poll_interval, once, concurrency)
+        while True:
+            # long running process: drop broken / expired connections between jobs like a request would
+            if not connection.in_atomic_block:
+                close_old_connections()
+            job = ImportJob.claim_next()
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            self.stdout.write(f"---- Importing {job.file_name} (job {job.id}) ----")
+            with heartbeat(job):
+                data_import.run_import_job(job)
+            self.report(job)
+
+    def handle_concurrently(self, poll_interval: float, once: bool, concurrency: int):
+        # at most one job per DataFile at a time, so they activate in the order they were queued
+        running: Dict[DataFile, Tuple[ImportJob, Future]] = {}
+        # the kind of file of the queued jobs looked at so far
+        kinds: Dict[int, Optional[DataFile]] = {}
+        pool = ProcessPoolExecutor(
+            max_workers=concurrency, mp_context=multiprocessing.get_context("fork")
+        )
+        try:
+            while True:
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                for data_file, (job, future) in list(running.items()):
+                    if future.done():
+                        del running[data_file]
+                        self.collect(job, future)
+
+                job = None
+                if len(running) < concurrency:
+                    job = ImportJob.claim_next(
+                        self.startable(kinds, set(running), concurrency - len(running))
+                    )
+                if job is not None:
+                    data_file = kinds.pop(job.id)
+                    if data_file is None:
+                        # fails straight away, with the usual error
+                        data_import.run_import_job(job)
+                        self.report(job)
+                    else:
+                        running[data_file] = (job, self.submit(pool, job))
+                    continue
+
+                if once and not running:
+                    return
+                time.sleep(poll_interval)
+        finally:
+            pool.shutdown()
+
+    def startable(self, kinds: Dict[int, Optional[DataFile]], busy: Set[DataFile], limit: int) -> List[int]:
+        """
+        Up to `limit` queued jobs that can start now: the oldest of each kind of file not being imported. The others
+        are left queued (rather than claimed and kept waiting here) until their turn comes, so they show as queued
+        and another worker can take them.
+        """
+        queued = list(
+            ImportJob.objects.filter(status=ImportJobStatus.queued).order_by("created_at").values_list("id", flat=True)
+        )
+        # claimed by another worker in the meantime
+        for job_id in set(kinds) - set(queued):
+            del kinds[job_id]
+
+        startable = []
+        busy = set(busy)
+        for job_id in queued:
+            if len(startable) == limit:
+                break
+            if job_id not in kinds:
+                job = ImportJob.objects.filter(id=job_id).first()
+                if job is None:
+                    # deleted in the meantime
+                    continue
+                kinds[job_id] = data_import.job_data_file(job)
+            data_file = kinds[job_id]
+            if data_file in busy:
+                continue
+            startable.append(job_id)
+            if data_file is not None:
+                busy.add(data_file)
+        return startable
+
+    def submit(self, pool: ProcessPoolExecutor, job: ImportJob) -> Future:
+        self.stdout.write(f"---- Importing {job.file_name} (job {job.id}) ----")
+        # the workers are forked on the first submit and must not share this process's connection
+        connections.close_all()
+        return pool.submit(run_job_in_worker, job.id)
+
+    def collect(self, job: ImportJob, future: Future):
+        try:
+            future.result()
+        except Exception as ex:
+            # the worker died before it could record the outcome
+            data_import.fail_import_job(job, ex)
+        job.refresh_from_db()
+        self.report(job)
+
+    def report(self, job: ImportJob):
+        self.stdout.write(
+            f"---- Job {job.id} {ImportJobStatus(job.status).value} in {job.seconds() or 0:.1f}s {job.error} ----"
+        )
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from ppe import retention
+from ppe.data_mapping.types import DataFile
+
+
+class Command(BaseCommand):
+    help = "Archive the rows of old replaced and cancelled imports to compressed dumps, and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=settings.IMPORT_RETENTION,
+            help="Imports of each kind of file to keep, whatever their status",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=retention.PRUNE_BATCH_SIZE,
+            help="Rows deleted per transaction",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Prune at most this many imports",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list the imports that would be pruned",
+        )
+
+    def handle(self, *args, keep, batch_size, limit, dry_run, **options):
+        if keep < 1:
+            raise CommandError("Keep at least the active import of each file")
+
+        if dry_run:
+            imports = retention.annotate_storage(
+                retention.prunable_imports(keep).order_by("import_date")
+            )[:limit]
+            for data_import in imports:
+                self.stdout.write(
+                    f"{data_import.id} {DataFile(data_import.data_file).name} {data_import.import_date:%Y-%m-%d} "
+                    f"{data_import.status}: {data_import.rows} rows, {filesizeformat(data_import.size)}"
+                )
+            return
+
+        pruned = 0
+        while limit is None or pruned < limit:
+            # the oldest first: once an import is pruned, the ones it carried forward can be too
+            data_import = retention.prunable_imports(keep).order_by("import_date").first()
+            if data_import is None:
+                break
+            deleted = retention.prune_import(data_import, batch_size)
+            pruned += 1
+            self.stdout.write(
+                f"Archived {data_import.id} ({DataFile(data_import.data_file).name}, "
+                f"{data_import.import_date:%Y-%m-%d}) to {data_import.archive}: {deleted} rows deleted"
+            )
+        self.stdout.write(f"Pruned {pruned} imports")
@@ -0,0 +1,208 @@
+import multiprocessing
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import sentry_sdk
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+
+import xlsx_utils
+from ppe import data_import
+from ppe.data_mapping.types import DataFile
+from ppe.errors import NoMappingForFileError, describe_upload_error
+from ppe.models import DataImport
+
+WATCHED_SUFFIXES = {".xlsx", ".csv"}
+
+
+class FileState(NamedTuple):
+    size: int
+    mtime: float
+
+
+class ImportResult(NamedTuple):
+    import_id: int
+    rows_written: int
+    seconds: float
+
+
+def import_file(path: Path, mappings, checksum: str, current_as_of: date) -> ImportResult:
+    """
+    Import and activate one file
+    """
+    start = time.perf_counter()
+    import_obj = data_import.import_data(
+        path,
+        mappings,
+        current_as_of=current_as_of,
+        uploaded_by="Watch folder",
+        overwrite_in_prog=True,
+        user_provided_filename=None,
+        checksum=checksum,
+    )
+    data_import.finalize_import(import_obj)
+    return ImportResult(
+        import_obj.id, import_obj.rows_written, time.perf_counter() - start
+    )
+
+
+def import_file_in_worker(*args) -> ImportResult:
+    try:
+        return import_file(*args)
+    finally:
+        # don't hold connections open between files
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Import new or changed spreadsheets as they land in a directory. "
+        "Each import is activated right away (sending `data_import_finalized`)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", type=Path)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Seconds between scans of the directory",
+        )
+        parser.add_argument(
+            "--settle",
+            type=float,
+            default=2,
+            help="Seconds a file must go unmodified before it is imported (so half-written files are skipped)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=2,
+            help="Files imported at once (never more than one per kind of file)",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once every file in the directory has been handled",
+        )
+
+    def handle(
+        self, *args, directory, poll_interval, settle, concurrency, once, **options
+    ):
+        self.directory = directory
+        self.settle = settle
+        # files already handled, and the state they were in
+        self.seen: Dict[Path, Tuple[FileState, str]] = {}
+        # at most one import per DataFile at a time, so they activate in the order the files landed
+        self.running: Dict[DataFile, Tuple[Path, Future]] = {}
+
+        pool = None
+        if concurrency > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=concurrency,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        try:
+            while True:
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                self.collect_finished()
+                waiting = self.scan(pool)
+                if once and not waiting and not self.running:
+                    return
+                time.sleep(poll_interval)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def scan(self, pool: Optional[ProcessPoolExecutor]) -> int:
+        """
+        Start importing every new or changed file that is ready.
+        :return: how many files are still waiting (to settle, or for an import of the same kind to finish)
+        """
+        waiting = 0
+        now = time.time()
+        for state, path in self.list_files():
+            seen_state, seen_checksum = self.seen.get(path, (None, None))
+            if state == seen_state:
+                continue
+            if now - state.mtime < self.settle:
+                waiting += 1
+                continue
+
+            checksum = data_import.file_checksum(path)
+            if checksum == seen_checksum or DataImport.objects.filter(
+                file_checksum=checksum
+            ).exists():
+                # touched but unchanged, or imported before (by us before a restart, or by hand)
+                self.seen[path] = (state, checksum)
+                continue
+
+            try:
+                mappings = xlsx_utils.guess_mapping(path, data_import.MAPPING_INDEX)
+                if not mappings:
+                    raise NoMappingForFileError()
+            except Exception as ex:
+                # not retried until the file changes
+                self.stderr.write(f"{path.name}: {describe_upload_error(ex)}")
+                self.seen[path] = (state, checksum)
+                continue
+
+            data_file = mappings[0].data_file
+            if data_file in self.running:
+                waiting += 1
+                continue
+
+            self.stdout.write(f"---- Importing {path.name} ({data_file.name}) ----")
+            args = (path, mappings, checksum, date.fromtimestamp(state.mtime))
+            if pool is None:
+                future = Future()
+                try:
+                    future.set_result(import_file(*args))
+                except Exception as ex:
+                    future.set_exception(ex)
+            else:
+                # the workers are forked on the first submit, by when `scan` has used this process's connection:
+                # they must open their own rather than share its socket (and close it under us when they finish)
+                connections.close_all()
+                future = pool.submit(import_file_in_worker, *args)
+            self.running[data_file] = (path, future)
+            self.seen[path] = (state, checksum)
+            if pool is None:
+                self.collect_finished()
+        return waiting
+
+    def list_files(self):
+        """
+        :return: (FileState, path) of every spreadsheet in the directory, oldest first
+        """
+        files = []
+        for path in self.directory.iterdir():
+            # skip hidden files and Excel's lock files
+            if path.suffix not in WATCHED_SUFFIXES or path.name.startswith(("~$", ".")):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((FileState(stat.st_size, stat.st_mtime), path))
+        return sorted(files, key=lambda state_path: state_path[0].mtime)
+
+    def collect_finished(self):
+        for data_file, (path, future) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[data_file]
+            try:
+                result = future.result()
+                self.stdout.write(
+                    f"---- {path.name} imported as {result.import_id}: "
+                    f"{result.rows_written} rows in {result.seconds:.1f}s ----"
+                )
+            except Exception as ex:
+                sentry_sdk.capture_message(f"Failed watch folder import of {path.name}")
+                sentry_sdk.capture_exception(ex)
+                self.stderr.write(f"---- {path.name} failed: {describe_upload_error(ex)} ----")
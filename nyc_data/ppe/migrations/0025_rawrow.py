@@ -0,0 +1,73 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:24
+
+import hashlib
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# source rows moved per query
+BATCH_SIZE = 1000
+
+
+def move_raw_data(apps, schema_editor):
+    RawRow = apps.get_model("ppe", "RawRow")
+    for model_name in ["Purchase", "Inventory"]:
+        model = apps.get_model("ppe", model_name)
+        rows = model.objects.exclude(raw_data={}).only("id", "raw_data").order_by("id")
+        last = None
+        while True:
+            batch = list((rows if last is None else rows.filter(id__gt=last))[:BATCH_SIZE])
+            if not batch:
+                break
+            raw_rows = {}
+            for obj in batch:
+                raw_data = obj.raw_data
+                if not isinstance(raw_data, str):
+                    raw_data = json.dumps(raw_data, cls=DjangoJSONEncoder)
+                encoded = raw_data.encode()
+                obj.raw_row_id = hashlib.sha256(encoded).hexdigest()
+                raw_rows[obj.raw_row_id] = RawRow(checksum=obj.raw_row_id, data=zlib.compress(encoded))
+            # shared with rows of an earlier batch or import
+            RawRow.objects.bulk_create(raw_rows.values(), ignore_conflicts=True)
+            model.objects.bulk_update(batch, ["raw_row"])
+            last = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0024_auto_20200517_2106'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawRow',
+            fields=[
+                ('checksum', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='raw_row',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ppe.RawRow'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='raw_row',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ppe.RawRow'),
+        ),
+        migrations.RunPython(move_raw_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='inventory',
+            name='raw_data',
+        ),
+        migrations.RemoveField(
+            model_name='purchase',
+            name='raw_data',
+        ),
+    ]
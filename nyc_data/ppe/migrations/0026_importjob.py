@@ -0,0 +1,49 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import ppe.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ppe', '0025_rawrow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataimport',
+            name='current_sheet',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='dataimport',
+            name='rows_parsed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dataimport',
+            name='rows_written',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.TextField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default=ppe.models.ImportJobStatus['queued'])),
+                ('data', models.BinaryField()),
+                ('file_name', models.TextField()),
+                ('current_as_of', models.DateField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('error', models.TextField(blank=True)),
+                ('import_in_progress', models.IntegerField(null=True)),
+                ('data_import', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ppe.DataImport')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0026_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataimport',
+            name='carried_forward',
+            field=models.ManyToManyField(blank=True, related_name='carried_into', to='ppe.DataImport'),
+        ),
+    ]
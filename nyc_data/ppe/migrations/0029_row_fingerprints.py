@@ -0,0 +1,139 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0028_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='demand',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='demand',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='facilitydelivery',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='facilitydelivery',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='inboundreceipt',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='inboundreceipt',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='need',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='need',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='scheduleddelivery',
+            name='fingerprint',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='scheduleddelivery',
+            name='row_key',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='demand',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='demand_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='facility',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='facility_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='facilitydelivery',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='facilitydelivery_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='hospital_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='inboundreceipt',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='inboundreceipt_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='inventory_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='need',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='need_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='purchase_row_diff'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduleddelivery',
+            index=models.Index(fields=['source', 'row_key', 'fingerprint'], name='scheduleddelivery_row_diff'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.db import migrations, models
+
+
+def move_failed_uploads(apps, schema_editor):
+    FailedImport = apps.get_model("ppe", "FailedImport")
+    storage = get_storage_class(settings.FAILED_IMPORT_STORAGE)(location=settings.FAILED_IMPORT_ROOT)
+    for failed_import in FailedImport.objects.only("id").iterator():
+        data = bytes(FailedImport.objects.values_list("data", flat=True).get(id=failed_import.id))
+        checksum = hashlib.sha256(data).hexdigest()
+        name = f"{checksum[:2]}/{checksum}.gz"
+        if not storage.exists(name):
+            storage.save(name, ContentFile(gzip.compress(data)))
+        FailedImport.objects.filter(id=failed_import.id).update(checksum=checksum)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0029_row_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedimport',
+            name='checksum',
+            field=models.CharField(db_index=True, default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(move_failed_uploads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='failedimport',
+            name='data',
+        ),
+    ]
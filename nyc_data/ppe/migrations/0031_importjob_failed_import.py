@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0030_failedimport_file_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='failed_import',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='ppe.FailedImport'),
+        ),
+    ]
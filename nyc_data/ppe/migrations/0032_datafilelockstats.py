@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-19 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0031_importjob_failed_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataFileLockStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_file', models.TextField(choices=[('PPE_ORDERINGCHARTS_DATE_XLSX', 'PPE_ORDERINGCHARTS_DATE_XLSX'), ('SUPPLIERS_PARTNERS_XLSX', 'SUPPLIERS_PARTNERS_XLSX'), ('INVENTORY', 'INVENTORY'), ('FACILITY_DELIVERIES', 'FACILITY_DELIVERIES'), ('HOSPITAL_DEMANDS', 'HOSPITAL_DEMANDS'), ('CSH_DONATIONS', 'CSH_DONATIONS')], default=None)),
+                ('operation', models.TextField()),
+                ('acquisitions', models.IntegerField(default=0)),
+                ('contended', models.IntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('max_wait_seconds', models.FloatField(default=0)),
+                ('last_contended_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'data file lock stats',
+                'unique_together': {('data_file', 'operation')},
+            },
+        ),
+    ]
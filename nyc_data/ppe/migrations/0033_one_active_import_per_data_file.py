@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def replace_duplicate_active_imports(apps, schema_editor):
+    # keep the latest active import of each data file
+    DataImport = apps.get_model("ppe", "DataImport")
+    seen = set()
+    for data_import in DataImport.objects.filter(status="active").order_by("-import_date"):
+        if data_import.data_file in seen:
+            DataImport.objects.filter(id=data_import.id).update(status="replaced")
+        seen.add(data_import.data_file)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0032_datafilelockstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_duplicate_active_imports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dataimport',
+            constraint=models.UniqueConstraint(condition=models.Q(status='active'), fields=('data_file',), name='one_active_import_per_data_file'),
+        ),
+    ]
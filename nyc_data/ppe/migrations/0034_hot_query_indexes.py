@@ -0,0 +1,41 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:05
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the imported data tables can be big: build the indexes without blocking imports
+    atomic = False
+
+    dependencies = [
+        ('ppe', '0033_one_active_import_per_data_file'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='facilitydelivery',
+            index=models.Index(fields=['source', 'date', 'item'], name='facilitydelivery_active_date'),
+        ),
+        AddIndexConcurrently(
+            model_name='facilitydelivery',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['date'], name='facilitydelivery_date_brin'),
+        ),
+        AddIndexConcurrently(
+            model_name='importjob',
+            index=models.Index(condition=models.Q(status='queued'), fields=['created_at'], name='importjob_queue'),
+        ),
+        AddIndexConcurrently(
+            model_name='inventory',
+            index=models.Index(fields=['source', 'as_of', 'item'], name='inventory_active_as_of'),
+        ),
+        AddIndexConcurrently(
+            model_name='purchase',
+            index=models.Index(fields=['source', 'order_type', 'item'], name='purchase_active_type'),
+        ),
+        AddIndexConcurrently(
+            model_name='scheduleddelivery',
+            index=models.Index(fields=['source', 'delivery_date'], name='scheduleddelivery_active_date'),
+        ),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:13
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Q
+
+IMPORTED_MODELS = [
+    "demand",
+    "facility",
+    "facilitydelivery",
+    "hospital",
+    "inboundreceipt",
+    "inventory",
+    "need",
+    "purchase",
+    "scheduleddelivery",
+]
+
+# rows flagged per statement (and transaction)
+BATCH_SIZE = 5000
+
+
+def flag_active_rows(apps, schema_editor):
+    DataImport = apps.get_model("ppe", "DataImport")
+    active_sources = list(
+        DataImport.objects.filter(Q(status="active") | Q(carried_into__status="active")).values_list(
+            "id", flat=True
+        )
+    )
+    for model_name in IMPORTED_MODELS:
+        model = apps.get_model("ppe", model_name)
+        last = None
+        while True:
+            rows = model.objects.filter(source__in=active_sources).order_by("pk")
+            if last is not None:
+                rows = rows.filter(pk__gt=last)
+            batch = list(rows.values_list("pk", flat=True)[:BATCH_SIZE])
+            if not batch:
+                break
+            model.objects.filter(pk__in=batch).update(is_active=True)
+            last = batch[-1]
+
+
+def replace_index(model_name, old, new):
+    """
+    Build `new` concurrently under a temporary name, then drop `old` (of the same name) and rename `new`, so the
+    queries `old` serves until the code using `new` is deployed are never without an index
+    """
+
+    def swap(apps, schema_editor, drop, build):
+        model = apps.get_model("ppe", model_name)
+        temporary = build.clone()
+        temporary.name = f"{build.name}_new"
+        schema_editor.add_index(model, temporary, concurrently=True)
+        schema_editor.remove_index(model, drop, concurrently=True)
+        schema_editor.execute(
+            f"ALTER INDEX {schema_editor.quote_name(temporary.name)} RENAME TO {schema_editor.quote_name(build.name)}"
+        )
+
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunPython(
+                lambda apps, schema_editor: swap(apps, schema_editor, old, new),
+                lambda apps, schema_editor: swap(apps, schema_editor, new, old),
+            )
+        ],
+        state_operations=[
+            migrations.RemoveIndex(model_name=model_name, name=old.name),
+            migrations.AddIndex(model_name=model_name, index=new),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+    # like 0034: the imported data tables can be big, so the flags are backfilled a batch at a time and the indexes
+    # built without blocking imports
+    atomic = False
+
+    dependencies = [
+        ('ppe', '0034_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='demand',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='facilitydelivery',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='inboundreceipt',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='inventory',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='need',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='scheduleddelivery',
+            name='is_active',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(flag_active_rows, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='demand',
+            index=models.Index(condition=models.Q(is_active=True), fields=['source'], name='demand_active'),
+        ),
+        AddIndexConcurrently(
+            model_name='facility',
+            index=models.Index(condition=models.Q(is_active=True), fields=['source'], name='facility_active'),
+        ),
+        AddIndexConcurrently(
+            model_name='hospital',
+            index=models.Index(condition=models.Q(is_active=True), fields=['source'], name='hospital_active'),
+        ),
+        AddIndexConcurrently(
+            model_name='inboundreceipt',
+            index=models.Index(condition=models.Q(is_active=True), fields=['source'], name='inboundreceipt_active'),
+        ),
+        AddIndexConcurrently(
+            model_name='need',
+            index=models.Index(condition=models.Q(is_active=True), fields=['source'], name='need_active'),
+        ),
+        replace_index(
+            'facilitydelivery',
+            old=models.Index(fields=['source', 'date', 'item'], name='facilitydelivery_active_date'),
+            new=models.Index(condition=models.Q(is_active=True), fields=['date', 'item'], name='facilitydelivery_active_date'),
+        ),
+        replace_index(
+            'inventory',
+            old=models.Index(fields=['source', 'as_of', 'item'], name='inventory_active_as_of'),
+            new=models.Index(condition=models.Q(is_active=True), fields=['as_of', 'item'], name='inventory_active_as_of'),
+        ),
+        replace_index(
+            'purchase',
+            old=models.Index(fields=['source', 'order_type', 'item'], name='purchase_active_type'),
+            new=models.Index(condition=models.Q(is_active=True), fields=['order_type', 'item'], name='purchase_active_type'),
+        ),
+        replace_index(
+            'scheduleddelivery',
+            old=models.Index(fields=['source', 'delivery_date'], name='scheduleddelivery_active_date'),
+            new=models.Index(condition=models.Q(is_active=True), fields=['delivery_date'], name='scheduleddelivery_active_date'),
+        ),
+    ]
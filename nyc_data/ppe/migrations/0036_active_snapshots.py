@@ -0,0 +1,73 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:16
+
+from django.db import migrations, models
+
+# the views behind `ActiveDelivery` and `ActiveItemTotals`; the unique indexes let them be refreshed concurrently
+CREATE_VIEWS = """
+CREATE MATERIALIZED VIEW ppe_activedelivery AS
+SELECT d.id, d.source_id, d.purchase_id, d.delivery_date, d.quantity, p.item, p.order_type, p.vendor, p.description
+FROM ppe_scheduleddelivery d JOIN ppe_purchase p ON p.id = d.purchase_id
+WHERE d.is_active;
+CREATE UNIQUE INDEX activedelivery_id ON ppe_activedelivery (id);
+CREATE INDEX activedelivery_date ON ppe_activedelivery (delivery_date, order_type);
+CREATE INDEX activedelivery_purchase ON ppe_activedelivery (purchase_id);
+
+CREATE MATERIALIZED VIEW ppe_activeitemtotals AS
+SELECT item, SUM(inventory)::integer AS inventory, SUM(donated)::integer AS donated
+FROM (
+    SELECT item, quantity AS inventory, 0 AS donated FROM ppe_inventory
+    WHERE is_active AND as_of = (SELECT MAX(as_of) FROM ppe_inventory WHERE is_active)
+    UNION ALL
+    SELECT item, 0, quantity - received_quantity FROM ppe_purchase
+    WHERE is_active AND order_type = 'donation'
+) totals
+GROUP BY item;
+CREATE UNIQUE INDEX activeitemtotals_item ON ppe_activeitemtotals (item);
+"""
+
+DROP_VIEWS = """
+DROP MATERIALIZED VIEW ppe_activedelivery;
+DROP MATERIALIZED VIEW ppe_activeitemtotals;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0035_active_rows'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_VIEWS, DROP_VIEWS),
+        migrations.CreateModel(
+            name='ActiveDelivery',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('delivery_date', models.DateField(null=True)),
+                ('quantity', models.IntegerField()),
+                ('item', models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None)),
+                ('order_type', models.TextField(choices=[('Purchase', 'Purchase'), ('Make', 'Make'), ('Donation', 'Donation')], default=None)),
+                ('vendor', models.TextField()),
+                ('description', models.TextField(blank=True)),
+            ],
+            options={
+                'db_table': 'ppe_activedelivery',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ActiveItemTotals',
+            fields=[
+                ('item', models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None, primary_key=True, serialize=False)),
+                ('inventory', models.IntegerField()),
+                ('donated', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'active item totals',
+                'db_table': 'ppe_activeitemtotals',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+    ]
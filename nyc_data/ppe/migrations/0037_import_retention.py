@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0036_active_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataimport',
+            name='archive',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='dataimport',
+            name='pruned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='dataimport',
+            name='status',
+            field=models.TextField(choices=[('active', 'active'), ('replaced', 'replaced'), ('candidate', 'candidate'), ('cancelled', 'cancelled'), ('archived', 'archived')], db_index=True, default=None),
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations
+
+# `ImportedDataModel.partitioned`: the tables become range partitioned by source_id. The rows already there become
+# one partition, for the imports so far; every import from now on gets a partition of its own
+# (see `DataImport.create_partitions`)
+PARTITIONED_TABLES = ["ppe_inventory", "ppe_facilitydelivery"]
+
+# ppe_activeitemtotals reads ppe_inventory, and a view follows the table it was created on when it is renamed
+ACTIVE_ITEM_TOTALS = """
+CREATE MATERIALIZED VIEW ppe_activeitemtotals AS
+SELECT item, SUM(inventory)::integer AS inventory, SUM(donated)::integer AS donated
+FROM (
+    SELECT item, quantity AS inventory, 0 AS donated FROM ppe_inventory
+    WHERE is_active AND as_of = (SELECT MAX(as_of) FROM ppe_inventory WHERE is_active)
+    UNION ALL
+    SELECT item, 0, quantity - received_quantity FROM ppe_purchase
+    WHERE is_active AND order_type = 'donation'
+) totals
+GROUP BY item;
+CREATE UNIQUE INDEX activeitemtotals_item ON ppe_activeitemtotals (item);
+"""
+
+
+def partition_by_source(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM ppe_dataimport")
+        (last_import,) = cursor.fetchone()
+        cursor.execute("DROP MATERIALIZED VIEW ppe_activeitemtotals")
+        for table in PARTITIONED_TABLES:
+            legacy = f"{table}_legacy"
+            cursor.execute(
+                """
+                SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = %s::regclass AND NOT x.indisprimary
+                """,
+                [table],
+            )
+            indexes = cursor.fetchall()
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                [table],
+            )
+            foreign_keys = cursor.fetchall()
+
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+            for name, _ in indexes:
+                cursor.execute(f"ALTER INDEX {name} RENAME TO {name}_legacy")
+            for name, _ in foreign_keys:
+                cursor.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {name}")
+            # the partition key has to be part of the primary key
+            cursor.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_pkey")
+            cursor.execute(f"ALTER TABLE {legacy} ADD PRIMARY KEY (id, source_id)")
+
+            cursor.execute(
+                f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (source_id)"
+            )
+            cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, source_id)")
+            for name, definition in foreign_keys:
+                cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+            cursor.execute(
+                f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)",
+                [last_import + 1],
+            )
+            # the same definitions on the partitioned table: the legacy partition's indexes are attached, not rebuilt
+            for _, definition in indexes:
+                cursor.execute(definition)
+        cursor.execute(ACTIVE_ITEM_TOTALS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0037_import_retention'),
+    ]
+
+    operations = [
+        # there is no going back to a single table, but nothing relies on the partitioning either
+        migrations.RunPython(partition_by_source, migrations.RunPython.noop),
+    ]
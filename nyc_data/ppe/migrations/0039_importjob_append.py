@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0038_partition_by_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='append',
+            field=models.BooleanField(default=True),
+        ),
+    ]
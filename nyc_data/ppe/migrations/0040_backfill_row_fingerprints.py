@@ -0,0 +1,80 @@
+import hashlib
+
+from django.db import migrations
+
+# rows fingerprinted per statement (and transaction)
+BATCH_SIZE = 5000
+
+# `ImportedDataModel.fingerprint_fields` and `diff_key` of each model as of 0029, in order: rows imported since
+# were fingerprinted as they were written, so these must hash the same values. Models referred to by others come
+# first, so their `row_key` is there to be hashed in turn
+FINGERPRINTS = [
+    (
+        "purchase",
+        ["order_type", "item", "description", "quantity", "unit", "received_quantity", "vendor", "cost",
+         "donation_date", "comment"],
+        ["order_type", "item", "vendor", "description"],
+    ),
+    ("facility", ["name", "tpe"], ["name"]),
+    ("hospital", ["name"], ["name"]),
+    ("scheduleddelivery", ["purchase", "delivery_date", "quantity"], ["purchase", "delivery_date"]),
+    ("facilitydelivery", ["date", "facility", "item", "quantity"], ["facility", "date", "item"]),
+    ("need", ["item", "date", "quantity", "hospital", "satisfied"], ["hospital", "item", "date"]),
+    ("inventory", ["item", "quantity", "as_of"], ["item", "as_of"]),
+    ("demand", ["item", "demand", "start_date", "end_date"], ["item", "start_date", "end_date"]),
+    (
+        "inboundreceipt",
+        ["date_received", "supplier", "description", "quantity", "inbound_id", "item_id", "item"],
+        ["inbound_id", "item_id"],
+    ),
+]
+
+
+def _digest(values) -> str:
+    # as `ppe.models._digest`
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+
+def fingerprint_rows(apps, schema_editor):
+    """
+    Fingerprint the rows imported before 0029, so the verify page can compare imports made before it with newer
+    ones (see `ImportedDataModel.set_fingerprint`)
+    """
+    for model_name, field_names, diff_key in FINGERPRINTS:
+        model = apps.get_model("ppe", model_name)
+        fields = [model._meta.get_field(name) for name in field_names]
+        relations = [field.name for field in fields if field.is_relation]
+        last = None
+        while True:
+            rows = model.objects.filter(fingerprint="").select_related(*relations).order_by("pk")
+            if last is not None:
+                rows = rows.filter(pk__gt=last)
+            batch = list(rows[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                values = {}
+                for field in fields:
+                    if field.is_relation:
+                        # the related row, as it would be identified in another import
+                        related = getattr(row, field.name)
+                        values[field.name] = related.row_key if related is not None else None
+                    else:
+                        values[field.name] = field.to_python(getattr(row, field.attname))
+                row.fingerprint = _digest(list(values.values()))
+                row.row_key = _digest([values[name] for name in diff_key])
+            model.objects.bulk_update(batch, ["fingerprint", "row_key"])
+            last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # the imported data tables can be big: a batch per transaction
+    atomic = False
+
+    dependencies = [
+        ('ppe', '0039_importjob_append'),
+    ]
+
+    operations = [
+        migrations.RunPython(fingerprint_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-19 05:56
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_heartbeats(apps, schema_editor):
+    # jobs running as this is deployed count as last seen when they started
+    ImportJob = apps.get_model("ppe", "ImportJob")
+    ImportJob.objects.filter(status="running").update(heartbeat_at=F("started_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0040_backfill_row_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
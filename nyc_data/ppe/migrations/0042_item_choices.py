@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-19 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0041_importjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='demand',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None),
+        ),
+        migrations.AlterField(
+            model_name='facilitydelivery',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None),
+        ),
+        migrations.AlterField(
+            model_name='inboundreceipt',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None),
+        ),
+        migrations.AlterField(
+            model_name='inventory',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None),
+        ),
+        migrations.AlterField(
+            model_name='need',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')]),
+        ),
+        migrations.AlterField(
+            model_name='purchase',
+            name='item',
+            field=models.TextField(choices=[('faceshield', 'faceshield'), ('gown', 'gown'), ('gown_material', 'gown_material'), ('coveralls', 'coveralls'), ('ponchos', 'ponchos'), ('scrubs', 'scrubs'), ('aprons', 'aprons'), ('n95_mask_non_surgical', 'n95_mask_non_surgical'), ('n95_mask_surgical', 'n95_mask_surgical'), ('kn95_mask', 'kn95_mask'), ('surgical_mask', 'surgical_mask'), ('mask_other', 'mask_other'), ('goggles', 'goggles'), ('generic_eyeware', 'generic_eyeware'), ('gloves', 'gloves'), ('swab_kit', 'swab_kit'), ('boot_covers', 'boot_covers'), ('ventilators_full_service', 'ventilators_full_service'), ('ventilators_non_full_service', 'ventilators_non_full_service'), ('bipap_machines', 'bipap_machines'), ('hand_sanitizer', 'hand_sanitizer'), ('ppe_other', 'ppe_other'), ('unknown', 'unknown'), ('body_bags', 'body_bags')], default=None),
+        ),    ]
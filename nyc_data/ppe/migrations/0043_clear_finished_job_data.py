@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def clear_finished_job_data(apps, schema_editor):
+    # imported, or kept as a FailedImport: see `data_import.finish_import_job`. The space is reclaimed by the next
+    # (auto)vacuum of the table's TOAST
+    ImportJob = apps.get_model("ppe", "ImportJob")
+    ImportJob.objects.filter(status__in=["done", "failed"]).exclude(data=b"").update(data=b"")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0042_item_choices'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_finished_job_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-19 06:11
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppe', '0043_clear_finished_job_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedimport',
+            name='error_report',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='error_report',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,16 +1,35 @@
+import functools
+import gzip
+import hashlib
+import json
+import secrets
+import shutil
 import tempfile
 import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
 from enum import Enum
 from pathlib import Path
-from typing import NamedTuple, Dict
+from typing import NamedTuple, Dict, List, Optional
 
+import sentry_sdk
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import JSONField
-from django.db import models
-from django.db.models import Sum, Max, QuerySet
+from django.contrib.postgres.indexes import BrinIndex
+from django.core.files import File
+from django.core.files.storage import Storage, get_storage_class
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, QuerySet, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 import ppe.dataclasses as dc
 from ppe.data_mapping.types import DataFile
+from ppe.errors import FailedImportFileMissing
 
 
 def enum2choices(enum):
@@ -28,6 +47,8 @@ class ImportStatus(str, Enum):
     replaced = "replaced"
     candidate = "candidate"
     cancelled = "cancelled"
+    # pruned by `manage.py prune_imports`: its rows were dumped to `archive` and deleted
+    archived = "archived"
 
 
 class DataImport(models.Model):
@@ -42,25 +63,194 @@ class DataImport(models.Model):
     file_name = models.TextField()
     file = models.FileField
 
+    # progress of the import, written as it runs so the upload page can poll it
+    current_sheet = models.TextField(blank=True)
+    rows_parsed = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    # the errors and warnings of the import (see `ErrorCollector.report`)
+    error_report = JSONField(default=dict, blank=True)
+
+    # earlier imports of a time-series file whose rows are part of this one too (see `data_import.import_data`)
+    carried_forward = models.ManyToManyField(
+        "self", symmetrical=False, related_name="carried_into", blank=True
+    )
+
+    # where the rows of an archived import were dumped, in `retention.import_archive_storage()`, and when they were
+    # deleted
+    archive = models.TextField(blank=True)
+    pruned_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["data_file"],
+                condition=Q(status=ImportStatus.active),
+                name="one_active_import_per_data_file",
+            )
+        ]
+
     @classmethod
     def sanity(cls):
         # for each data_source, at most 1 active
-        for _, src in DataFile.__members__.items():
-            ct = DataImport.objects.filter(
-                data_file=src, status=ImportStatus.active
-            ).count()
-            if ct > 1:
-                print(f"Something is weird, more than one active object for {src}")
-                return False
+        duplicated = (
+            DataImport.objects.filter(status=ImportStatus.active)
+            .values("data_file")
+            .annotate(ct=Count("id"))
+            .filter(ct__gt=1)
+        )
+        for src in duplicated:
+            print(f"Something is weird, more than one active object for {src['data_file']}")
+            return False
         return True
 
     def cancel(self):
         self.status = ImportStatus.cancelled
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_status = instance.status
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or "status" in fields:
+            self._saved_status = self.status
+
+    def save(self, *args, update_fields=None, **kwargs):
+        saved_status = getattr(self, "_saved_status", None)
+        activation_changed = self.status != saved_status and ImportStatus.active in (
+            self.status,
+            saved_status,
+        )
+        if update_fields is not None and "status" not in update_fields:
+            activation_changed = False
+        with transaction.atomic():
+            super().save(*args, update_fields=update_fields, **kwargs)
+            if activation_changed:
+                DataImport.sync_active_rows(self.data_file)
+        self._saved_status = self.status
+
+    def delete(self, *args, **kwargs):
+        # partitions first: if dropping one fails, the import is still there to delete again
+        for model in partitioned_models():
+            drop_partition(model, self.id)
+        return super().delete(*args, **kwargs)
+
+    def create_partitions(self, models):
+        """
+        Add a partition for the rows of this import to the table of each of `models` that is partitioned (and
+        doesn't have one yet).
+
+        The partition is created on its own and then attached. Before Postgres 12 attaching takes an ACCESS EXCLUSIVE
+        lock on the table, so readers queue behind it (and it behind queries already running on the table) until
+        the transaction ends; the partition is empty, so that is only as long as it takes to update the catalog.
+        Attaching also locks the tables the partition refers to against writes until the transaction ends, so do it
+        before a long running one.
+        """
+        if not hasattr(self, "_partitions"):
+            self._partitions = set()
+        with connection.cursor() as cursor:
+            for model in models:
+                if not model.partitioned or model in self._partitions:
+                    continue
+                if self.id < model.first_partitioned_import():
+                    # its rows are in the partition of the imports that predate partitioning
+                    self._partitions.add(model)
+                    continue
+                partition = model.partition_name(self.id)
+                cursor.execute("SELECT to_regclass(%s)", [partition])
+                if cursor.fetchone()[0] is None:
+                    table = connection.ops.quote_name(model._meta.db_table)
+                    cursor.execute(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)")
+                    cursor.execute(
+                        f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)",
+                        [self.id, self.id + 1],
+                    )
+                self._partitions.add(model)
+
+    @classmethod
+    def active_sources(cls):
+        """
+        Imports whose rows make up the active data: the active imports and whatever they carry forward
+        """
+        return cls.objects.filter(
+            Q(status=ImportStatus.active) | Q(carried_into__status=ImportStatus.active)
+        ).values("id")
+
+    @classmethod
+    def sync_active_rows(cls, data_file: DataFile):
+        """
+        Set `ImportedDataModel.is_active` on the rows of `data_file`'s imports to match `active_sources`. Only rows
+        whose import was activated or replaced are written.
+
+        That is still every row of the old generation and the new one, so an activation takes as many row locks
+        (held until it commits) and leaves as many dead tuples as the two imports have rows. Readers aren't blocked
+        by them, and nothing else writes those rows: it is the price of reading the active rows without joining
+        `DataImport`.
+        """
+        imports = cls.objects.filter(data_file=data_file).values("id")
+        active_sources = cls.active_sources().filter(data_file=data_file)
+        for model in imported_data_models():
+            model.objects.filter(is_active=True, source__in=imports).exclude(
+                source__in=active_sources
+            ).update(is_active=False)
+            model.objects.filter(is_active=False, source__in=active_sources).update(
+                is_active=True
+            )
+        refresh_snapshots_after_commit()
+
+    def sources(self):
+        return [self.id, *self.carried_forward.values_list("id", flat=True)]
+
+    def record_progress(self, **progress):
+        for field, value in progress.items():
+            setattr(self, field, value)
+        progress_connection = getattr(self, "_progress_connection", None)
+        if progress_connection is None:
+            self.save(update_fields=list(progress.keys()))
+            return
+        fields = [self._meta.get_field(name) for name in progress]
+        assignments = ", ".join(f"{connection.ops.quote_name(field.column)} = %s" for field in fields)
+        with progress_connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {connection.ops.quote_name(self._meta.db_table)} SET {assignments} WHERE id = %s",
+                [
+                    *(field.get_db_prep_save(progress[field.name], progress_connection) for field in fields),
+                    self.id,
+                ],
+            )
+
+    @contextmanager
+    def progress_outside_transaction(self):
+        """
+        Have `record_progress` write through a database connection of its own meanwhile: written in the (single,
+        long running) transaction of an import, the upload page wouldn't see any progress until it commits.
+
+        Only for a transaction that isn't part of a larger one (e.g. a test's), which could lock the tables the
+        progress is written to. The import's transaction must not update this import itself meanwhile, or the two
+        would wait for each other.
+        """
+        if connection.in_atomic_block:
+            yield
+            return
+        progress_connection = connection.copy()
+        progress_connection.connect()
+        self._progress_connection = progress_connection
+        try:
+            yield
+        finally:
+            del self._progress_connection
+            progress_connection.close()
+
     def display(self):
         return f'File uploaded {self.import_date.strftime("%d/%m/%y")} by {self.uploaded_by or "unknown"}. Filename: {self.file_name}'
 
-    def compute_delta(self):
+    def compute_delta(self, page: int = 0):
+        """
+        What changes if this import is activated, by comparing the fingerprints of its rows with those of
+        the active import (see `ImportedDataModel.row_key`). Only counts and one page of samples are loaded.
+        """
         if not self.sanity():
             raise Exception(
                 "Can't compute a delta. Something is horribly wrong in the DB"
@@ -71,50 +261,157 @@ class DataImport(models.Model):
         active_import = DataImport.objects.filter(
             status=ImportStatus.active, data_file=self.data_file
         ).first()
+        active_sources = active_import.sources() if active_import else []
+        candidate_sources = self.sources()
 
-        if active_import:
-            active_objects = active_import.imported_objects()
-        else:
-            active_objects = {}
-
-        new_objects = {
-            k: set(objs).difference(active_objects.get(k))
-            if k in active_objects.keys()
-            else set(objs)
-            for k, objs in self.imported_objects().items()
-        }
-
+        diffs = [
+            RowDiff.compute(tpe, candidate_sources, active_sources, page)
+            for tpe in IMPORTED_MODELS
+        ]
         return UploadDelta(
             previous=active_import,
             active_stats={
-                tpe.__name__: len(objs) for (tpe, objs) in active_objects.items()
+                diff.model: diff.active_rows for diff in diffs if diff.active_rows
             },
             candidate_stats={
-                tpe.__name__: len(objs)
-                for (tpe, objs) in self.imported_objects().items()
+                diff.model: diff.candidate_rows for diff in diffs if diff.candidate_rows
             },
-            new_objects=new_objects,
+            diffs=[diff for diff in diffs if diff.any_changes()],
+            comparable=not any(diff.unfingerprinted for diff in diffs),
+            page=page,
         )
 
     def imported_objects(self):
+        sources = self.sources()
         return {
-            tpe: tpe.objects.prefetch_related("source").filter(source=self)
-            for tpe in [
-                ScheduledDelivery,
-                Inventory,
-                Purchase,
-                FacilityDelivery,
-                Demand,
-            ]
+            tpe: tpe.objects.prefetch_related("source").filter(source__in=sources)
+            for tpe in IMPORTED_MODELS
         }
 
 
+# rows are compared by `row_key`; several rows can share a key, so all of their fingerprints are compared at once
+_ROW_DIFF_SQL = """
+WITH candidate AS (
+    SELECT row_key, count(*) AS rows, md5(string_agg(fingerprint, ',' ORDER BY fingerprint)) AS content
+    FROM {table} WHERE source_id = ANY(%(candidate)s) GROUP BY row_key
+), active AS (
+    SELECT row_key, count(*) AS rows, md5(string_agg(fingerprint, ',' ORDER BY fingerprint)) AS content
+    FROM {table} WHERE source_id = ANY(%(active)s) GROUP BY row_key
+), diff AS (
+    SELECT
+        row_key,
+        CASE
+            WHEN active.row_key IS NULL THEN 'added'
+            WHEN candidate.row_key IS NULL THEN 'removed'
+            WHEN candidate.content <> active.content THEN 'changed'
+            ELSE 'unchanged'
+        END AS kind,
+        coalesce(candidate.rows, 0) AS candidate_rows,
+        coalesce(active.rows, 0) AS active_rows
+    FROM candidate FULL OUTER JOIN active USING (row_key)
+)
+"""
+
+
+class DiffSample(NamedTuple):
+    kind: str
+    # the rows with this key in the candidate and the active import, described by `ImportedDataModel.describe`
+    candidate: List[str]
+    active: List[str]
+
+
+class RowDiff(NamedTuple):
+    model: str
+    candidate_rows: int
+    active_rows: int
+    added: int
+    removed: int
+    changed: int
+    samples: List[DiffSample]
+    # whether any of the rows were imported before fingerprints were recorded
+    unfingerprinted: bool
+
+    KINDS = ["added", "removed", "changed"]
+    SAMPLES_PER_PAGE = 10
+
+    def any_changes(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @classmethod
+    def compute(cls, tpe, candidate_sources, active_sources, page: int = 0):
+        params = dict(candidate=list(candidate_sources), active=list(active_sources))
+        sql = _ROW_DIFF_SQL.format(table=tpe._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql
+                + "SELECT kind, count(*), sum(candidate_rows)::int, sum(active_rows)::int, bool_or(row_key = '') "
+                "FROM diff GROUP BY kind",
+                params,
+            )
+            counts = {}
+            unfingerprinted = False
+            for kind, keys, candidate_rows, active_rows, unset in cursor.fetchall():
+                counts[kind] = (keys, candidate_rows, active_rows)
+                unfingerprinted |= unset
+
+        samples = []
+        for kind in cls.KINDS:
+            if kind not in counts or counts[kind][0] <= page * cls.SAMPLES_PER_PAGE:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    sql
+                    + "SELECT row_key FROM diff WHERE kind = %(kind)s ORDER BY row_key LIMIT %(limit)s OFFSET %(offset)s",
+                    dict(
+                        params,
+                        kind=kind,
+                        limit=cls.SAMPLES_PER_PAGE,
+                        offset=page * cls.SAMPLES_PER_PAGE,
+                    ),
+                )
+                keys = [row_key for row_key, in cursor.fetchall()]
+            samples += cls._samples(tpe, kind, keys, candidate_sources, active_sources)
+
+        return cls(
+            model=tpe.__name__,
+            candidate_rows=sum(c for _, c, _ in counts.values()),
+            active_rows=sum(a for _, _, a in counts.values()),
+            samples=samples,
+            unfingerprinted=unfingerprinted,
+            **{kind: counts.get(kind, (0,))[0] for kind in cls.KINDS},
+        )
+
+    @staticmethod
+    def _samples(tpe, kind, keys, candidate_sources, active_sources):
+        by_key = {key: ([], []) for key in keys}
+        rows = tpe.objects.filter(
+            source__in=[*candidate_sources, *active_sources], row_key__in=keys
+        ).order_by("row_key", "fingerprint")
+        if any(f.name == "purchase" for f in tpe._meta.fields):
+            rows = rows.select_related("purchase")
+        for row in rows:
+            by_key[row.row_key][0 if row.source_id in candidate_sources else 1].append(
+                row.describe()
+            )
+        return [DiffSample(kind, candidate, active) for candidate, active in by_key.values()]
+
+
 class UploadDelta(NamedTuple):
     previous: DataImport
     active_stats: Dict[str, int]
     candidate_stats: Dict[str, int]
 
-    new_objects: Dict[str, any]
+    # models with any added, removed or changed rows
+    diffs: List[RowDiff]
+    # false when either import predates row fingerprints, so every row would look added or removed
+    comparable: bool
+    page: int
+
+    def has_next_page(self):
+        return any(
+            max(diff.added, diff.removed, diff.changed) > (self.page + 1) * RowDiff.SAMPLES_PER_PAGE
+            for diff in self.diffs
+        )
 
 
 def current_as_of(qs: QuerySet):
@@ -123,18 +420,130 @@ def current_as_of(qs: QuerySet):
     return qs.first().source.current_as_of or "Unknown"
 
 
+_UNFINGERPRINTED_FIELDS = {
+    "id",
+    "created_at",
+    "updated_at",
+    "source",
+    "raw_row",
+    "row_key",
+    "fingerprint",
+    "is_active",
+}
+
+
+def _digest(values) -> str:
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+
+# for `DataImport.compute_delta`
+_ROW_DIFF_INDEX = models.Index(fields=["source", "row_key", "fingerprint"], name="%(class)s_row_diff")
+# for `active()`, which only reads the active rows. Models with a more specific partial index of their active rows
+# leave it out
+_ACTIVE_INDEX = models.Index(fields=["source"], condition=Q(is_active=True), name="%(class)s_active")
+
+
+@functools.lru_cache()
+def _first_partitioned_import(table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT substring(pg_get_expr(relpartbound, oid) FROM 'TO \\((\\d+)\\)') FROM pg_class WHERE relname = %s",
+            [f"{table}_legacy"],
+        )
+        return int(cursor.fetchone()[0])
+
+
 class ImportedDataModel(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     source = models.ForeignKey(DataImport, on_delete=models.CASCADE)
 
+    # Fingerprints for diffing imports (see `DataImport.compute_delta`): `row_key` hashes the `diff_key` fields,
+    # which identify "the same" row in two imports of a file, and `fingerprint` hashes all of the imported fields.
+    # Both are set by `set_fingerprint` when the row is written
+    row_key = models.CharField(max_length=32, default="", editable=False)
+    fingerprint = models.CharField(max_length=32, default="", editable=False)
+
+    # whether `source` is one of `DataImport.active_sources()`, so reading the active data doesn't need a join.
+    # Kept in sync by `DataImport.sync_active_rows` whenever an import is activated or replaced
+    is_active = models.BooleanField(default=False, editable=False)
+
+    # empty: rows are only ever added or removed, never changed
+    diff_key = ()
+
+    # whether the table is range partitioned by `source`, each import's rows in a partition of their own (see
+    # `DataImport.create_partitions`), so an import's rows can be dropped with its partition instead of row by row
+    partitioned = False
+
     @classmethod
-    def active(cls):
-        return cls.objects.prefetch_related("source").filter(
-            source__status=ImportStatus.active
+    def partition_name(cls, data_import_id: int) -> str:
+        return f"{cls._meta.db_table}_{data_import_id}"
+
+    @classmethod
+    def first_partitioned_import(cls) -> int:
+        """
+        The first import with a partition of its own: the rows of earlier ones are in `<table>_legacy`
+        """
+        return _first_partitioned_import(cls._meta.db_table)
+
+    @classmethod
+    def fingerprint_fields(cls):
+        if "_fingerprint_fields" not in cls.__dict__:
+            cls._fingerprint_fields = [
+                field
+                for field in cls._meta.concrete_fields
+                if field.name not in _UNFINGERPRINTED_FIELDS
+            ]
+        return cls._fingerprint_fields
+
+    def fingerprint_values(self):
+        values = {}
+        for field in self.fingerprint_fields():
+            if field.is_relation:
+                # the related row, as it would be identified in another import
+                related = field.get_cached_value(self, default=None)
+                if related is not None:
+                    if not related.row_key:
+                        related.set_fingerprint()
+                    values[field.name] = related.row_key
+                else:
+                    values[field.name] = getattr(self, field.attname)
+            else:
+                # as it will be read back, eg. a date rather than the datetime a mapper parsed
+                value = field.to_python(getattr(self, field.attname))
+                values[field.name] = value.value if isinstance(value, Enum) else value
+        return values
+
+    def set_fingerprint(self):
+        values = self.fingerprint_values()
+        self.fingerprint = _digest(list(values.values()))
+        self.row_key = _digest(
+            [values[name] for name in self.diff_key] if self.diff_key else self.fingerprint
         )
 
+    def describe(self):
+        return ", ".join(
+            f"{name}: {value}" for name, value in self.fingerprint_values().items()
+        )
+
+    def save(self, *args, **kwargs):
+        if not self.row_key:
+            self.set_fingerprint()
+        if self._state.adding and self.source_id is not None:
+            # imports are written as candidates, but rows can be added to an active one directly too
+            self.is_active = self.source.status == ImportStatus.active
+            if self.partitioned:
+                # usually created up front by `data_import.import_data`, for all of the rows of a file
+                self.source.create_partitions([type(self)])
+        super().save(*args, **kwargs)
+        if self.is_active:
+            refresh_snapshots_after_commit()
+
+    @classmethod
+    def active(cls):
+        return cls.objects.filter(is_active=True)
+
     def check_cached(self, field):
         """
         Helper wrapper to log a warning if a related field isn't cached
@@ -155,9 +564,78 @@ class ImportedDataModel(models.Model):
 
     class Meta:
         abstract = True
+        indexes = [_ROW_DIFF_INDEX, _ACTIVE_INDEX]
+
+
+@functools.lru_cache(maxsize=1024)
+def _encode_raw_row(serialized: str):
+    # fan-out rows (eg. one InventoryRow -> 20+ Inventory objects) hand us the same string over and over
+    encoded = serialized.encode()
+    return hashlib.sha256(encoded).hexdigest(), zlib.compress(encoded)
+
+
+class RawRow(models.Model):
+    """
+    A source spreadsheet row, stored once as compressed JSON and shared by every object generated from it.
+    Rows are keyed by a checksum of their contents, so a row repeated across uploads is only stored once.
+    """
+
+    checksum = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+
+    @classmethod
+    def from_data(cls, raw_data) -> "RawRow":
+        if not isinstance(raw_data, str):
+            raw_data = json.dumps(raw_data, cls=DjangoJSONEncoder)
+        checksum, data = _encode_raw_row(raw_data)
+        return cls(checksum=checksum, data=data)
+
+    @classmethod
+    def save_all(cls, raw_rows):
+        """
+        Insert any of `raw_rows` that aren't stored yet in a single query
+        """
+        raw_rows = list(raw_rows)
+        unique = {raw_row.checksum: raw_row for raw_row in raw_rows}
+        cls.objects.bulk_create(unique.values(), ignore_conflicts=True)
+        for raw_row in raw_rows:
+            raw_row._state.adding = False
+
+    def load(self):
+        return json.loads(zlib.decompress(self.data))
+
+
+class RawDataModel(ImportedDataModel):
+    """
+    Imported data that keeps a reference to the spreadsheet row it came from. The payload lives in `RawRow`, so
+    querying these models never loads it unless you ask for `raw_data` (use `select_related("raw_row")` in bulk).
+    """
+
+    raw_row = models.ForeignKey(
+        RawRow, null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+
+    @property
+    def raw_data(self):
+        return self.raw_row.load() if self.raw_row_id else None
+
+    @raw_data.setter
+    def raw_data(self, value):
+        self.raw_row = RawRow.from_data(value) if value else None
+
+    def save(self, *args, **kwargs):
+        raw_row = self.__class__.raw_row.field.get_cached_value(self, default=None)
+        if raw_row is not None and raw_row._state.adding:
+            RawRow.save_all([raw_row])
+        super().save(*args, **kwargs)
+
+    class Meta(ImportedDataModel.Meta):
+        abstract = True
 
 
-class Purchase(ImportedDataModel):
+class Purchase(RawDataModel):
+    diff_key = ("order_type", "item", "vendor", "description")
+
     order_type = ChoiceField(dc.OrderType)
 
     item = ChoiceField(dc.Item)
@@ -172,11 +650,34 @@ class Purchase(ImportedDataModel):
     donation_date = models.DateField(null=True, blank=True, default=None)
     comment = models.TextField(blank=True)
 
-    raw_data = JSONField()
+    @classmethod
+    def with_delivery_totals(cls, purchases: QuerySet) -> QuerySet:
+        """
+        Annotate `purchases` with what `total_deliveries` (`scheduled_total`) and `unscheduled_quantity`
+        (`unscheduled`) would otherwise query for each purchase
+        """
+        scheduled_total = (
+            ScheduledDelivery.objects.filter(purchase=OuterRef("pk"))
+            .order_by()
+            .values("purchase")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+        return purchases.annotate(
+            scheduled_total=Subquery(scheduled_total, output_field=models.IntegerField())
+        ).annotate(
+            unscheduled=Case(
+                When(received_quantity=F("quantity"), then=0),
+                default=F("quantity") - Coalesce("scheduled_total", 0),
+                output_field=models.IntegerField(),
+            )
+        )
 
     @property
     def total_deliveries(self):
-        # WARNING: I this doesn't seem to be prefetched.
+        if hasattr(self, "scheduled_total"):
+            return self.scheduled_total
+        # one query per purchase: see `with_delivery_totals`
         return self.deliveries.aggregate(Sum("quantity"))["quantity__sum"]
 
     @property
@@ -185,20 +686,32 @@ class Purchase(ImportedDataModel):
 
     @property
     def unscheduled_quantity(self):
+        if hasattr(self, "unscheduled"):
+            return self.unscheduled
         if self.received_quantity == self.quantity:
             return 0
         else:
 
             return self.quantity - (self.total_deliveries or 0)
 
+    class Meta(RawDataModel.Meta):
+        indexes = [
+            _ROW_DIFF_INDEX,
+            # `Purchase.active().filter(order_type=...)`, the drilldown's items
+            models.Index(
+                fields=["order_type", "item"], condition=Q(is_active=True), name="purchase_active_type"
+            ),
+        ]
+
+
+class Inventory(RawDataModel):
+    diff_key = ("item", "as_of")
+    partitioned = True
 
-class Inventory(ImportedDataModel):
     item = ChoiceField(dc.Item)
     quantity = models.IntegerField()
     as_of = models.DateField()
 
-    raw_data = JSONField()
-
     @classmethod
     def as_of_latest(cls):
         return super().active().aggregate(Max("as_of"))["as_of__max"]
@@ -207,37 +720,304 @@ class Inventory(ImportedDataModel):
     def active(cls):
         return super().active().filter(as_of=cls.as_of_latest())
 
+    class Meta(RawDataModel.Meta):
+        indexes = [
+            _ROW_DIFF_INDEX,
+            # `as_of_latest` reads the max off the index, `active` the rows as of that date
+            models.Index(
+                fields=["as_of", "item"], condition=Q(is_active=True), name="inventory_active_as_of"
+            ),
+        ]
+
+
+def failed_import_storage() -> Storage:
+    return get_storage_class(settings.FAILED_IMPORT_STORAGE)(location=settings.FAILED_IMPORT_ROOT)
+
+
+# chunk size when compressing and decompressing failed uploads
+FAILED_IMPORT_CHUNK_SIZE = 64 * 1024
+
 
 class FailedImport(models.Model):
-    data = models.BinaryField(blank=False)
+    """
+    An upload that couldn't be imported. The file itself is kept gzipped in `failed_import_storage()`, named by
+    its checksum, so the same file failing repeatedly is stored once. It is deleted once every upload of it is fixed.
+    """
+
+    checksum = models.CharField(max_length=64, db_index=True)
     file_name = models.TextField()
     uploaded_at = models.DateTimeField(auto_now_add=True, db_index=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     current_as_of = models.DateField()
     fixed = models.BooleanField(default=False)
+    # what was wrong with its rows, as far as the import got (see `ErrorCollector.report`)
+    error_report = JSONField(default=dict, blank=True)
 
-    def retry(self):
-        with tempfile.NamedTemporaryFile(
-            "w+b", delete=False, suffix=self.file_name
-        ) as f:
-            f.write(self.data)
+    @staticmethod
+    def stored_name(checksum: str) -> str:
+        return f"{checksum[:2]}/{checksum}.gz"
+
+    @classmethod
+    def store(cls, f, checksum: str, **fields) -> "FailedImport":
+        """
+        Save a FailedImport for the (already written) file `f`, compressing it into storage unless a file with the
+        same checksum is there already
+        """
+        # saved first, so the file isn't discarded for a fixed upload of it meanwhile (see `discard_file`)
+        failed_import = cls(checksum=checksum, **fields)
+        failed_import.save()
+        storage = failed_import_storage()
+        name = cls.stored_name(checksum)
+        if not storage.exists(name):
+            f.seek(0)
+            with tempfile.TemporaryFile() as compressed:
+                with gzip.GzipFile(fileobj=compressed, mode="wb") as gz:
+                    shutil.copyfileobj(f, gz, FAILED_IMPORT_CHUNK_SIZE)
+                compressed.seek(0)
+                saved = storage.save(name, File(compressed))
+            if saved != name:
+                # stored concurrently by someone else
+                storage.delete(saved)
+        return failed_import
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.fixed:
+            # nothing left to retry
+            self.discard_file()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.discard_file()
+        return result
+
+    def discard_file(self):
+        """
+        Delete the stored upload, unless an upload of the same file is still to be fixed or a retry of one is still
+        queued or running
+        """
+        unfixed = FailedImport.objects.filter(checksum=self.checksum, fixed=False)
+        retrying = ImportJob.objects.filter(
+            failed_import__checksum=self.checksum,
+            status__in=[ImportJobStatus.queued, ImportJobStatus.running],
+        )
+        if not unfixed.exists() and not retrying.exists():
+            failed_import_storage().delete(self.stored_name(self.checksum))
+
+    def open(self):
+        """
+        The original upload, decompressed as it is read
+
+        :raises FailedImportFileMissing: if the stored file is gone
+        """
+        storage = failed_import_storage()
+        name = self.stored_name(self.checksum)
+        try:
+            stored = storage.open(name)
+        except OSError as ex:
+            if storage.exists(name):
+                raise
+            raise FailedImportFileMissing(self.id) from ex
+        return gzip.GzipFile(fileobj=stored)
+
+    @contextmanager
+    def local_copy(self):
+        """
+        The upload as a file on disk: spreadsheets need random access, so it is decompressed to a scratch file a
+        chunk at a time
+        """
+        with tempfile.NamedTemporaryFile("w+b", suffix=self.file_name) as f:
+            with self.open() as stored:
+                shutil.copyfileobj(stored, f, FAILED_IMPORT_CHUNK_SIZE)
             f.flush()
+            yield Path(f.name)
 
+    def retry(self, import_job: Optional["ImportJob"] = None, error_collector=None) -> "DataImport":
+        """
+        Import and activate the upload again (e.g. after a fix to its mapping)
+
+        :param error_collector: see `data_import.import_data`
+        """
+        with self.local_copy() as path:
             from ppe.data_import import smart_import, finalize_import
 
             import_obj = smart_import(
-                path=Path(f.name),
+                path=path,
                 uploader_name=self.uploaded_by.username,
                 current_as_of=self.current_as_of,
                 user_provided_name=self.file_name,
                 overwrite_in_prog=True,
+                checksum=self.checksum,
+                import_job=import_job,
+                error_collector=error_collector,
             )
             finalize_import(import_obj)
             self.fixed = True
             self.save()
+        return import_obj
+
+    def queue_retry(self) -> Optional["ImportJob"]:
+        """
+        Retry the upload in `manage.py import_worker` instead, unless it is fixed already or a retry of it is
+        already queued or running
+
+        :return: the queued job, or None if there was nothing to queue
+        """
+        with transaction.atomic():
+            # one retry at a time, however many admins ask for one
+            failed_import = FailedImport.objects.select_for_update().get(id=self.id)
+            pending = failed_import.retries.filter(
+                status__in=[ImportJobStatus.queued, ImportJobStatus.running]
+            )
+            if failed_import.fixed or pending.exists():
+                return None
+            job = ImportJob(
+                data=b"",
+                file_name=self.file_name,
+                uploaded_by=self.uploaded_by,
+                current_as_of=self.current_as_of,
+                failed_import=self,
+            )
+            job.save()
+        return job
+
+
+class ImportJobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ImportJob(models.Model):
+    """
+    An upload waiting to be imported (or being imported) by `manage.py import_worker`, off the request path.
+    """
+
+    status = ChoiceField(ImportJobStatus, default=ImportJobStatus.queued, db_index=True)
+    # the upload, until the job is done or failed (see `data_import.finish_import_job`)
+    data = models.BinaryField(blank=False)
+    file_name = models.TextField()
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    current_as_of = models.DateField()
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    # last seen alive by the worker running it (see `settings.IMPORT_JOB_HEARTBEAT`)
+    heartbeat_at = models.DateTimeField(null=True)
+
+    data_import = models.ForeignKey(DataImport, null=True, on_delete=models.SET_NULL)
+    # set for retries of a failed upload, which are imported from its stored file rather than `data`
+    failed_import = models.ForeignKey(
+        FailedImport, null=True, on_delete=models.CASCADE, related_name="retries"
+    )
+    # False to re-import every date of a time-series file (see `data_import.import_data`)
+    append = models.BooleanField(default=True)
+    error = models.TextField(blank=True)
+    # of a failed job, as far as the import got (see `ErrorCollector.report`)
+    error_report = JSONField(default=dict, blank=True)
+    # set when the job failed because another import of the same file type is waiting to be verified
+    import_in_progress = models.IntegerField(null=True)
+
+    @classmethod
+    def claim_next(cls, ids: Optional[List[int]] = None) -> Optional["ImportJob"]:
+        """
+        Mark the oldest queued job (of `ids`, if given) as running and return it. Safe to call from several workers
+        at once.
+        """
+        cls.requeue_stale()
+        queued = cls.objects.filter(status=ImportJobStatus.queued)
+        if ids is not None:
+            queued = queued.filter(id__in=ids)
+        with transaction.atomic():
+            job = queued.select_for_update(skip_locked=True).order_by("created_at").first()
+            if job is not None:
+                job.status = ImportJobStatus.running
+                job.started_at = job.heartbeat_at = timezone.now()
+                job.save(update_fields=["status", "started_at", "heartbeat_at"])
+        return job
+
+    @classmethod
+    def requeue_stale(cls) -> int:
+        """
+        Queue the running jobs whose worker hasn't sent a heartbeat for `settings.IMPORT_JOB_STALE_AFTER` seconds
+        again, discarding the import they were in the middle of: the worker died (or lost the database) without
+        recording an outcome.
+
+        :return: the number of jobs queued again
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+        requeued = 0
+        with transaction.atomic():
+            stale = cls.objects.select_for_update(skip_locked=True).filter(
+                status=ImportJobStatus.running, heartbeat_at__lt=cutoff
+            )
+            for job in stale:
+                # an import is finished once its error report is saved; the rows of an unfinished one were rolled
+                # back with the worker's transaction, and a retry of the file mustn't be matched against it
+                interrupted = job.data_import
+                if (
+                    interrupted is not None
+                    and interrupted.status == ImportStatus.candidate
+                    and not interrupted.error_report
+                ):
+                    interrupted.delete()
+                job.status = ImportJobStatus.queued
+                job.data_import = job.started_at = job.heartbeat_at = None
+                job.save(update_fields=["status", "data_import", "started_at", "heartbeat_at"])
+                requeued += 1
+        return requeued
+
+    def beat(self):
+        """
+        Record that the worker running this job is still alive
+        """
+        ImportJob.objects.filter(id=self.id, status=ImportJobStatus.running).update(heartbeat_at=timezone.now())
+
+    @contextmanager
+    def local_copy(self):
+        """
+        The file to import, on disk
+        """
+        if self.failed_import_id is not None:
+            with self.failed_import.local_copy() as path:
+                yield path
+            return
+        with tempfile.NamedTemporaryFile("w+b", suffix=self.file_name) as f:
+            f.write(self.data)
+            f.flush()
+            yield Path(f.name)
+
+    def seconds(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def progress(self):
+        data_import = self.data_import
+        return dict(
+            status=self.status,
+            error=self.error,
+            current_sheet=data_import.current_sheet if data_import else "",
+            rows_parsed=data_import.rows_parsed if data_import else 0,
+            rows_written=data_import.rows_written if data_import else 0,
+        )
+
+    class Meta:
+        indexes = [
+            # `claim_next`: only the (few) queued jobs, oldest first
+            models.Index(
+                fields=["created_at"],
+                condition=Q(status=ImportJobStatus.queued),
+                name="importjob_queue",
+            )
+        ]
 
 
 class ScheduledDelivery(ImportedDataModel):
+    diff_key = ("purchase", "delivery_date")
+
     purchase = models.ForeignKey(
         Purchase, on_delete=models.CASCADE, related_name="deliveries"
     )
@@ -266,8 +1046,19 @@ class ScheduledDelivery(ImportedDataModel):
             source=self.source.display(),
         )
 
+    class Meta(ImportedDataModel.Meta):
+        indexes = [
+            _ROW_DIFF_INDEX,
+            # the rollups' and forecasts' deliveries in a period
+            models.Index(
+                fields=["delivery_date"], condition=Q(is_active=True), name="scheduleddelivery_active_date"
+            ),
+        ]
+
 
 class InboundReceipt(ImportedDataModel):
+    diff_key = ("inbound_id", "item_id")
+
     date_received = models.DateTimeField()
     supplier = ChoiceField(dc.Supplier)
     description = models.TextField()
@@ -278,20 +1069,40 @@ class InboundReceipt(ImportedDataModel):
 
 
 class Facility(ImportedDataModel):
+    diff_key = ("name",)
+
     name = models.TextField(db_index=True)
     tpe = ChoiceField(dc.FacilityType)
 
 
 class FacilityDelivery(ImportedDataModel):
+    diff_key = ("facility", "date", "item")
+    # a cumulative sheet is imported every day
+    partitioned = True
+
     date = models.DateField()
     facility = models.ForeignKey(Facility, null=True, on_delete=models.CASCADE)
     item = ChoiceField(dc.Item)
     quantity = models.IntegerField()
 
+    class Meta(ImportedDataModel.Meta):
+        indexes = [
+            _ROW_DIFF_INDEX,
+            # `aggregations.deliveries_for_period`
+            models.Index(
+                fields=["date", "item"], condition=Q(is_active=True), name="facilitydelivery_active_date"
+            ),
+            # the table is appended to a day at a time (see `data_import.new_series_rows`), so a tiny BRIN index
+            # covers date ranges across every import
+            BrinIndex(fields=["date"], name="facilitydelivery_date_brin"),
+        ]
+
 
 class Demand(ImportedDataModel):
     """Real demand data from NYC"""
 
+    diff_key = ("item", "start_date", "end_date")
+
     item = ChoiceField(dc.Item)
     demand = models.IntegerField()
     # both start and end are inclusive
@@ -300,12 +1111,16 @@ class Demand(ImportedDataModel):
 
 
 class Hospital(ImportedDataModel):
+    diff_key = ("name",)
+
     # TODO: need to figure out what resolution is needed. Could bring in the full geocoding hospital
     # model from covidhospitalstatus
     name = models.TextField()
 
 
 class Need(ImportedDataModel):
+    diff_key = ("hospital", "item", "date")
+
     item = models.TextField(choices=enum2choices(dc.Item))
     date = models.DateField()
 
@@ -313,3 +1128,185 @@ class Need(ImportedDataModel):
     hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE)
 
     satisfied = models.BooleanField()
+
+
+class DataFileLockStats(models.Model):
+    """
+    How contended the per-DataFile import locks are (see `ppe.locks.data_file_lock`), across every process
+    """
+
+    data_file = ChoiceField(DataFile)
+    # "import" or "finalize"
+    operation = models.TextField()
+    acquisitions = models.IntegerField(default=0)
+    # acquisitions that had to wait for another process
+    contended = models.IntegerField(default=0)
+    wait_seconds = models.FloatField(default=0)
+    max_wait_seconds = models.FloatField(default=0)
+    last_contended_at = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = [("data_file", "operation")]
+        verbose_name_plural = "data file lock stats"
+
+
+class MaterializedView(models.Model):
+    """
+    A read-only model over a materialized view of the active imports (created by its migration).
+    Refreshed whenever the active rows change, see `refresh_snapshots_after_commit`.
+    """
+
+    @classmethod
+    def refresh(cls):
+        with connection.cursor() as cursor:
+            # needs a unique index on the view, but doesn't block readers while it runs
+            cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {cls._meta.db_table}")
+
+    class Meta:
+        abstract = True
+        managed = False
+
+
+class ActiveDelivery(MaterializedView):
+    """
+    An active `ScheduledDelivery`, with the fields of its purchase that the dashboard and drilldown show
+    """
+
+    id = models.UUIDField(primary_key=True)
+    source = models.ForeignKey(DataImport, on_delete=models.DO_NOTHING, related_name="+")
+    purchase = models.ForeignKey(Purchase, on_delete=models.DO_NOTHING, related_name="+")
+    delivery_date = models.DateField(null=True)
+    quantity = models.IntegerField()
+    item = ChoiceField(dc.Item)
+    order_type = ChoiceField(dc.OrderType)
+    vendor = models.TextField()
+    description = models.TextField(blank=True)
+
+    class Meta(MaterializedView.Meta):
+        db_table = "ppe_activedelivery"
+
+
+class ActiveItemTotals(MaterializedView):
+    """
+    Per item: the latest active inventory and the outstanding active donations
+    """
+
+    item = ChoiceField(dc.Item, primary_key=True)
+    inventory = models.IntegerField()
+    donated = models.IntegerField()
+
+    class Meta(MaterializedView.Meta):
+        db_table = "ppe_activeitemtotals"
+        verbose_name_plural = "active item totals"
+
+
+def refresh_snapshots():
+    for view in [ActiveDelivery, ActiveItemTotals]:
+        view.refresh()
+
+
+def refresh_snapshots_after_commit():
+    """
+    Refresh the materialized views once the changes to the active rows made in the current transaction are
+    committed (right away outside of one), however many changes it makes
+    """
+    savepoints = set(connection.savepoint_ids)
+    # already registered by a change that can only be rolled back together with this one
+    if any(
+        func is _refresh_snapshots_safely and sids <= savepoints
+        for sids, func in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_refresh_snapshots_safely)
+
+
+def _refresh_snapshots_safely():
+    try:
+        refresh_snapshots()
+    except Exception as ex:
+        # the change is committed either way; the dashboard lags behind until the next refresh
+        sentry_sdk.capture_exception(ex)
+
+
+def imported_data_models() -> List[type]:
+    return [model for model in apps.get_models() if issubclass(model, ImportedDataModel)]
+
+
+def partitioned_models() -> List[type]:
+    return [model for model in imported_data_models() if model.partitioned]
+
+
+def drop_partition(model, data_import_id: int) -> int:
+    """
+    Detach and drop the partition of `model` holding the rows of an import, if it has one
+
+    :return: the number of rows dropped
+    """
+    partition = model.partition_name(data_import_id)
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [partition])
+        if cursor.fetchone()[0] is None:
+            return 0
+        cursor.execute(f"SELECT count(*) FROM {partition}")
+        (rows,) = cursor.fetchone()
+        # concurrently (Postgres 14 and up), readers of the table aren't blocked; that can't be done in a transaction
+        # though. Otherwise detaching takes an ACCESS EXCLUSIVE lock on the table, held until the transaction ends.
+        concurrently = (
+            " CONCURRENTLY" if connection.pg_version >= 140000 and not connection.in_atomic_block else ""
+        )
+        if connection.in_atomic_block:
+            # a table can't be dropped with (deferred) foreign key checks of rows written in the transaction pending
+            connection.check_constraints()
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}{concurrently}")
+        cursor.execute(f"DROP TABLE {partition}")
+    return rows
+
+
+# the models whose rows are compared by `DataImport.compute_delta`
+IMPORTED_MODELS = [ScheduledDelivery, Inventory, Purchase, FacilityDelivery, Demand]
+
+
+class ApiToken(models.Model):
+    """
+    Lets automated feeds use the import API as `user`, with an `Authorization: Bearer <key>` header.
+    Only a hash of the key is stored: it is shown once, by `manage.py create_api_token`.
+    """
+
+    key_hash = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True)
+
+    @staticmethod
+    def hash_key(key: str):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def create(cls, user: User, name: str):
+        """
+        :return: (token, key)
+        """
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(key_hash=cls.hash_key(key), user=user, name=name), key
+
+    @classmethod
+    def authenticate(cls, authorization: str) -> Optional[User]:
+        """
+        :param authorization: value of the Authorization header
+        :return: the user the token belongs to, if it is valid
+        """
+        scheme, _, key = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not key:
+            return None
+        token = (
+            cls.objects.select_related("user")
+            .filter(key_hash=cls.hash_key(key.strip()), user__is_active=True)
+            .first()
+        )
+        if token is None:
+            return None
+        token.last_used_at = timezone.now()
+        token.save(update_fields=["last_used_at"])
+        return token.user
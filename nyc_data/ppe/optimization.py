@@ -26,7 +26,10 @@ def generate_forecast_for_item(start_date: date, item: dc.Item, n_days: int = 10
         return None
     else:
         demand_for_asset = demand_data[item]
-    start_inventory = Inventory.active().filter(item=item).first().quantity
+    # not `first()`: ordering by the (random) primary key walks the primary key index instead of using `as_of`
+    start_inventory = (
+        Inventory.active().filter(item=item).values_list("quantity", flat=True)[0]
+    )
     future_deliveries = ScheduledDelivery.active().filter(
         purchase__item=item, delivery_date__gte=start_date
     )
@@ -0,0 +1,261 @@
+"""
+Pruning old imports: every upload leaves its rows behind, but only the active ones are ever read. Imports beyond
+the newest `settings.IMPORT_RETENTION` of each kind of file have their rows dumped to a gzipped JSON lines file and
+deleted, a batch at a time (see `manage.py prune_imports`). The `DataImport` itself is kept, as `archived`.
+"""
+import gzip
+import io
+import json
+import tempfile
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage, get_storage_class
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ppe.data_mapping.types import DataFile
+from ppe.locks import data_file_lock
+from ppe.models import (
+    DataImport,
+    ImportStatus,
+    RawDataModel,
+    RawRow,
+    drop_partition,
+    imported_data_models,
+)
+
+# rows deleted per statement (and transaction)
+PRUNE_BATCH_SIZE = 5000
+
+
+def import_archive_storage() -> Storage:
+    return get_storage_class(settings.IMPORT_ARCHIVE_STORAGE)(location=settings.IMPORT_ARCHIVE_ROOT)
+
+
+def prunable_imports(keep: int) -> QuerySet:
+    """
+    Replaced and cancelled imports older than the newest `keep` imports of their file, and archived imports whose
+    rows haven't all been deleted yet (e.g. an interrupted prune).
+
+    Imports carried forward into one whose rows are still there are never pruned: their rows are part of it (and
+    part of the active data, if it is the active import).
+    """
+    newer = (
+        DataImport.objects.filter(
+            data_file=OuterRef("data_file"), import_date__gt=OuterRef("import_date")
+        )
+        .order_by()
+        .values("data_file")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    carried_into_unpruned = DataImport.carried_forward.through.objects.filter(
+        from_dataimport__pruned_at=None
+    ).values("to_dataimport")
+    return (
+        DataImport.objects.annotate(
+            newer=Coalesce(Subquery(newer, output_field=IntegerField()), 0)
+        )
+        .filter(
+            Q(status__in=[ImportStatus.replaced, ImportStatus.cancelled], newer__gte=keep)
+            | Q(status=ImportStatus.archived, pruned_at=None)
+        )
+        .exclude(id__in=carried_into_unpruned)
+    )
+
+
+def _deletion_order() -> List[type]:
+    """
+    The imported data models, each before any model it references (eg. `ScheduledDelivery` before `Purchase`)
+    """
+    remaining = imported_data_models()
+    ordered = []
+    while remaining:
+        for model in remaining:
+            referenced_by_remaining = any(
+                field.related_model is model
+                for other in remaining
+                if other is not model
+                for field in other._meta.concrete_fields
+                if field.is_relation
+            )
+            if not referenced_by_remaining:
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise Exception(f"Imported data models reference each other: {remaining}")
+    return ordered
+
+
+def archive_name(data_import: DataImport) -> str:
+    return f"{DataFile(data_import.data_file).name}/{data_import.id}.jsonl.gz"
+
+
+def dump_rows(data_import: DataImport) -> str:
+    """
+    Write the rows of `data_import`, and the raw rows they came from, to a gzipped JSON lines file in
+    `import_archive_storage()`, one `{"model": ..., "fields": ...}` object per row.
+
+    :return: the name of the file
+    """
+    storage = import_archive_storage()
+    name = archive_name(data_import)
+    with tempfile.TemporaryFile() as compressed:
+        with gzip.GzipFile(fileobj=compressed, mode="wb") as gz, io.TextIOWrapper(gz) as out:
+            for model in imported_data_models():
+                rows = model.objects.filter(source=data_import)
+                for fields in rows.values().iterator():
+                    out.write(
+                        json.dumps({"model": model._meta.label_lower, "fields": fields}, cls=DjangoJSONEncoder)
+                    )
+                    out.write("\n")
+                if issubclass(model, RawDataModel):
+                    raw_rows = RawRow.objects.filter(checksum__in=rows.values("raw_row"))
+                    for raw_row in raw_rows.iterator():
+                        out.write(
+                            json.dumps(
+                                {
+                                    "model": RawRow._meta.label_lower,
+                                    "fields": {"checksum": raw_row.checksum, "data": raw_row.load()},
+                                },
+                                cls=DjangoJSONEncoder,
+                            )
+                        )
+                        out.write("\n")
+        compressed.seek(0)
+        # left behind by a prune that was interrupted before it recorded the file
+        if storage.exists(name):
+            storage.delete(name)
+        return storage.save(name, File(compressed))
+
+
+def delete_rows(data_import: DataImport, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """
+    Delete the rows of `data_import` `batch_size` at a time, each batch in its own transaction so locks are short
+    lived and autovacuum can keep up, or drop their partition (see `ImportedDataModel.partitioned`). Raw rows no one
+    else refers to any more are deleted too.
+
+    :return: the number of rows deleted
+    """
+    raw_data_models = [model for model in imported_data_models() if issubclass(model, RawDataModel)]
+    raw_rows = set()
+    for model in raw_data_models:
+        raw_rows.update(
+            model.objects.filter(source=data_import, raw_row__isnull=False)
+            .values_list("raw_row", flat=True)
+            .distinct()
+        )
+
+    deleted = 0
+    for model in _deletion_order():
+        if model.partitioned:
+            # imported since the table was partitioned: no rows to delete one by one
+            deleted += drop_partition(model, data_import.id)
+        table = connection.ops.quote_name(model._meta.db_table)
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE source_id = %s LIMIT %s)",
+                    [data_import.id, batch_size],
+                )
+                deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+
+    raw_rows = list(raw_rows)
+    for start in range(0, len(raw_rows), batch_size):
+        orphaned = RawRow.objects.filter(checksum__in=raw_rows[start : start + batch_size])
+        for model in raw_data_models:
+            # an anti-join on the referencing table's index, rather than a NOT IN over the whole table
+            orphaned = orphaned.filter(~Exists(model.objects.filter(raw_row=OuterRef("pk"))))
+        # an import of the same file could be about to refer to one of them again
+        with data_file_lock(data_import.data_file, "prune"):
+            deleted += orphaned._raw_delete(orphaned.db)
+    return deleted
+
+
+def prune_import(data_import: DataImport, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """
+    Archive `data_import` (one of `prunable_imports`): dump its rows, then delete them.
+
+    :return: the number of rows deleted
+    """
+    with data_file_lock(data_import.data_file, "prune"):
+        # a duplicate upload may have offered it for verification again in the meantime (see `data_import`)
+        data_import.refresh_from_db()
+        if data_import.status not in (
+            ImportStatus.replaced,
+            ImportStatus.cancelled,
+            ImportStatus.archived,
+        ):
+            return 0
+        # from here on, nothing will read or reactivate it
+        data_import.status = ImportStatus.archived
+        data_import.save(update_fields=["status"])
+
+    if not data_import.archive:
+        data_import.archive = dump_rows(data_import)
+        data_import.save(update_fields=["archive"])
+    deleted = delete_rows(data_import, batch_size)
+    data_import.pruned_at = timezone.now()
+    data_import.save(update_fields=["pruned_at"])
+    return deleted
+
+
+def table_row_sizes() -> Dict[type, float]:
+    """
+    The average size of a row of each imported data model in bytes, including its share of the table's indexes and
+    TOAST, from the planner's row estimates
+    """
+    models = {model._meta.db_table: model for model in imported_data_models()}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT relname, CASE WHEN reltuples > 0 THEN pg_total_relation_size(oid) / reltuples ELSE 0 END
+            FROM pg_class WHERE relkind = 'r' AND relname = ANY(%s)
+            """,
+            [list(models)],
+        )
+        return {models[table]: size for table, size in cursor.fetchall()}
+
+
+def annotate_storage(imports: QuerySet) -> QuerySet:
+    """
+    Annotate each import with its rows of every imported data model (`rows_<model>`), their total (`rows`), and an
+    estimate of the bytes they take up (`size`)
+    """
+    sizes = table_row_sizes()
+    total_rows = Value(0, output_field=IntegerField())
+    total_size = Value(0, output_field=IntegerField())
+    for model in imported_data_models():
+        rows = (
+            model.objects.filter(source=OuterRef("pk"))
+            .order_by()
+            .values("source")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        field = f"rows_{model._meta.model_name}"
+        imports = imports.annotate(
+            **{field: Coalesce(Subquery(rows, output_field=IntegerField()), 0)}
+        )
+        total_rows = total_rows + F(field)
+        total_size = total_size + F(field) * Value(int(sizes.get(model, 0)), output_field=IntegerField())
+    return imports.annotate(rows=total_rows, size=total_size)
+
+
+def row_counts(data_import: DataImport) -> Dict[str, int]:
+    """
+    The non-zero `rows_<model>` annotations of an import from `annotate_storage`, by model name
+    """
+    counts = {
+        model.__name__: getattr(data_import, f"rows_{model._meta.model_name}")
+        for model in imported_data_models()
+    }
+    return {model: count for model, count in counts.items() if count}
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by `data_import.finalize_import` once a `DataImport` is active (sender: DataImport, data_import: the import).
+# It is sent after the activation has committed, so receivers (and any queries they run) see the new active data.
+# Anything caching or precomputing data derived from the active imports should connect to it and refresh.
+# A receiver that raises doesn't undo the activation.
+data_import_finalized = Signal(providing_args=["data_import"])
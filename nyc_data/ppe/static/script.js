@@ -136,6 +136,27 @@ $(function(){
             addUrlParameter('supply', newSupply.join(','));
         });
     }
+
+    // Upload progress: poll until the import worker is finished, then reload to be sent on to verification
+    if($('.upload-status').length > 0){
+        var uploadStatus = $('.upload-status');
+        function pollUpload() {
+            fetch(uploadStatus.data('progress-url'), {credentials: 'same-origin'})
+                .then(function(response) { return response.json(); })
+                .then(function(progress) {
+                    if (progress.status == 'done' || progress.status == 'failed') {
+                        window.location.reload();
+                        return;
+                    }
+                    uploadStatus.find('.upload-state').text(progress.status);
+                    uploadStatus.find('.current-sheet').text(progress.current_sheet || '—');
+                    uploadStatus.find('.rows-parsed').text(progress.rows_parsed);
+                    uploadStatus.find('.rows-written').text(progress.rows_written);
+                    setTimeout(pollUpload, 1000);
+                });
+        }
+        setTimeout(pollUpload, 1000);
+    }
 });
 
 svgClock = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 512 512"><path d="M256 8a248 248 0 100 496 248 248 0 000-496zm0 448a200 200 0 110-400 200 200 0 010 400zm62-104l-85-62c-3-2-5-6-5-10V116c0-7 5-12 12-12h32c7 0 12 5 12 12v142l67 48c5 4 6 12 2 17l-18 26c-4 5-12 7-17 3z"/></svg>';
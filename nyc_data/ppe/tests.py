@@ -1,30 +1,64 @@
+import gzip
+import hashlib
+import json
+import tempfile
+import threading
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
+from pathlib import Path
 
+from django.conf import settings
 from django.contrib import auth
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from freezegun import freeze_time
 
 import ppe.dataclasses as dc
-from ppe import aggregations
+from ppe import aggregations, drilldown, retention
 from ppe.aggregations import AssetRollup, DemandSrc, AggColumn
 from ppe.data_mapping.mappers.dcas_sourcing import SourcingRow
-from ppe.data_mapping.mappers.hospital_demands import DemandRow
+from ppe.data_mapping.mappers.hospital_demands import DemandRow, WEEKLY_DEMANDS
 from ppe.data_mapping.types import DataFile
-from ppe.data_mapping.utils import ErrorCollector
+from ppe.data_mapping.utils import SAMPLE_SIZE, ErrorCollector, DateColumnParser, parse_date
 from ppe.dataclasses import Period
+import xlsx_utils
+from ppe.errors import ColumnNameMismatch, FailedImportFileMissing, ImportNotCandidate, PartialFile
+from xlsx_utils import import_xlsx
+from openpyxl import Workbook
+
+from ppe import data_import as data_import_module, locks, views
+from ppe.management.commands import import_worker
+from ppe.data_mapping.mappers import hospital_deliveries, inventory_from_facilities
 from ppe.models import (
+    ActiveDelivery,
+    ActiveItemTotals,
+    DataFileLockStats,
     DataImport,
     ImportStatus,
     Purchase,
     Inventory,
     FacilityDelivery,
     Facility,
+    RawRow,
+    ImportJob,
+    ImportJobStatus,
+    Demand,
+    FailedImport,
+    ScheduledDelivery,
+    ApiToken,
+    failed_import_storage,
+    refresh_snapshots,
 )
+from ppe.signals import data_import_finalized
 
 
-class TestAssetRollup(TestCase):
+class TestAssetRollup(TransactionTestCase):
     def setUp(self) -> None:
         self.data_import = DataImport(
             status=ImportStatus.active,
@@ -183,18 +217,14 @@ class TestAssetRollup(TestCase):
         today = datetime(2020, 4, 12)
         self.data_import.status = ImportStatus.replaced
         self.data_import.save()
-        try:
-            self.assertEqual(aggregations.known_recent_demand(), {})
-            rollup = aggregations.asset_rollup_legacy(today - timedelta(days=28), today)
-            self.assertEqual(
-                rollup[dc.Item.gown],
-                AssetRollup(
-                    asset=dc.Item.gown, total_cols=AggColumn.all(), demand=0, ordered=0
-                ),
-            )
-        finally:
-            self.data_import.status = ImportStatus.active
-            self.data_import.save()
+        self.assertEqual(aggregations.known_recent_demand(), {})
+        rollup = aggregations.asset_rollup_legacy(today - timedelta(days=28), today)
+        self.assertEqual(
+            rollup[dc.Item.gown],
+            AssetRollup(
+                asset=dc.Item.gown, total_cols=AggColumn.all(), demand=0, ordered=0
+            ),
+        )
 
 
 class TestUnscheduledDeliveries(unittest.TestCase):
@@ -228,6 +258,9 @@ class TestUnscheduledDeliveries(unittest.TestCase):
         purchase = Purchase.objects.filter(item=dc.Item.gown)
         self.assertEqual(purchase.count(), 1)
         self.assertEqual(purchase.first().unscheduled_quantity, 995)
+        self.assertEqual(
+            Purchase.with_delivery_totals(purchase).get().unscheduled_quantity, 995
+        )
 
 
 class TestCategoryMappings(unittest.TestCase):
@@ -273,6 +306,39 @@ class TestViews(TestCase):
         self.assertIn(b"Incoming Supply", response.content)
         self.assertEqual(response.status_code, 200)
 
+    def test_drilldown_queries_dont_grow_with_purchases(self):
+        data_import = DataImport.objects.create(
+            status=ImportStatus.active,
+            data_file=DataFile.PPE_ORDERINGCHARTS_DATE_XLSX,
+            file_checksum="123",
+        )
+
+        def drilldown_queries(purchases):
+            for _ in range(purchases):
+                purchase = Purchase.objects.create(
+                    source=data_import,
+                    order_type=dc.OrderType.Purchase,
+                    item=dc.Item.gown,
+                    quantity=100,
+                    vendor="Gown Sellers Ltd",
+                )
+                for days in [1, 2]:
+                    ScheduledDelivery.objects.create(
+                        source=data_import,
+                        purchase=purchase,
+                        delivery_date=datetime.today().date() + timedelta(days=days),
+                        quantity=10,
+                    )
+            refresh_snapshots()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse("drilldown"), {"category": "Gowns & Coverings", "rollup": "mayoral"}
+                )
+            self.assertEqual(response.context["unscheduled_total"], 80 * Purchase.objects.count())
+            return len(queries)
+
+        self.assertEqual(drilldown_queries(1), drilldown_queries(3))
+
 
 class TestPeriod(unittest.TestCase):
     def test_period_len(self):
@@ -299,3 +365,1146 @@ class TestRollupObj(unittest.TestCase):
         )
 
         self.assertEqual(rollup.total, 789 + 456)
+
+
+class TestDateColumnParser(unittest.TestCase):
+    def test_matches_parse_date(self):
+        values = ["4/15", "4/16", "4/17", "4/18", "4/19", "4/15", "30-Apr", "junk", None]
+        parser = DateColumnParser()
+        column_errors, cell_errors = ErrorCollector(), ErrorCollector()
+        for value in values:
+            self.assertEqual(
+                parser(value, column_errors), parse_date(value, cell_errors), value
+            )
+        self.assertEqual(column_errors.report(), cell_errors.report())
+
+    def test_locks_format(self):
+        parser = DateColumnParser(sample_size=2)
+        parser("04/10/2020", ErrorCollector())
+        self.assertIsNone(parser.locked_format)
+        parser("04/11/2020", ErrorCollector())
+        self.assertEqual(parser.locked_format, "%m/%d/%Y")
+
+    def test_repeated_errors_are_reported(self):
+        parser = DateColumnParser()
+        error_collector = ErrorCollector()
+        parser("not a date", error_collector)
+        parser("not a date", error_collector)
+        self.assertEqual(error_collector.error_count, 2)
+
+
+class TestColumnarImport(unittest.TestCase):
+    def test_matches_row_path(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("Item,Demand,Week Start,Week End\n")
+            for i in range(50):
+                f.write(f"{['Gowns', 'Gloves', 'Mystery'][i % 3]},{i % 4 or 'lots'},4/{i % 7 + 1}/2020,junk\n")
+            f.flush()
+
+            row_errors, column_errors = ErrorCollector(), ErrorCollector()
+            by_row = list(import_xlsx(Path(f.name), WEEKLY_DEMANDS, row_errors, columnar=False))
+            by_column = list(import_xlsx(Path(f.name), WEEKLY_DEMANDS, column_errors))
+
+        self.assertEqual(by_row, by_column)
+        self.assertEqual(row_errors.report(), column_errors.report())
+        self.assertEqual(row_errors.reported[("error", "Unknown date format: {}")].rows[:3], [2, 3, 4])
+
+
+class TestGuessMapping(unittest.TestCase):
+    def guess(self, workbook: Workbook):
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            return xlsx_utils.guess_mapping(Path(f.name), data_import_module.MAPPING_INDEX)
+
+    def test_resolves_from_headers(self):
+        workbook = Workbook()
+        workbook.active.title = "Facility Deliveries Summaries"
+        workbook.active.append([m.sheet_column_name for m in hospital_deliveries.FACILITY_DELIVERIES.mappings])
+        inventory = workbook.create_sheet("Inventory Levels")
+        inventory.append(["Date"])
+        with self.assertRaises(ColumnNameMismatch):
+            self.guess(workbook)
+
+        inventory.append(["Date", *inventory_from_facilities.sheet_columns])
+        inventory.delete_rows(1)
+        self.assertEqual(
+            self.guess(workbook),
+            [inventory_from_facilities.INVENTORY, hospital_deliveries.FACILITY_DELIVERIES],
+        )
+
+        workbook.remove(inventory)
+        with self.assertRaises(PartialFile):
+            self.guess(workbook)
+
+
+class TestErrorCollector(unittest.TestCase):
+    def test_aggregates_by_template(self):
+        error_collector = ErrorCollector()
+        error_collector.sheet = "Sheet1"
+        for row in range(1000):
+            error_collector.row = row
+            error_collector.report_warning("Unknown type: {}", f"thing {row}")
+        error_collector.report_error("Null asset name")
+
+        report = error_collector.report()
+        self.assertEqual(error_collector.warning_count, 1000)
+        self.assertEqual(
+            report["errors"],
+            [dict(template="Null asset name", count=1, messages=["Null asset name"], rows=[999], sheets=["Sheet1"])],
+        )
+        [warning] = report["warnings"]
+        self.assertEqual(warning["count"], 1000)
+        self.assertEqual(len(warning["messages"]), SAMPLE_SIZE)
+        self.assertEqual(warning["rows"], list(range(SAMPLE_SIZE)))
+
+    def test_extend_attributes_location(self):
+        sheet_errors = ErrorCollector()
+        sheet_errors.report_error("Bool input was None")
+        error_collector = ErrorCollector()
+        error_collector.sheet, error_collector.row = "Sheet2", 7
+        error_collector.extend(sheet_errors)
+        [error] = error_collector.report()["errors"]
+        self.assertEqual((error["rows"], error["sheets"]), ([7], ["Sheet2"]))
+
+
+class TestRawRows(TestCase):
+    def test_fan_out_shares_raw_row(self):
+        data_import = DataImport(
+            status=ImportStatus.active,
+            data_file=DataFile.FACILITY_DELIVERIES,
+            file_checksum="123",
+        )
+        data_import.save()
+        raw_data = '{"Date": "4/10/2020", "Gowns": 5, "Gloves": 6}'
+        for item in [dc.Item.gown, dc.Item.gloves]:
+            Inventory(
+                item=item,
+                quantity=5,
+                as_of=datetime(year=2020, day=10, month=4),
+                raw_data=raw_data,
+                source=data_import,
+            ).save()
+
+        self.assertEqual(RawRow.objects.count(), 1)
+        inventory = Inventory.objects.select_related("raw_row").first()
+        self.assertEqual(inventory.raw_data["Gowns"], 5)
+
+
+@override_settings(FAILED_IMPORT_ROOT=tempfile.mkdtemp())
+class TestImportJobs(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            auth.get_user_model().objects.create_superuser(username="testuser")
+        )
+
+    def upload(self, content: bytes):
+        response = self.client.post(
+            reverse("upload"),
+            {
+                "file": SimpleUploadedFile("demand.csv", content),
+                "data_current": "2020-04-12",
+            },
+        )
+        job = ImportJob.objects.get()
+        self.assertRedirects(
+            response, reverse("upload_status", kwargs={"job_id": job.id})
+        )
+        self.assertEqual(job.status, ImportJobStatus.queued)
+        call_command("import_worker", once=True, concurrency=1)
+        job.refresh_from_db()
+        return job
+
+    def test_import_off_request_path(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        job = self.upload(content)
+        self.assertEqual(job.status, ImportJobStatus.done)
+        self.assertEqual(bytes(job.data), b"")
+        self.assertEqual(
+            job.data_import.file_checksum, hashlib.sha256(content).hexdigest()
+        )
+        self.assertEqual(job.data_import.rows_parsed, 1)
+        self.assertEqual(job.data_import.rows_written, 1)
+        self.assertEqual(Demand.objects.filter(source=job.data_import).count(), 1)
+
+        progress = self.client.get(
+            reverse("upload_progress", kwargs={"job_id": job.id})
+        ).json()
+        self.assertEqual(progress["status"], ImportJobStatus.done)
+        self.assertRedirects(
+            self.client.get(reverse("upload_status", kwargs={"job_id": job.id})),
+            reverse("verify", kwargs={"import_id": job.data_import.id}),
+        )
+
+    def test_failed_import(self):
+        job = self.upload(b"not,a,known,format\n1,2,3,4\n")
+        self.assertEqual(job.status, ImportJobStatus.failed)
+        # kept as the FailedImport only
+        self.assertEqual(bytes(job.data), b"")
+        response = self.client.get(reverse("upload_status", kwargs={"job_id": job.id}))
+        self.assertContains(response, "We were unable to find an existing mapping for this file.")
+        failed_import = FailedImport.objects.get()
+        with failed_import.open() as f:
+            self.assertEqual(f.read(), b"not,a,known,format\n1,2,3,4\n")
+
+        response = self.client.get(
+            reverse("admin:ppe_failedimport_download", args=[failed_import.id])
+        )
+        self.assertEqual(
+            b"".join(response.streaming_content), b"not,a,known,format\n1,2,3,4\n"
+        )
+
+    def test_requeue_stale_job(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        user = auth.get_user_model().objects.get()
+        job = data_import_module.enqueue_upload(
+            SimpleUploadedFile("demand.csv", content), datetime(2020, 4, 12).date(), user
+        )
+        job = ImportJob.claim_next()
+        self.assertEqual(job.status, ImportJobStatus.running)
+        # the worker died halfway through the import
+        job.data_import = DataImport.objects.create(
+            status=ImportStatus.candidate,
+            data_file=DataFile.HOSPITAL_DEMANDS,
+            file_checksum=hashlib.sha256(content).hexdigest(),
+        )
+        job.save(update_fields=["data_import"])
+        alive = data_import_module.enqueue_upload(
+            SimpleUploadedFile("demand.csv", content), datetime(2020, 4, 12).date(), user
+        )
+        self.assertEqual(ImportJob.claim_next(), alive)
+
+        self.assertIsNone(ImportJob.claim_next())
+        with freeze_time(timezone.now() + timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER + 1)):
+            alive.beat()
+            self.assertEqual(ImportJob.claim_next(), job)
+        self.assertFalse(DataImport.objects.exists())
+        self.assertEqual(ImportJob.objects.get(id=alive.id).status, ImportJobStatus.running)
+
+        job.refresh_from_db()
+        data_import_module.run_import_job(job)
+        self.assertEqual(job.status, ImportJobStatus.done)
+        self.assertEqual(Demand.objects.filter(source=job.data_import).count(), 1)
+
+    def test_waiting_jobs_stay_queued(self):
+        user = auth.get_user_model().objects.get()
+        demands, more_demands, unknown = [
+            data_import_module.enqueue_upload(
+                SimpleUploadedFile(name, content), datetime(2020, 4, 12).date(), user
+            )
+            for name, content in [
+                ("demand.csv", b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"),
+                ("demand.csv", b"Item,Demand,Week Start,Week End\nGowns,7,4/6/2020,4/12/2020\n"),
+                ("unknown.csv", b"not,a,known,format\n1,2,3,4\n"),
+            ]
+        ]
+        worker = import_worker.Command()
+        kinds = {}
+        self.assertEqual(worker.startable(kinds, set(), 3), [demands.id, unknown.id])
+        self.assertEqual(worker.startable(kinds, {DataFile.HOSPITAL_DEMANDS}, 3), [unknown.id])
+        self.assertEqual(worker.startable(kinds, set(), 1), [demands.id])
+
+        self.assertEqual(ImportJob.claim_next([unknown.id]), unknown)
+        self.assertEqual(worker.startable(kinds, {DataFile.HOSPITAL_DEMANDS}, 3), [])
+        self.assertEqual(kinds, {demands.id: DataFile.HOSPITAL_DEMANDS, more_demands.id: DataFile.HOSPITAL_DEMANDS})
+        more_demands.refresh_from_db()
+        self.assertEqual(more_demands.status, ImportJobStatus.queued)
+
+    def test_failure_shows_error_report(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\nBoots,5,4/6/2020,4/12/2020\n"
+        # e.g. the database went away halfway through
+        with mock.patch.object(data_import_module, "write_objects", side_effect=Exception("connection lost")):
+            job = self.upload(content)
+        self.assertEqual(job.status, ImportJobStatus.failed)
+        [warning] = job.error_report["warnings"]
+        self.assertEqual(warning["messages"], ["Unknown type: Boots"])
+
+        response = self.client.get(reverse("upload_status", kwargs={"job_id": job.id}))
+        self.assertContains(response, "connection lost")
+        self.assertContains(response, "Unknown type: Boots")
+        failed_import = FailedImport.objects.get()
+        self.assertEqual(failed_import.error_report, job.error_report)
+        response = self.client.get(reverse("admin:ppe_failedimport_change", args=[failed_import.id]))
+        self.assertContains(response, "Unknown type: Boots")
+
+    def store_failed_import(self, content: bytes) -> FailedImport:
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            return FailedImport.store(
+                f,
+                hashlib.sha256(content).hexdigest(),
+                file_name="demand.csv",
+                uploaded_by=auth.get_user_model().objects.get(),
+                current_as_of=datetime(2020, 4, 12).date(),
+            )
+
+    def test_retry_failed_import(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        # the same file failed twice
+        failed_import, again = [self.store_failed_import(content) for _ in range(2)]
+        stored_name = FailedImport.stored_name(failed_import.checksum)
+
+        failed_import.retry()
+        self.assertTrue(failed_import.fixed)
+        self.assertEqual(Demand.active().count(), 1)
+        self.assertTrue(failed_import_storage().exists(stored_name))
+
+        again.fixed = True
+        again.save()
+        self.assertFalse(failed_import_storage().exists(stored_name))
+
+    def test_file_kept_for_queued_retries(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        failed_import, again = [self.store_failed_import(content) for _ in range(2)]
+        stored_name = FailedImport.stored_name(failed_import.checksum)
+        first, second = failed_import.queue_retry(), again.queue_retry()
+
+        for job in [first, second]:
+            job.status = ImportJobStatus.running
+            data_import_module.run_import_job(job)
+            self.assertEqual(job.status, ImportJobStatus.done)
+            # the last retry no longer needs it
+            self.assertEqual(failed_import_storage().exists(stored_name), job == first)
+
+        with self.assertRaises(FailedImportFileMissing):
+            failed_import.open()
+
+    def test_bulk_retry(self):
+        # e.g. one that has been fixed since, and one that still fails
+        self.store_failed_import(b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n")
+        self.upload(b"not,a,known,format\n1,2,3,4\n")
+
+        changelist = reverse("admin:ppe_failedimport_changelist")
+        self.client.post(
+            changelist,
+            {
+                "action": "retry_upload",
+                "_selected_action": FailedImport.objects.values_list("id", flat=True),
+            },
+        )
+        self.assertEqual(
+            ImportJob.objects.filter(failed_import__isnull=False, status=ImportJobStatus.queued).count(), 2
+        )
+        call_command("import_worker", once=True, concurrency=1)
+
+        self.assertEqual(
+            set(FailedImport.objects.values_list("file_name", "fixed")),
+            {("demand.csv", True), ("demand.csv", False)},
+        )
+        self.assertEqual(FailedImport.objects.count(), 2)
+        response = self.client.get(changelist)
+        self.assertContains(response, "done in")
+        self.assertContains(response, "failed in")
+
+        # the fixed one isn't retried again, the other is only queued once
+        for _ in range(2):
+            response = self.client.post(
+                changelist,
+                {
+                    "action": "retry_upload",
+                    "_selected_action": FailedImport.objects.values_list("id", flat=True),
+                },
+                follow=True,
+            )
+        self.assertContains(response, "Queued 0 uploads")
+        self.assertContains(response, "Skipped 2 uploads")
+        self.assertEqual(ImportJob.objects.filter(status=ImportJobStatus.queued).count(), 1)
+
+    def test_retry_of_discarded_file_fails(self):
+        content = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        failed_import = self.store_failed_import(content)
+        failed_import.retry()
+        # e.g. queued before `queue_retry` refused to queue retries of fixed uploads
+        job = ImportJob.objects.create(
+            data=b"",
+            file_name=failed_import.file_name,
+            uploaded_by=failed_import.uploaded_by,
+            current_as_of=failed_import.current_as_of,
+            failed_import=failed_import,
+        )
+
+        self.assertEqual(import_worker.Command().startable({}, set(), 2), [job.id])
+        call_command("import_worker", once=True, concurrency=2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJobStatus.failed)
+        self.assertEqual(job.error, str(FailedImportFileMissing(failed_import.id)))
+
+
+class TestImportProgress(TransactionTestCase):
+    def test_progress_seen_before_commit(self):
+        data_import = DataImport.objects.create(
+            status=ImportStatus.candidate, data_file=DataFile.HOSPITAL_DEMANDS, file_checksum="1"
+        )
+        # e.g. the upload page's
+        other = connection.copy()
+        other.connect()
+        self.addCleanup(other.close)
+
+        def progress():
+            with other.cursor() as cursor:
+                cursor.execute(
+                    "SELECT current_sheet, rows_written FROM ppe_dataimport WHERE id = %s", [data_import.id]
+                )
+                return cursor.fetchone()
+
+        with data_import.progress_outside_transaction(), transaction.atomic():
+            Demand.objects.create(
+                source=data_import,
+                item=dc.Item.gown,
+                demand=5,
+                start_date=datetime(2020, 4, 6),
+                end_date=datetime(2020, 4, 12),
+            )
+            data_import.record_progress(current_sheet="demands", rows_written=1)
+            self.assertEqual(progress(), ("demands", 1))
+        self.assertEqual(DataImport.objects.get().rows_written, 1)
+
+
+class TestMultiSheetImport(TestCase):
+    def test_sheets_parsed_in_parallel(self):
+        workbook = Workbook()
+        inventory = workbook.active
+        inventory.title = "Inventory Levels"
+        inventory.append(["Date", *inventory_from_facilities.sheet_columns])
+        inventory.append(["4/10/2020", *[10] * len(inventory_from_facilities.sheet_columns)])
+
+        deliveries = workbook.create_sheet("Facility Deliveries Summaries")
+        deliveries.append(
+            ["Date", "Facility Name or Network", "Facility Type", *hospital_deliveries.sheet_columns]
+        )
+        for day in range(1, 4):
+            deliveries.append(
+                [f"4/{day}/2020", "Generic Hospital", "Hospital", *[1] * len(hospital_deliveries.sheet_columns)]
+            )
+
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            data_import = data_import_module.smart_import(
+                Path(f.name), "testuser", datetime(2020, 4, 12).date()
+            )
+
+        self.assertEqual(data_import.rows_parsed, 4)
+        self.assertEqual(
+            Inventory.objects.filter(source=data_import).count(),
+            len(inventory_from_facilities.sheet_columns),
+        )
+        self.assertEqual(
+            FacilityDelivery.objects.filter(source=data_import).count(),
+            3 * len(hospital_deliveries.sheet_columns),
+        )
+        self.assertEqual(
+            data_import.rows_written,
+            len(inventory_from_facilities.sheet_columns)
+            + 3 * len(hospital_deliveries.sheet_columns),
+        )
+
+
+class TestDuplicateUploads(TestCase):
+    def smart_import(self, content: bytes):
+        with tempfile.NamedTemporaryFile(suffix=".csv") as f:
+            f.write(content)
+            f.flush()
+            return data_import_module.smart_import(
+                Path(f.name), "testuser", datetime(2020, 4, 12).date()
+            )
+
+    def test_identical_file_is_not_reimported(self):
+        demands = b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n"
+        first = self.smart_import(demands)
+        self.assertEqual(self.smart_import(demands), first)
+        data_import_module.finalize_import(first)
+        self.assertEqual(self.smart_import(demands), first)
+        self.assertEqual(DataImport.objects.count(), 1)
+        self.client.force_login(
+            auth.get_user_model().objects.create_superuser(username="testuser")
+        )
+        self.assertContains(
+            self.client.get(reverse("verify", kwargs={"import_id": first.id})),
+            "This exact file is already the active data",
+        )
+        self.assertEqual(Demand.objects.count(), 1)
+
+        newer = self.smart_import(demands.replace(b"Gowns,5", b"Gowns,7"))
+        data_import_module.finalize_import(newer)
+        first.refresh_from_db()
+        self.assertEqual(first.status, ImportStatus.replaced)
+
+        # re-uploading the older file offers the existing rows up for verification again
+        reactivated = self.smart_import(demands)
+        self.assertEqual(reactivated, first)
+        self.assertEqual(reactivated.status, ImportStatus.candidate)
+        self.assertEqual(Demand.objects.count(), 2)
+
+
+class TestUploadDelta(TestCase):
+    def smart_import(self, rows):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("Item,Demand,Week Start,Week End\n" + "".join(f"{row}\n" for row in rows))
+            f.flush()
+            return data_import_module.smart_import(
+                Path(f.name), "testuser", datetime(2020, 4, 12).date()
+            )
+
+    def test_diff_by_row_key(self):
+        active = self.smart_import(
+            ["Gowns,5,4/6/2020,4/12/2020", "Gloves,5,4/6/2020,4/12/2020", "Gowns,1,4/13/2020,4/19/2020"]
+        )
+        data_import_module.finalize_import(active)
+        candidate = self.smart_import(
+            ["Gowns,5,4/6/2020,4/12/2020", "Gloves,8,4/6/2020,4/12/2020", "Faceshields,3,4/6/2020,4/12/2020"]
+        )
+
+        delta = candidate.compute_delta()
+        self.assertTrue(delta.comparable)
+        self.assertEqual(delta.active_stats, {"Demand": 3})
+        self.assertEqual(delta.candidate_stats, {"Demand": 3})
+        [diff] = delta.diffs
+        self.assertEqual((diff.added, diff.removed, diff.changed), (1, 1, 1))
+        changed = [sample for sample in diff.samples if sample.kind == "changed"]
+        self.assertEqual(len(changed), 1)
+        self.assertIn("demand: 5", changed[0].active[0])
+        self.assertIn("demand: 8", changed[0].candidate[0])
+        self.assertFalse(delta.has_next_page())
+
+        self.client.force_login(auth.get_user_model().objects.create_superuser(username="testuser"))
+        for page in ["x", "-1"]:
+            response = self.client.get(reverse("verify", kwargs={"import_id": candidate.id}), {"page": page})
+            self.assertEqual(response.status_code, 200)
+
+    def delta_queries(self, weeks):
+        start = datetime(2020, 4, 6).date()
+        rows = [
+            f"Gowns,{{}},{start + timedelta(weeks=week):%m/%d/%Y},{start + timedelta(weeks=week, days=6):%m/%d/%Y}"
+            for week in range(weeks)
+        ]
+        data_import_module.finalize_import(self.smart_import([row.format(5) for row in rows]))
+        candidate = self.smart_import([row.format(8) for row in rows])
+        with CaptureQueriesContext(connection) as queries:
+            candidate.compute_delta()
+        data_import_module.finalize_import(candidate)
+        return len(queries)
+
+    def test_queries_dont_grow_with_rows(self):
+        # only counts and a page of samples are loaded, whatever the size of the file
+        self.assertEqual(self.delta_queries(100), self.delta_queries(3))
+
+
+class TestDataFileLock(TestCase):
+    def test_waits_for_other_sessions(self):
+        other = connection.copy()
+        other.connect()
+        other.set_autocommit(True)
+        self.addCleanup(other.close)
+        # the raw connection, so the timer thread below can use it too
+        other = other.connection
+        key = [locks.LOCK_NAMESPACE, locks.lock_key(DataFile.HOSPITAL_DEMANDS)]
+        other.cursor().execute("SELECT pg_advisory_lock(%s, %s)", key)
+        self.assertEqual(len(locks.held_locks()["HOSPITAL_DEMANDS"]), 1)
+
+        # a different kind of file isn't held up
+        with locks.data_file_lock(DataFile.FACILITY_DELIVERIES, "import"):
+            pass
+
+        release = threading.Timer(0.2, lambda: other.cursor().execute("SELECT pg_advisory_unlock(%s, %s)", key))
+        release.start()
+        with locks.data_file_lock(DataFile.HOSPITAL_DEMANDS, "import"):
+            release.join()
+        stats = DataFileLockStats.objects.get(data_file=DataFile.HOSPITAL_DEMANDS, operation="import")
+        self.assertEqual((stats.acquisitions, stats.contended), (1, 1))
+        self.assertGreaterEqual(stats.max_wait_seconds, 0.1)
+        self.assertEqual(DataFileLockStats.objects.get(data_file=DataFile.FACILITY_DELIVERIES).contended, 0)
+        self.assertEqual(locks.held_locks(), {})
+
+    def test_verify_gives_up_waiting(self):
+        data_import = DataImport.objects.create(
+            status=ImportStatus.candidate, data_file=DataFile.HOSPITAL_DEMANDS, file_checksum="1"
+        )
+        other = connection.copy()
+        other.connect()
+        self.addCleanup(other.close)
+        # e.g. an import of the same file type
+        other.cursor().execute(
+            "SELECT pg_advisory_lock(%s, %s)", [locks.LOCK_NAMESPACE, locks.lock_key(DataFile.HOSPITAL_DEMANDS)]
+        )
+        self.client.force_login(auth.get_user_model().objects.create_superuser(username="testuser"))
+
+        with mock.patch.object(views, "VERIFY_LOCK_TIMEOUT", 0.1):
+            response = self.client.post(reverse("verify", kwargs={"import_id": data_import.id}))
+        self.assertContains(response, "Another import of this file type is running", status_code=409)
+        data_import.refresh_from_db()
+        self.assertEqual(data_import.status, ImportStatus.candidate)
+
+
+class TestDryRunImport(TestCase):
+    def test_dry_run_does_not_touch_db(self):
+        with tempfile.NamedTemporaryFile(suffix=".csv") as f:
+            f.write(
+                b"Item,Demand,Week Start,Week End\n"
+                b"Gowns,5,4/6/2020,4/12/2020\n"
+                b"Gowns,6,not a date,4/12/2020\n"
+            )
+            f.flush()
+            with self.assertNumQueries(0):
+                report = data_import_module.smart_import(
+                    Path(f.name), "testuser", datetime(2020, 4, 12).date(), dry_run=True
+                )
+
+        self.assertEqual(report.data_file, DataFile.HOSPITAL_DEMANDS)
+        self.assertEqual(report.rows, 2)
+        self.assertEqual(report.object_counts, {"Demand": 2})
+        self.assertEqual(report.error_collector.error_count, 1)
+        self.assertFalse(DataImport.objects.exists())
+
+
+class TestAppendImport(TestCase):
+    def import_days(self, days: int, append: bool = True):
+        workbook = Workbook()
+        inventory = workbook.active
+        inventory.title = "Inventory Levels"
+        inventory.append(["Date", *inventory_from_facilities.sheet_columns])
+        deliveries = workbook.create_sheet("Facility Deliveries Summaries")
+        deliveries.append(
+            ["Date", "Facility Name or Network", "Facility Type", *hospital_deliveries.sheet_columns]
+        )
+        for day in range(1, days + 1):
+            inventory.append([f"4/{day}/2020", *[day] * len(inventory_from_facilities.sheet_columns)])
+            deliveries.append(
+                [f"4/{day}/2020", "Generic Hospital", "Hospital", *[1] * len(hospital_deliveries.sheet_columns)]
+            )
+
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f:
+            workbook.save(f.name)
+            data_import = data_import_module.smart_import(
+                Path(f.name), "testuser", datetime(2020, 4, 12).date(), append=append
+            )
+        data_import_module.finalize_import(data_import)
+        return data_import
+
+    def test_only_new_dates_imported(self):
+        deliveries_per_day = len(hospital_deliveries.sheet_columns)
+        first = self.import_days(3)
+        second = self.import_days(4)
+        third = self.import_days(5)
+
+        self.assertEqual(
+            FacilityDelivery.objects.filter(source=second).count(), deliveries_per_day
+        )
+        self.assertEqual(
+            FacilityDelivery.objects.filter(source=third).count(), deliveries_per_day
+        )
+        self.assertEqual(set(third.sources()), {first.id, second.id, third.id})
+        self.assertEqual(FacilityDelivery.active().count(), 5 * deliveries_per_day)
+        self.assertEqual(Inventory.as_of_latest(), datetime(2020, 4, 5).date())
+
+        # the verify page's delta sees the carried rows as part of the import
+        self.assertEqual(
+            len(third.imported_objects()[FacilityDelivery]), 5 * deliveries_per_day
+        )
+
+    def test_reimport_every_date(self):
+        deliveries_per_day = len(hospital_deliveries.sheet_columns)
+        self.import_days(3)
+        # e.g. after earlier dates were corrected
+        corrected = self.import_days(4, append=False)
+        self.assertFalse(corrected.carried_forward.exists())
+        self.assertEqual(
+            FacilityDelivery.objects.filter(source=corrected).count(), 4 * deliveries_per_day
+        )
+        self.assertEqual(FacilityDelivery.active().count(), 4 * deliveries_per_day)
+
+        self.client.force_login(auth.get_user_model().objects.create_superuser(username="testuser"))
+        self.client.post(
+            reverse("upload"),
+            {
+                "file": SimpleUploadedFile("demand.csv", b"Item,Demand,Week Start,Week End\n"),
+                "data_current": "2020-04-12",
+                "reimport_history": "on",
+            },
+        )
+        self.assertFalse(ImportJob.objects.get().append)
+
+
+class TestWatchImports(TransactionTestCase):
+    def test_imports_new_and_changed_files(self):
+        finalized = []
+        data_import_finalized.connect(
+            lambda sender, data_import, **kwargs: finalized.append(data_import.id),
+            weak=False,
+            dispatch_uid="test_watch_imports",
+        )
+        self.addCleanup(
+            data_import_finalized.disconnect, dispatch_uid="test_watch_imports"
+        )
+        watch = lambda: call_command(
+            "watch_imports", directory, once=True, settle=0, concurrency=1, poll_interval=0
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            demands = Path(directory) / "demands.csv"
+            demands.write_bytes(b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n")
+            (Path(directory) / "unknown.csv").write_bytes(b"not,a,known,format\n1,2,3,4\n")
+            watch()
+            first = DataImport.objects.get()
+            self.assertEqual(first.status, ImportStatus.active)
+            self.assertEqual(finalized, [first.id])
+
+            # unchanged files are left alone
+            watch()
+            self.assertEqual(DataImport.objects.count(), 1)
+
+            demands.write_bytes(b"Item,Demand,Week Start,Week End\nGowns,7,4/6/2020,4/12/2020\n")
+            watch()
+            second = DataImport.objects.get(status=ImportStatus.active)
+            self.assertNotEqual(second, first)
+            self.assertEqual(Demand.active().get().demand, 7)
+            self.assertEqual(finalized, [first.id, second.id])
+
+
+    def test_imports_in_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            demands = Path(directory) / "demands.csv"
+            demands.write_bytes(b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\n")
+            call_command("watch_imports", directory, once=True, settle=0, concurrency=2, poll_interval=0)
+            # this process's connection survived the workers closing theirs
+            self.assertEqual(DataImport.objects.get().status, ImportStatus.active)
+
+            demands.write_bytes(b"Item,Demand,Week Start,Week End\nGowns,7,4/6/2020,4/12/2020\n")
+            call_command("watch_imports", directory, once=True, settle=0, concurrency=2, poll_interval=0)
+            self.assertEqual(Demand.active().get().demand, 7)
+
+
+class TestFinalizeImport(TransactionTestCase):
+    def test_swaps_active_import_after_commit(self):
+        finalized = []
+        data_import_finalized.connect(
+            lambda sender, data_import, **kwargs: finalized.append(data_import.id),
+            weak=False,
+            dispatch_uid="test_finalize_import",
+        )
+        self.addCleanup(
+            data_import_finalized.disconnect, dispatch_uid="test_finalize_import"
+        )
+        first, second = [
+            DataImport.objects.create(
+                status=ImportStatus.candidate,
+                data_file=DataFile.HOSPITAL_DEMANDS,
+                file_checksum=checksum,
+            )
+            for checksum in ["1", "2"]
+        ]
+        for data_import in [first, second]:
+            Demand.objects.create(
+                source=data_import,
+                item=dc.Item.gown,
+                demand=5,
+                start_date=datetime(2020, 4, 6),
+                end_date=datetime(2020, 4, 12),
+            )
+        self.assertFalse(Demand.active().exists())
+        data_import_module.finalize_import(first)
+        self.assertEqual(finalized, [first.id])
+        self.assertEqual(Demand.active().get().source_id, first.id)
+
+        with transaction.atomic():
+            data_import_module.finalize_import(second)
+            # nothing is sent while the activation could still be rolled back
+            self.assertEqual(finalized, [first.id])
+        self.assertEqual(finalized, [first.id, second.id])
+        first.refresh_from_db()
+        self.assertEqual(first.status, ImportStatus.replaced)
+        self.assertEqual(
+            DataImport.objects.get(status=ImportStatus.active), second
+        )
+        self.assertEqual(Demand.active().get().source_id, second.id)
+
+        with self.assertRaises(IntegrityError):
+            DataImport.objects.filter(id=first.id).update(status=ImportStatus.active)
+
+    def test_only_activates_candidates(self):
+        data_import = DataImport.objects.create(
+            status=ImportStatus.candidate, data_file=DataFile.HOSPITAL_DEMANDS, file_checksum="1"
+        )
+        # replaced by an upload that held the lock while this was waiting for it
+        DataImport.objects.filter(id=data_import.id).update(status=ImportStatus.replaced)
+        with self.assertRaises(ImportNotCandidate):
+            data_import_module.finalize_import(data_import)
+        self.assertEqual(data_import.status, ImportStatus.replaced)
+        self.assertFalse(DataImport.objects.filter(status=ImportStatus.active).exists())
+
+    def test_refreshes_snapshots(self):
+        data_import = DataImport.objects.create(
+            status=ImportStatus.candidate, data_file=DataFile.INVENTORY, file_checksum="1"
+        )
+        Inventory.objects.create(
+            source=data_import, item=dc.Item.gown, quantity=5, as_of=datetime(2020, 4, 12)
+        )
+        data_import_module.finalize_import(data_import)
+        self.assertEqual(
+            list(ActiveItemTotals.objects.values_list("item", "inventory", "donated")),
+            [(dc.Item.gown, 5, 0)],
+        )
+
+        # and when the active rows change some other way, e.g. in the admin
+        data_import.cancel()
+        data_import.save()
+        self.assertFalse(ActiveItemTotals.objects.exists())
+
+
+@override_settings(IMPORT_ARCHIVE_ROOT=tempfile.mkdtemp())
+class TestPruneImports(TestCase):
+    def test_archives_old_imports(self):
+        statuses = [
+            ImportStatus.replaced,
+            ImportStatus.cancelled,
+            ImportStatus.replaced,
+            ImportStatus.replaced,
+            ImportStatus.active,
+        ]
+        imports = [
+            DataImport.objects.create(
+                status=status, data_file=DataFile.INVENTORY, file_checksum=str(n)
+            )
+            for n, status in enumerate(statuses)
+        ]
+        oldest, cancelled, carried, _, active = imports
+        active.carried_forward.set([carried])
+        for n, data_import in enumerate(imports):
+            for raw_data in [{"Item": "Gowns"}, {"Item": "Gowns", "Import": n}]:
+                Inventory(
+                    source=data_import,
+                    item=dc.Item.gown,
+                    quantity=5,
+                    as_of=datetime(2020, 4, 12),
+                    raw_data=raw_data,
+                ).save()
+        DataImport.sync_active_rows(DataFile.INVENTORY)
+
+        call_command("prune_imports", keep=2, batch_size=1)
+
+        for data_import in imports:
+            data_import.refresh_from_db()
+        self.assertEqual(
+            [data_import.status for data_import in imports],
+            [ImportStatus.archived, ImportStatus.archived, *statuses[2:]],
+        )
+        # the carried forward rows are part of the active data
+        self.assertEqual(
+            set(Inventory.active().values_list("source", flat=True)), {carried.id, active.id}
+        )
+        self.assertFalse(Inventory.objects.filter(source__in=[oldest, cancelled]).exists())
+        # each import's rows were in a partition of their own, which is dropped
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT to_regclass(%s), to_regclass(%s)",
+                [Inventory.partition_name(oldest.id), Inventory.partition_name(active.id)],
+            )
+            self.assertEqual(cursor.fetchone(), (None, Inventory.partition_name(active.id)))
+        self.assertEqual(RawRow.objects.count(), 4)
+        self.assertIsNone(
+            data_import_module.find_duplicate_import(DataFile.INVENTORY, oldest.file_checksum)
+        )
+
+        with retention.import_archive_storage().open(oldest.archive) as stored, gzip.open(stored, "rt") as f:
+            dumped = [json.loads(line) for line in f]
+        self.assertEqual(
+            sorted(row["model"] for row in dumped), ["ppe.inventory"] * 2 + ["ppe.rawrow"] * 2
+        )
+        self.assertEqual(
+            {row["fields"]["source_id"] for row in dumped if row["model"] == "ppe.inventory"},
+            {oldest.id},
+        )
+
+        self.client.force_login(
+            auth.get_user_model().objects.create_superuser(username="testuser")
+        )
+        response = self.client.get(reverse("admin:ppe_dataimport_changelist"))
+        rows = {data_import.id: data_import for data_import in response.context["cl"].result_list}
+        self.assertEqual((rows[active.id].rows, rows[oldest.id].rows), (2, 0))
+        self.assertContains(response, '<span title="Inventory: 2">2</span>', html=True)
+
+
+class TestPartitions(TransactionTestCase):
+    """
+    Outside of a test transaction, as imports and `prune_imports` run
+    """
+
+    def partition_exists(self, model, data_import_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [model.partition_name(data_import_id)])
+            return cursor.fetchone()[0] is not None
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = ANY(%s::regclass[])",
+                [[Inventory._meta.db_table, FacilityDelivery._meta.db_table]],
+            )
+            return {partition for partition, in cursor.fetchall()}
+
+    @override_settings(IMPORT_ARCHIVE_ROOT=tempfile.mkdtemp())
+    def test_prune_drops_partitions(self):
+        # detached concurrently on Postgres 14 and up only
+        for pg_version in sorted({110000, connection.pg_version}):
+            with mock.patch.object(connection, "pg_version", pg_version):
+                data_import = DataImport.objects.create(
+                    status=ImportStatus.replaced, data_file=DataFile.INVENTORY, file_checksum=str(pg_version)
+                )
+                data_import.create_partitions([Inventory])
+                Inventory.objects.create(
+                    source=data_import, item=dc.Item.gown, quantity=5, as_of=datetime(2020, 4, 12)
+                )
+                self.assertEqual(retention.prune_import(data_import), 1)
+                self.assertFalse(self.partition_exists(Inventory, data_import.id))
+                self.assertFalse(Inventory.objects.exists())
+
+    def test_failed_import_drops_partitions(self):
+        workbook = Workbook()
+        inventory = workbook.active
+        inventory.title = "Inventory Levels"
+        inventory.append(["Date", *inventory_from_facilities.sheet_columns])
+        inventory.append(["4/10/2020", *[10] * len(inventory_from_facilities.sheet_columns)])
+        deliveries = workbook.create_sheet("Facility Deliveries Summaries")
+        deliveries.append(
+            ["Date", "Facility Name or Network", "Facility Type", *hospital_deliveries.sheet_columns]
+        )
+        deliveries.append(
+            ["4/10/2020", "Generic Hospital", "Hospital", *[1] * len(hospital_deliveries.sheet_columns)]
+        )
+
+        partitions = self.partitions()
+        write_objects = data_import_module.write_objects
+
+        def fail_after_writing(*args, **kwargs):
+            write_objects(*args, **kwargs)
+            raise RuntimeError("disk full")
+
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as f, mock.patch.object(
+            data_import_module, "write_objects", fail_after_writing
+        ):
+            workbook.save(f.name)
+            # the import's own error, not one from cleaning up after it
+            with self.assertRaisesMessage(RuntimeError, "disk full"):
+                data_import_module.smart_import(Path(f.name), "testuser", datetime(2020, 4, 12).date())
+
+        self.assertFalse(DataImport.objects.exists())
+        self.assertEqual(self.partitions(), partitions)
+
+
+class TestImportApi(TestCase):
+    def setUp(self):
+        user = auth.get_user_model().objects.create_user(username="feed")
+        _, key = ApiToken.create(user, "test feed")
+        self.auth = dict(HTTP_AUTHORIZATION=f"Bearer {key}")
+
+    def test_requires_token(self):
+        response = self.client.post(reverse("api_imports"))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            reverse("api_imports"), HTTP_AUTHORIZATION="Bearer not-a-key"
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_import(self):
+        response = self.client.post(
+            reverse("api_imports"),
+            {
+                "file": SimpleUploadedFile(
+                    "demand.csv",
+                    b"Item,Demand,Week Start,Week End\nGowns,5,4/6/2020,4/12/2020\nBoots,5,4/6/2020,4/12/2020\n",
+                ),
+                "data_current": "2020-04-12",
+            },
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()["status_url"]
+        self.assertEqual(self.client.get(status_url, **self.auth).json()["status"], "queued")
+
+        call_command("import_worker", once=True, concurrency=1)
+        status = self.client.get(status_url, **self.auth).json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["rows_parsed"], 2)
+        self.assertEqual(status["import"]["status"], "candidate")
+        [warning] = status["import"]["warnings"]
+        self.assertEqual(warning["template"], "Unknown type: {}")
+        self.assertEqual(warning["messages"], ["Unknown type: Boots"])
+        self.assertEqual(warning["rows"], [3])
+        self.assertEqual(status["delta"]["candidate"]["Demand"], 2)
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+class TestQueryPlans(TestCase):
+    """
+    EXPLAINs every query the dashboards run against a seeded history of imports, and fails if any of them would
+    scan a table that grows with every import instead of looking its rows up in an index.
+    """
+
+    IMPORTS_PER_FILE = 5
+    # the tables that grow with every import
+    GROWING_TABLES = {
+        model._meta.db_table
+        for model in [
+            Purchase, ScheduledDelivery, Inventory, FacilityDelivery, Demand, ImportJob, ActiveDelivery
+        ]
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.today().date()
+        items = [dc.Item.gown, dc.Item.gloves, dc.Item.faceshield, dc.Item.n95_mask_surgical]
+
+        def imports(data_file):
+            for i in range(cls.IMPORTS_PER_FILE):
+                last = i == cls.IMPORTS_PER_FILE - 1
+                yield DataImport.objects.create(
+                    status=ImportStatus.active if last else ImportStatus.replaced,
+                    data_file=data_file,
+                    file_checksum=str(i),
+                )
+
+        for data_import in imports(DataFile.PPE_ORDERINGCHARTS_DATE_XLSX):
+            purchases = Purchase.objects.bulk_create(
+                Purchase(
+                    source=data_import,
+                    order_type=order_type,
+                    item=item,
+                    quantity=10,
+                    vendor="Vendor",
+                    donation_date=today,
+                )
+                for order_type in dc.OrderType
+                for item in items
+            )
+            ScheduledDelivery.objects.bulk_create(
+                ScheduledDelivery(
+                    source=data_import,
+                    purchase=purchase,
+                    delivery_date=today + timedelta(days=days),
+                    quantity=5,
+                )
+                for purchase in purchases
+                for days in range(-60, 60, 15)
+            )
+        for data_import in imports(DataFile.INVENTORY):
+            data_import.create_partitions([Inventory])
+            Inventory.objects.bulk_create(
+                Inventory(source=data_import, item=item, quantity=5, as_of=today - timedelta(days=days))
+                for item in items
+                for days in range(0, 30, 7)
+            )
+        for data_import in imports(DataFile.FACILITY_DELIVERIES):
+            facility = Facility.objects.create(
+                name="Hospital", tpe=dc.FacilityType.hospital, source=data_import
+            )
+            data_import.create_partitions([FacilityDelivery])
+            FacilityDelivery.objects.bulk_create(
+                FacilityDelivery(
+                    source=data_import,
+                    facility=facility,
+                    item=item,
+                    quantity=5,
+                    date=today - timedelta(days=days),
+                )
+                for item in items
+                for days in range(60)
+            )
+        for data_import in imports(DataFile.HOSPITAL_DEMANDS):
+            Demand.objects.bulk_create(
+                Demand(
+                    source=data_import,
+                    item=item,
+                    demand=5,
+                    start_date=today - timedelta(days=days + 6),
+                    end_date=today - timedelta(days=days),
+                )
+                for item in items
+                for days in range(0, 60, 7)
+            )
+        # bulk_create doesn't flag the active rows
+        for data_file in DataFile:
+            DataImport.sync_active_rows(data_file)
+        refresh_snapshots()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertIndexed(self, run, *indexes):
+        """
+        Every query `run` makes looks the imported data up through an index, and `indexes` are among those used
+        """
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        used = set()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE indexdef LIKE '% WHERE %'")
+            partial_indexes = {name for (name,) in cursor.fetchall()}
+            # the partitions of partitioned tables (and their indexes) are reported as the table (and index)
+            cursor.execute(
+                """
+                SELECT partition.relname, parent.relname FROM pg_inherits
+                JOIN pg_class partition ON partition.oid = inhrelid JOIN pg_class parent ON parent.oid = inhparent
+                """
+            )
+            parents = dict(cursor.fetchall())
+            # make scanning a table (or a whole index) prohibitively expensive, as it is in production, where the
+            # active imports are a small fraction of the history
+            for setting in ["enable_seqscan", "enable_mergejoin", "enable_hashjoin"]:
+                cursor.execute(f"SET LOCAL {setting} = off")
+            for query in queries.captured_queries:
+                if not query["sql"].startswith("SELECT"):
+                    continue
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query["sql"])
+                [[[plan]]] = cursor.fetchall()
+                for node in _plan_nodes(plan["Plan"]):
+                    for name in ["Relation Name", "Index Name"]:
+                        if name in node:
+                            node[name] = parents.get(node[name], node[name])
+                    used.add(node.get("Index Name"))
+                    if node.get("Relation Name") in self.GROWING_TABLES:
+                        # a bitmap heap scan is driven by (bitmap) index lookups below it, and a partial index only
+                        # holds the rows the query asked for
+                        self.assertTrue(
+                            "Index Cond" in node
+                            or node["Node Type"] == "Bitmap Heap Scan"
+                            or node.get("Index Name") in partial_indexes,
+                            f"{node['Node Type']} on {node['Relation Name']}:\n{query['sql']}",
+                        )
+        self.assertLessEqual(set(indexes), used)
+
+    def test_asset_rollup(self):
+        today = datetime.today().date()
+        self.assertIndexed(
+            lambda: aggregations.asset_rollup_legacy(today, today + timedelta(days=28)),
+            "activedelivery_date",
+            "facilitydelivery_active_date",
+        )
+
+    def test_drilldown(self):
+        today = datetime.today().date()
+        self.assertIndexed(
+            lambda: drilldown.drilldown_result(
+                dc.Item.gown, lambda item: item, AggColumn.all(), Period(today, today + timedelta(days=28))
+            )
+        )
+
+    def test_forecast(self):
+        # the queries of `optimization.generate_forecast_for_item`, which stops in the debugger
+        today = datetime.today().date()
+        self.assertIndexed(
+            lambda: (
+                Inventory.active().filter(item=dc.Item.gown).values_list("quantity", flat=True)[0],
+                list(
+                    ScheduledDelivery.active().filter(
+                        purchase__item=dc.Item.gown, delivery_date__gte=today
+                    )
+                ),
+            ),
+            "inventory_active_as_of",
+            "scheduleddelivery_active_date",
+        )
+
+    def test_import_queue(self):
+        self.assertIndexed(ImportJob.claim_next, "importjob_queue")
@@ -8,6 +8,18 @@ urlpatterns = [
     path("byweek", views.week_breakdown, name="breakdown"),
     path("forecast/supply", views.supply_forecast, name="supply_forecast"),
     path("upload/", views.Upload.as_view(), name="upload"),
+    path("upload/<int:job_id>/", views.UploadStatus.as_view(), name="upload_status"),
+    path(
+        "upload/<int:job_id>/progress",
+        views.UploadProgress.as_view(),
+        name="upload_progress",
+    ),
     path("verify/<str:import_id>/", views.Verify.as_view(), name="verify"),
     path("cancel/<str:import_id>/", views.CancelImport.as_view(), name="cancel"),
+    path("api/imports/", views.ImportApi.as_view(), name="api_imports"),
+    path(
+        "api/imports/<int:job_id>/",
+        views.ImportApiStatus.as_view(),
+        name="api_import_status",
+    ),
 ]
@@ -9,7 +9,9 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django_tables2 import RequestConfig
 
 import ppe.errors
@@ -19,7 +21,14 @@ from ppe.aggregations import DemandCalculationConfig, AggColumn
 from ppe.data_mapping.utils import parse_date, ErrorCollector
 from ppe.dataclasses import OrderType
 from ppe.drilldown import drilldown_result
-from ppe.models import DataImport, ScheduledDelivery
+from ppe.models import (
+    ApiToken,
+    DataImport,
+    ScheduledDelivery,
+    ImportJob,
+    ImportJobStatus,
+    ImportStatus,
+)
 from ppe.optimization import generate_forecast
 
 
@@ -229,6 +238,8 @@ class UploadContext(NamedTuple):
     form: Form = forms.UploadFileForm
     error: Optional[str] = None
     import_in_progress: Optional[str] = None
+    # of the failed import (see `ErrorCollector.report`)
+    error_report: Optional[dict] = None
 
 
 class Upload(LoginRequiredMixin, View):
@@ -236,46 +247,25 @@ class Upload(LoginRequiredMixin, View):
         return render(request, "upload.html", UploadContext()._asdict())
 
     def handle_upload_error(self, err: Exception) -> UploadContext:
-        try:
+        if settings.DEBUG and not isinstance(err, ppe.errors.DataImportError):
             raise err
-        except ppe.errors.ImportInProgressError as ex:
-            upload_context = UploadContext(
-                error="Import already in progress for this file type.",
-                import_in_progress=ex.import_id,
-            )
-        except ppe.errors.NoMappingForFileError as ex:
-            upload_context = UploadContext(
-                error="We were unable to find an existing mapping for this file."
-            )
-
-        except ppe.errors.SheetNameMismatch as ex:
-            upload_context = UploadContext(error=str(ex))
-        except ppe.errors.CsvImportError as ex:
-            upload_context = UploadContext(error=f"Error reading CSV file: {ex}.")
-        except ppe.errors.PartialFile as ex:
-            upload_context = UploadContext(error=str(ex))
-        except ppe.errors.ColumnNameMismatch as ex:
-            upload_context = UploadContext(error=str(ex))
-        except Exception as ex:
-            if settings.DEBUG:
-                raise
-            upload_context = UploadContext(
-                error=f"There was an unknown error importing the file. {ex}"
-            )
-
-        return upload_context
+        return UploadContext(
+            error=ppe.errors.describe_upload_error(err),
+            import_in_progress=getattr(err, "import_id", None),
+        )
 
     def post(self, request):
         form = forms.UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
             try:
-                import_obj = data_import.handle_upload(
+                job = data_import.enqueue_upload(
                     f=request.FILES["file"],
                     user=request.user,
                     current_as_of=form.data["data_current"],
+                    append=not form.cleaned_data["reimport_history"],
                 )
                 return HttpResponseRedirect(
-                    reverse("verify", kwargs={"import_id": import_obj.id})
+                    reverse("upload_status", kwargs={"job_id": job.id})
                 )
             except Exception as ex:
                 context = self.handle_upload_error(ex)
@@ -287,17 +277,160 @@ class Upload(LoginRequiredMixin, View):
             )
 
 
+class UploadStatus(LoginRequiredMixin, View):
+    """
+    Shows the progress of a queued upload until `manage.py import_worker` finishes it,
+    then sends the user on to verify it (or back to the upload form if it failed)
+    """
+
+    def get(self, request, job_id):
+        job = (
+            ImportJob.objects.defer("data").select_related("data_import").get(id=job_id)
+        )
+        if job.status == ImportJobStatus.done:
+            return HttpResponseRedirect(
+                reverse("verify", kwargs={"import_id": job.data_import_id})
+            )
+        elif job.status == ImportJobStatus.failed:
+            context = UploadContext(
+                error=job.error,
+                import_in_progress=job.import_in_progress,
+                error_report=job.error_report,
+            )
+            return render(request, "upload.html", context._asdict())
+        return render(request, "upload_status.html", dict(job=job))
+
+
+class UploadProgress(LoginRequiredMixin, View):
+    def get(self, request, job_id):
+        job = (
+            ImportJob.objects.defer("data").select_related("data_import").get(id=job_id)
+        )
+        return JsonResponse(job.progress())
+
+
+class ApiTokenRequiredMixin:
+    """
+    Authenticates API requests by their `Authorization: Bearer <key>` header (see
+    `ApiToken`) instead of a session, so they don't need a CSRF token either
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        user = ApiToken.authenticate(request.headers.get("Authorization", ""))
+        if user is None:
+            return JsonResponse({"error": "A valid API token is required"}, status=401)
+        request.user = user
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ImportApi(ApiTokenRequiredMixin, View):
+    """
+    Queues a file for import, like the upload form (and with the same fields). Poll the
+    returned status url to follow it.
+    """
+
+    def post(self, request):
+        form = forms.UploadFileForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return JsonResponse({"error": form.errors}, status=400)
+        job = data_import.enqueue_upload(
+            f=request.FILES["file"],
+            user=request.user,
+            current_as_of=form.cleaned_data["data_current"],
+            append=not form.cleaned_data["reimport_history"],
+        )
+        status_url = reverse("api_import_status", kwargs={"job_id": job.id})
+        return JsonResponse(
+            {"job_id": job.id, "status_url": request.build_absolute_uri(status_url)},
+            status=202,
+        )
+
+
+class ImportApiStatus(ApiTokenRequiredMixin, View):
+    def get(self, request, job_id):
+        job = (
+            ImportJob.objects.defer("data")
+            .select_related("data_import")
+            .filter(id=job_id)
+            .first()
+        )
+        if job is None:
+            return JsonResponse({"error": f"No import job {job_id}"}, status=404)
+
+        status = dict(job_id=job.id, **job.progress())
+        if job.status == ImportJobStatus.failed:
+            status["error_report"] = job.error_report
+        import_obj = job.data_import
+        if import_obj is not None:
+            status["import"] = dict(
+                id=import_obj.id,
+                status=import_obj.status,
+                verify_url=request.build_absolute_uri(
+                    reverse("verify", kwargs={"import_id": import_obj.id})
+                ),
+                **import_obj.error_report,
+            )
+            if (
+                job.status == ImportJobStatus.done
+                and import_obj.status == ImportStatus.candidate
+            ):
+                delta = import_obj.compute_delta()
+                status["delta"] = dict(
+                    previous_import_id=delta.previous.id if delta.previous else None,
+                    active=delta.active_stats,
+                    candidate=delta.candidate_stats,
+                    changes={
+                        diff.model: dict(
+                            added=diff.added, removed=diff.removed, changed=diff.changed
+                        )
+                        for diff in delta.diffs
+                    },
+                )
+        return JsonResponse(status)
+
+
+# seconds activating an import waits for an import of the same file type to finish,
+# before giving up
+VERIFY_LOCK_TIMEOUT = 5
+
+
+def _page(request) -> int:
+    # a hand-edited or truncated link shows the first page rather than failing
+    try:
+        return max(int(request.GET.get("page", 0)), 0)
+    except ValueError:
+        return 0
+
+
 class Verify(LoginRequiredMixin, View):
     def get(self, request, import_id):
         import_obj = DataImport.objects.get(id=import_id)
+        if import_obj.status == ImportStatus.active:
+            # re-upload of the file that is already live
+            return render(
+                request,
+                "verify_upload.html",
+                dict(import_id=import_id, already_active=import_obj),
+            )
         return render(
             request,
             "verify_upload.html",
-            dict(import_id=import_id, delta=import_obj.compute_delta()),
+            dict(
+                import_id=import_id,
+                delta=import_obj.compute_delta(page=_page(request)),
+                error_report=import_obj.error_report,
+            ),
         )
 
     def post(self, request, import_id):
-        data_import.finalize_import(DataImport.objects.get(id=import_id))
+        try:
+            data_import.finalize_import(
+                DataImport.objects.get(id=import_id), lock_timeout=VERIFY_LOCK_TIMEOUT
+            )
+        except (ppe.errors.DataFileBusy, ppe.errors.ImportNotCandidate) as ex:
+            context = UploadContext(error=ppe.errors.describe_upload_error(ex))
+            return render(request, "upload.html", context._asdict(), status=409)
         return HttpResponseRedirect(reverse("index"))
 
 
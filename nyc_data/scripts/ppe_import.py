@@ -1,37 +1,225 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import date
 from pathlib import Path
+from typing import NamedTuple
+
+from django.db import connections
 
 import ppe.errors
+import xlsx_utils
 from ppe import data_import
+from ppe.data_mapping.utils import ErrorCollector
+
+DRY_RUN = "dry-run"
+NO_APPEND = "no-append"
+
+
+class ParsedFile(NamedTuple):
+    mappings: list
+    checksum: str
+    parsed: list
+    seconds: float
+
+
+class FileSummary(NamedTuple):
+    file: Path
+    data_file: str = ""
+    rows: int = 0
+    written: int = 0
+    errors: int = 0
+    warnings: int = 0
+    parse_seconds: float = 0
+    write_seconds: float = 0
+    result: str = ""
+
+    def rows_per_second(self):
+        seconds = self.parse_seconds + self.write_seconds
+        return self.rows / seconds if seconds else 0
+
+
+def parse_file(path: Path) -> ParsedFile:
+    """
+    Everything about importing `path` that doesn't need the database, so it can run in a
+    worker process
+    """
+    start = time.perf_counter()
+    mappings = xlsx_utils.guess_mapping(path, data_import.MAPPING_INDEX)
+    if not mappings:
+        raise ppe.errors.NoMappingForFileError()
+    return ParsedFile(
+        mappings=mappings,
+        checksum=data_import.file_checksum(path),
+        # already in a worker: parse the sheets one after the other
+        parsed=[data_import.parse_sheet(path, mapping) for mapping in mappings],
+        seconds=time.perf_counter() - start,
+    )
+
+
+def in_order(fn, paths, workers: int):
+    """
+    Runs `fn` on every path in a pool of `workers` processes.
+    :return: iterator of (path, future of `fn(path)`), in the order of `paths`.
+    At most `2 * workers` results are held at once.
+    """
+    if workers == 1:
+        for path in paths:
+            future = Future()
+            try:
+                future.set_result(fn(path))
+            except Exception as ex:
+                future.set_exception(ex)
+            yield path, future
+        return
 
+    # the workers must not share the connection of this process
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append((path, pool.submit(fn, path)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
 
-def run(path=None):
-    if path is None:
-        private_data_dir = Path("../private-data")
-        xlsx_files = [
-            f for f in private_data_dir.iterdir() if f.suffix in {".xlsx", ".csv"}
-        ]
+
+def import_parsed(
+    path: Path, parsed_file: ParsedFile, append: bool = True
+) -> FileSummary:
+    start = time.perf_counter()
+    error_collector = ErrorCollector()
+    data_file = parsed_file.mappings[0].data_file
+    duplicate = data_import.find_duplicate_import(data_file, parsed_file.checksum)
+    import_obj = data_import.import_data(
+        path,
+        parsed_file.mappings,
+        current_as_of=date.today(),
+        uploaded_by="Uploaded via CLI",
+        overwrite_in_prog=True,
+        user_provided_filename=None,
+        checksum=parsed_file.checksum,
+        parsed=parsed_file.parsed,
+        error_collector=error_collector,
+        append=append,
+    )
+    data_import.finalize_import(import_obj)
+    return FileSummary(
+        file=path,
+        data_file=data_file.name,
+        rows=sum(len(sheet.rows) for sheet in parsed_file.parsed),
+        written=0 if duplicate else import_obj.rows_written,
+        errors=error_collector.error_count,
+        warnings=error_collector.warning_count,
+        parse_seconds=parsed_file.seconds,
+        write_seconds=time.perf_counter() - start,
+        result=f"{'already imported' if duplicate else 'imported'} as {import_obj.id}",
+    )
+
+
+def dry_run_parsed(path: Path, parsed_file: ParsedFile) -> FileSummary:
+    report = data_import.dry_run_import(
+        path, parsed_file.mappings, parsed=parsed_file.parsed
+    )
+    print(report.display())
+    report.error_collector.dump()
+    return FileSummary(
+        file=path,
+        data_file=report.data_file.name,
+        rows=report.rows,
+        written=sum(report.object_counts.values()),
+        errors=report.error_collector.error_count,
+        warnings=report.error_collector.warning_count,
+        parse_seconds=parsed_file.seconds,
+        write_seconds=report.seconds,
+        result="dry run",
+    )
+
+
+def print_summary(summaries, seconds: float):
+    columns = [
+        "file",
+        "data file",
+        "rows",
+        "objects",
+        "errors",
+        "warnings",
+        "parse s",
+        "write s",
+        "rows/s",
+    ]
+    width = max([len(str(s.file.name)) for s in summaries] + [len(columns[0])])
+    print(
+        f"{columns[0]:<{width}} {columns[1]:<28}"
+        + "".join(f"{c:>10}" for c in columns[2:])
+        + "  result"
+    )
+    for s in summaries:
+        print(
+            f"{s.file.name:<{width}} {s.data_file:<28}"
+            f"{s.rows:>10}{s.written:>10}{s.errors:>10}{s.warnings:>10}"
+            f"{s.parse_seconds:>10.2f}{s.write_seconds:>10.2f}"
+            f"{s.rows_per_second():>10.0f}  {s.result}"
+        )
+    rows = sum(s.rows for s in summaries)
+    print(
+        f"{len(summaries)} files, {rows} rows in {seconds:.1f}s "
+        f"({rows / seconds if seconds else 0:.0f} rows/s)"
+    )
+
+
+def run(*args):
+    """
+    `manage.py runscript ppe_import [--script-args [path] [dry-run] [no-append]]`
+
+    `path` is a file or a directory of them. Files are parsed in a pool of processes
+    (one per core), and imported one at a time in the order they were last modified, so
+    the most recent file of each kind ends up active.
+    With `dry-run`, files are only parsed and mapped, and a report of what they would
+    import is printed.
+    With `no-append`, every date of a time-series file is imported, not only those the
+    active import doesn't have (e.g. after earlier dates were corrected)
+    """
+    dry_run = DRY_RUN in args
+    append = NO_APPEND not in args
+    paths = [arg for arg in args if arg not in (DRY_RUN, NO_APPEND)]
+    path = Path(paths[0]) if paths else Path("../private-data")
+    if path.is_dir():
+        xlsx_files = [f for f in path.iterdir() if f.suffix in {".xlsx", ".csv"}]
     else:
-        xlsx_files = [Path(path)]
+        xlsx_files = [path]
+    xlsx_files.sort(key=lambda f: (f.stat().st_mtime, f.name))
 
-    print(f"Found {len(xlsx_files)} xlsx files in private-data")
-    for file in xlsx_files:
+    print(f"Found {len(xlsx_files)} xlsx files in {path}")
+    start = time.perf_counter()
+    workers = min(len(xlsx_files), os.cpu_count() or 1) or 1
+    summaries = []
+    for file, parsed_file in in_order(parse_file, xlsx_files, workers):
         try:
             print(f"---- Importing {file} ----")
-            import_obj = data_import.smart_import(
-                path=file,
-                uploader_name="Uploaded via CLI",
-                current_as_of=date.today(),
-                overwrite_in_prog=True,
-            )
-            data_import.finalize_import(import_obj)
+            if dry_run:
+                summaries.append(dry_run_parsed(file, parsed_file.result()))
+            else:
+                summaries.append(import_parsed(file, parsed_file.result(), append))
         except ppe.errors.NoMappingForFileError:
             print(f"{file} does not appear to be a format we recognize")
+            summaries.append(FileSummary(file, result="unrecognized format"))
         except ppe.errors.PartialFile:
             print(
                 f"{file} appears to have changed and does not match the format anymore"
             )
+            summaries.append(FileSummary(file, result="partial file"))
+        except Exception as ex:
+            print(f"Failed to import {file}: {ex!r}")
+            summaries.append(FileSummary(file, result=f"failed: {ex!r}"))
         finally:
             print(f"---- Import of {file} complete ----")
             print()
             print()
+
+    print_summary(summaries, time.perf_counter() - start)
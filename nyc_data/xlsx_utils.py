@@ -1,8 +1,10 @@
 import csv
 import json
 import re
+from decimal import Decimal
+from operator import itemgetter
 from pathlib import Path
-from typing import NamedTuple, Any, Callable, List, Optional, Set, Union
+from typing import NamedTuple, Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from django.core.serializers.json import DjangoJSONEncoder
 from fuzzywuzzy import process
@@ -10,7 +12,7 @@ from openpyxl import load_workbook
 
 from ppe import errors
 from ppe.data_mapping.types import DataFile
-from ppe.data_mapping.utils import ErrorCollector, parse_date
+from ppe.data_mapping.utils import ErrorCollector, parse_date, DateColumnParser
 from ppe.errors import ColumnNameMismatch
 
 
@@ -22,6 +24,15 @@ def XLSXDictReader(sheet, header_row_i):
         yield {header.value: rowcol.value for (header, rowcol) in zip(header_row, row)}
 
 
+def read_csv(csvfile):
+    """
+    Streams rows out of an open CSV file (closing it once exhausted), so callers that
+    only need the header don't read the whole file.
+    """
+    with csvfile:
+        yield from csv.DictReader(csvfile)
+
+
 class Mapping(NamedTuple):
     sheet_column_name: str
     obj_column_name: str
@@ -41,18 +52,19 @@ def ExactMatch(sheet_name: str):
 class RegexMatch:
     def __init__(self, patt, take_latest=True):
         self.patt = patt
+        self.regex = re.compile(patt)
         self.take_latest = take_latest
 
     def __repr__(self):
         return self.patt
 
     def __call__(self, names):
-        opts = [name for name in names if re.match(self.patt, name)]
+        opts = [name for name in names if self.regex.match(name)]
         if len(opts) == 1:
             return opts[0]
         if len(opts) > 1 and self.take_latest:
             date_strs = [
-                (opt, re.search(self.patt, opt).group(1)) for opt in opts
+                (opt, self.regex.search(opt).group(1)) for opt in opts
             ]  # [(opt, ('4-23',)), ...]
             parsed_dates = [
                 (opt, parse_date(date_str, ErrorCollector()))
@@ -65,6 +77,20 @@ class RegexMatch:
         return None
 
 
+class TimeSeries(NamedTuple):
+    """
+    Marks a sheet as a cumulative log: every version of the file repeats all prior dates
+    and adds new ones, so only dates that haven't been imported yet need to be (see
+    `data_import.import_data`).
+    """
+
+    # attribute of the sheet's `ImportedRow` holding the date of the row
+    row_date: str
+    # model the rows are stored as, and its date field
+    model: Any
+    model_date: str
+
+
 class SheetMapping(NamedTuple):
     data_file: DataFile
     sheet_name: Optional[Union[Callable[[List[str]], Optional[str]], str]]
@@ -72,16 +98,16 @@ class SheetMapping(NamedTuple):
     include_raw: bool
     obj_constructor: Optional[Callable[[Any], "ImportedRow"]]
     header_row_idx: int = 1
+    time_series: Optional[TimeSeries] = None
 
     def load_data(self, path: Path):
         if self.sheet_name is None:
             try:
-                with open(path, encoding="latin-1") as csvfile:
-                    text = csvfile.read()
+                csvfile = open(path, encoding="latin-1", newline="")
             except Exception as exc:
                 raise errors.CsvImportError("Error reading in CSV file") from exc
 
-            return csv.DictReader(text.splitlines())
+            return read_csv(csvfile)
         else:
             workbook = load_workbook(path, data_only=True, read_only=True)
             actual_sheet = self.can_import(workbook.sheetnames)
@@ -102,76 +128,271 @@ class SheetMapping(NamedTuple):
     def key_columns(self):
         return (mapping.sheet_column_name for mapping in self.mappings)
 
+    def column_procs(self):
+        """
+        Per-import instances of each mapping's `proc`. `parse_date` is swapped for a
+        `DateColumnParser` so every date column infers (and memoizes) its own format.
+        """
+        return {
+            mapping: DateColumnParser() if mapping.proc is parse_date else mapping.proc
+            for mapping in self.mappings
+        }
+
 
 RAW_DATA = "raw_data"
 
 
-def guess_mapping(sheet: Path, all_mappings: List[SheetMapping]):
+class MappingIndex:
+    """
+    What `guess_mapping` needs to know about a list of mappings, worked out once:
+    mappings by exact sheet name, the regex matched ones, the CSV ones, the columns each
+    requires, and how many sheets each kind of file has.
+    """
+
+    def __init__(self, all_mappings: List[SheetMapping]):
+        self.all_mappings = list(all_mappings)
+        # position in `all_mappings`, so matches come back in the same order
+        self.order = {id(m): i for i, m in enumerate(self.all_mappings)}
+        self.by_sheet_name: Dict[str, List[SheetMapping]] = {}
+        self.matched: List[SheetMapping] = []
+        self.csv: List[SheetMapping] = []
+        for m in self.all_mappings:
+            if isinstance(m.sheet_name, str):
+                self.by_sheet_name.setdefault(m.sheet_name, []).append(m)
+            elif m.sheet_name is None:
+                self.csv.append(m)
+            else:
+                self.matched.append(m)
+        self.columns = {
+            id(m): frozenset(mapping.sheet_column_name for mapping in m.mappings)
+            for m in self.all_mappings
+        }
+        self.sheets_per_data_file = {}
+        for m in self.all_mappings:
+            self.sheets_per_data_file.setdefault(m.data_file, []).append(m.sheet_name)
+        # only used for error hints
+        self.known_sheet_names = [
+            m.sheet_name if isinstance(m.sheet_name, str) else repr(m.sheet_name)
+            for m in self.all_mappings
+            if m.sheet_name is not None
+        ]
+
+    def sheet_mappings(self, sheet_names: List[str]) -> List[SheetMapping]:
+        matches = [m for name in sheet_names for m in self.by_sheet_name.get(name, [])]
+        matches += [m for m in self.matched if m.sheet_name(sheet_names) is not None]
+        return sorted(matches, key=lambda m: self.order[id(m)])
+
+    def has_columns(self, mapping: SheetMapping, header) -> bool:
+        return self.columns[id(mapping)].issubset(header)
+
+    def best_guess(self, sheet_names: List[str]):
+        """
+        The sheet of the workbook that looks the most like one we know, and that sheet
+        """
+        guesses = [
+            (name, process.extractOne(name, self.known_sheet_names))
+            for name in sheet_names
+        ]
+        name, (known, _) = max(guesses, key=lambda guess: guess[1][1])
+        return name, known
+
+
+def read_header(path: Path, encoding="latin-1") -> List[str]:
+    try:
+        with open(path, encoding=encoding, newline="") as csvfile:
+            return next(csv.reader(csvfile), [])
+    except Exception as exc:
+        raise errors.CsvImportError("Error reading in CSV file") from exc
+
+
+def guess_mapping(
+    sheet: Path, all_mappings: Union[MappingIndex, List[SheetMapping]]
+) -> Optional[List[SheetMapping]]:
+    """
+    The mappings to import `sheet` with: resolved from its sheet names and header rows,
+    reading the file once
+    """
+    index = (
+        all_mappings
+        if isinstance(all_mappings, MappingIndex)
+        else MappingIndex(all_mappings)
+    )
     if sheet.suffix == ".xlsx":
         workbook = load_workbook(sheet, data_only=True, read_only=True)
-        possible_mappings = [
-            m for m in all_mappings if m.can_import(workbook.sheetnames)
-        ]
-        if not possible_mappings:
-            known_sheetnames = [m.sheet_name for m in all_mappings]
-            matches = [
-                (us, process.extractOne(us, known_sheetnames))
-                for us in workbook.sheetnames
-            ]
-            raise errors.SheetNameMismatch(
-                workbook.sheetnames, (matches[0][0], matches[0][1][0])
-            )
-        else:
-            df = possible_mappings[0].data_file
+        try:
+            sheet_names = workbook.sheetnames
+            possible_mappings = index.sheet_mappings(sheet_names)
+            if not possible_mappings:
+                raise errors.SheetNameMismatch(
+                    sheet_names, index.best_guess(sheet_names)
+                )
 
-            if len([m for m in all_mappings if m.data_file == df]) != len(
-                possible_mappings
-            ):
-                expected = [m.sheet_name for m in all_mappings if m.data_file == df]
+            df = possible_mappings[0].data_file
+            if len(index.sheets_per_data_file[df]) != len(possible_mappings):
                 raise errors.PartialFile(
-                    expected_sheets=expected, actual_sheets=workbook.sheetnames
+                    expected_sheets=index.sheets_per_data_file[df],
+                    actual_sheets=sheet_names,
                 )
 
+            for mapping in possible_mappings:
+                header_row = workbook[mapping.can_import(sheet_names)][
+                    mapping.header_row_idx
+                ]
+                header = [cell.value for cell in header_row]
+                if not index.has_columns(mapping, header):
+                    raise ColumnNameMismatch(
+                        [m.sheet_column_name for m in mapping.mappings],
+                        [column for column in header if column is not None],
+                    )
+            return possible_mappings
+        finally:
+            workbook.close()
+
     elif sheet.suffix == ".csv":
-        possible_mappings = [m for m in all_mappings if m.sheet_name is None]
+        header = read_header(sheet)
+        return [m for m in index.csv if index.has_columns(m, header)] or None
     else:
         return []
-    final_mappings = []
 
-    for mapping in possible_mappings:
-        first_row = next(mapping.load_data(sheet))
 
-        col_names = [m.sheet_column_name for m in mapping.mappings]
-        if all(col_name in first_row for col_name in col_names):
-            final_mappings.append(mapping)
-        elif mapping.sheet_name is not None:
-            raise ColumnNameMismatch(col_names, first_row.keys())
+COLUMN_BATCH_SIZE = 1000
+NUMERIC_TYPES = {int, float, bool, Decimal}
+
+
+def map_rows(
+    rows: List[Dict[str, Any]],
+    row_numbers: List[int],
+    sheet_mapping: SheetMapping,
+    procs: Dict[Mapping, Callable],
+    error_collector: ErrorCollector,
+):
+    """
+    Applies each mapping's proc cell by cell.
+    :return: iterator of (row, mapped_row)
+    """
+    for row, row_number in zip(rows, row_numbers):
+        error_collector.row = row_number
+        mapped_row = {}
+        for mapping in sheet_mapping.mappings:
+            item = row[mapping.sheet_column_name]
+            proc = procs[mapping]
+            if proc:
+                item = proc(item, error_collector)
+            mapped_row[mapping.obj_column_name] = item
+        yield row, mapped_row
+
 
-    if final_mappings:
-        return final_mappings
+def map_columns(
+    rows: List[Dict[str, Any]],
+    row_numbers: List[int],
+    sheet_mapping: SheetMapping,
+    procs: Dict[Mapping, Callable],
+    memos: Dict[Mapping, Tuple[Dict[Any, Any], Dict[Any, ErrorCollector]]],
+    error_collector: ErrorCollector,
+):
+    """
+    Column-wise equivalent of `map_rows`. Each proc runs once per distinct value in its
+    column (memoized in `memos` across batches as `(results, errors)` keyed by value),
+    then results are mapped back onto the rows.
+
+    Errors reported while converting a value are replayed for every cell holding that
+    value, in row order, so `error_collector` ends up exactly as `map_rows` leaves it.
+    :return: iterator of (row, mapped_row)
+    """
+    names, columns, column_errors = [], [], []
+    for mapping in sheet_mapping.mappings:
+        values = list(map(itemgetter(mapping.sheet_column_name), rows))
+        proc = procs[mapping]
+        if proc:
+            results, errors = memos[mapping]
+            if NUMERIC_TYPES.isdisjoint(map(type, values)):
+                keys = values
+            else:
+                # 1, 1.0 and True are equal (and hash equal) but may convert differently
+                keys = list(zip(map(type, values), values))
+            for key, value in dict(zip(keys, values)).items():
+                if key in results:
+                    continue
+                value_errors = ErrorCollector()
+                results[key] = proc(value, value_errors)
+                if len(value_errors):
+                    errors[key] = value_errors
+            values = list(map(results.__getitem__, keys))
+            if errors:
+                column_errors.append((keys, errors))
+        names.append(mapping.obj_column_name)
+        columns.append(values)
+
+    for i, (row, cells) in enumerate(zip(rows, zip(*columns))):
+        if column_errors:
+            error_collector.row = row_numbers[i]
+        for keys, errors in column_errors:
+            value_errors = errors.get(keys[i])
+            if value_errors is not None:
+                error_collector.extend(value_errors)
+        yield row, dict(zip(names, cells))
 
 
 def import_xlsx(
     path: Path,
     sheet_mapping: SheetMapping,
     error_collector: ErrorCollector = lambda: ErrorCollector(),
+    columnar: bool = True,
 ):
-    as_dicts = list(sheet_mapping.load_data(path))
+    return (
+        obj
+        for _, obj in import_xlsx_numbered(
+            path, sheet_mapping, error_collector, columnar
+        )
+    )
 
-    for row in as_dicts:
-        mapped_row = {}
-        if all(row.get(col) is None for col in sheet_mapping.key_columns()):
-            continue
-        for mapping in sheet_mapping.mappings:
-            item = row[mapping.sheet_column_name]
-            if mapping.proc:
-                item = mapping.proc(item, error_collector)
-            mapped_row[mapping.obj_column_name] = item
 
+def import_xlsx_numbered(
+    path: Path,
+    sheet_mapping: SheetMapping,
+    error_collector: ErrorCollector,
+    columnar: bool = True,
+):
+    """
+    :return: iterator of (spreadsheet row number, mapped row)
+    """
+    as_dicts = sheet_mapping.load_data(path)
+    procs = sheet_mapping.column_procs()
+    memos = {mapping: ({}, {}) for mapping in sheet_mapping.mappings}
+
+    key_columns = list(sheet_mapping.key_columns())
+    # data starts on the row after the header (rows are numbered from 1)
+    numbered_rows = [
+        (row_number, row)
+        for row_number, row in enumerate(as_dicts, sheet_mapping.header_row_idx + 1)
+        if not all(row.get(col) is None for col in key_columns)
+    ]
+    row_numbers = [row_number for row_number, _ in numbered_rows]
+    rows = [row for _, row in numbered_rows]
+
+    if columnar:
+        batches = (
+            (
+                rows[start : start + COLUMN_BATCH_SIZE],
+                row_numbers[start : start + COLUMN_BATCH_SIZE],
+            )
+            for start in range(0, len(rows), COLUMN_BATCH_SIZE)
+        )
+        mapped_rows = (
+            mapped
+            for batch, batch_numbers in batches
+            for mapped in map_columns(
+                batch, batch_numbers, sheet_mapping, procs, memos, error_collector
+            )
+        )
+    else:
+        mapped_rows = map_rows(rows, row_numbers, sheet_mapping, procs, error_collector)
+
+    for row_number, (row, mapped_row) in zip(row_numbers, mapped_rows):
         if sheet_mapping.include_raw:
             # allow serialization of datetimes
             mapped_row[RAW_DATA] = json.dumps(row, cls=DjangoJSONEncoder)
         if sheet_mapping.obj_constructor:
-            yield sheet_mapping.obj_constructor(**mapped_row)
+            yield row_number, sheet_mapping.obj_constructor(**mapped_row)
         else:
-            yield mapped_row
+            yield row_number, mapped_row